@@ -0,0 +1,128 @@
+import re
+import threading
+
+# (intent, keyword groups) in priority order: a rule matches when every group has at least
+# one of its keywords in the message (plain substring match, case-insensitive). A keyword
+# negated just before it ("no change", "don't modify") doesn't count, so "modify_plan" can sit
+# before "satisfied" ("great, but change the timing") without catching "good, no change".
+INTENT_RULES = [
+    ("anxious", (("anxious", "stressed", "worried"),)),
+    ("academic_plan", (("academic planning", "academic journey", "subjects", "courses"),)),
+    ("goals", (("goals",), ("academic", "study"))),
+    ("create_plan", (("yes",), ("create", "plan", "proceed"))),
+    ("save_plan", (("save",), ("yes", "okay"))),
+    ("modify_plan", (("not satisfied", "change", "modify", "different"),)),
+    ("satisfied", (("satisfied", "good", "perfect", "great"),)),
+    ("subject_help", (("math", "mathematics", "english", "grammar", "science", "physics", "chemistry", "biology",
+                       "history", "geography", "economics", "computer", "programming"),)),
+]
+FALLBACK_INTENT = "chat"
+# A negator ending at most two words before the keyword, within the same clause
+NEGATION = re.compile(r"\b(?:no|not|never|without|don't|dont|do not|nothing to)\s+(?:[\w']+\s+){0,2}$")
+NEGATION_WINDOW = 40  # chars before a keyword searched for a negator
+
+# Replies that don't depend on the message or the profile: served as-is, no LLM call
+STATIC_REPLIES = {
+    "save_plan": """Excellent! I've saved your study plan to your Study Plan page.
+
+You can now:
+• Visit the Study Plan page to see your complete plan
+• Check off tasks as you complete them
+• Add new tasks or edit existing ones
+• Track your progress over time
+
+Your study plan is now ready to help you achieve your academic goals! 🎯""",
+    "satisfied": """Great! I'm glad you're satisfied with the study plan.
+
+Would you like me to save this study plan to your Study Plan page so you can track your progress and manage your tasks?
+
+Just say "Yes, save it" and I'll add it to your Study Plan page with actionable tasks you can check off as you complete them.""",
+    "modify_plan": """I understand you'd like some changes to the study plan.
+
+Please let me know what specific aspects you'd like me to modify:
+• Study schedule timing
+• Subject priorities
+• Study techniques
+• Time management approach
+• Or any other specific areas
+
+I'll create a revised plan that better meets your needs.""",
+}
+
+STUDY_PLAN_CREATED_REPLY = """Perfect! I've created a comprehensive study plan for you based on your academic profile and goals.
+
+Here's what I've included:
+• Analysis of your current performance
+• Personalized study schedule
+• Subject-wise focus areas
+• Time management strategies
+• Study techniques and exam preparation timeline
+
+Would you like me to save this study plan to your Study Plan page so you can track your progress and manage your tasks?
+
+Just say "Yes, save it" and I'll add it to your Study Plan page with actionable tasks you can check off as you complete them."""
+
+
+class IntentRouter:
+    """Classifies chat messages with one regex pass over the message.
+
+    All rule keywords are compiled into a single lookahead alternation, so one
+    scan finds every keyword occurrence, overlapping ones included (longest
+    first at each position; shorter keywords it starts with are implied).
+    Negated occurrences are dropped, then the rules are checked in order
+    against the keyword set. Hits per intent are counted for tuning the table.
+    """
+
+    def __init__(self, rules=INTENT_RULES, fallback=FALLBACK_INTENT):
+        self.rules = [(intent, [frozenset(group) for group in groups]) for intent, groups in rules]
+        self.fallback = fallback
+        keywords = sorted({k for _, groups in self.rules for group in groups for k in group}, key=len, reverse=True)
+        self.pattern = re.compile("(?=(" + "|".join(re.escape(k) for k in keywords) + "))")
+        # Only prefixes: keywords starting later inside a hit get their own match (and negation check)
+        self.implied = {k: frozenset(other for other in keywords if k.startswith(other)) for k in keywords}
+        self.lock = threading.Lock()
+        self.hits = {intent: 0 for intent, _ in self.rules}
+        self.hits[fallback] = 0
+        self.static_served = 0
+
+    def keywords_in(self, message):
+        text = (message or "").lower()
+        found = set()
+        for match in self.pattern.finditer(text):
+            start = match.start()
+            if NEGATION.search(text[max(0, start - NEGATION_WINDOW):start]):
+                continue
+            found |= self.implied[match.group(1)]
+        return found
+
+    def classify(self, message):
+        found = self.keywords_in(message)
+        intent = self.fallback
+        for name, groups in self.rules:
+            if all(group & found for group in groups):
+                intent = name
+                break
+        with self.lock:
+            self.hits[intent] += 1
+        return intent
+
+    def record_static(self):
+        with self.lock:
+            self.static_served += 1
+
+    def stats(self):
+        with self.lock:
+            hits = dict(self.hits)
+            static_served = self.static_served
+        total = sum(hits.values())
+        return {
+            "messages": total,
+            "static_served": static_served,
+            "intents": {
+                intent: {"hits": count, "share": round(count / total, 3) if total else None}
+                for intent, count in hits.items()
+            },
+        }
+
+
+chat_intents = IntentRouter()
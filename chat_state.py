@@ -0,0 +1,102 @@
+import os
+import copy
+import threading
+from datetime import datetime, timedelta
+from cachetools import TTLCache
+from pymongo import ReturnDocument
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CHAT_STATE_TTL_HOURS = int(os.getenv("CHAT_STATE_TTL_HOURS", "24"))  # Mongo tier; idle conversations expire
+CHAT_STATE_MAX_ENTRIES = int(os.getenv("CHAT_STATE_MAX_ENTRIES", "5000"))  # in-process tier
+# Short on purpose: a write made through another worker is only seen here once this copy expires
+# (reads that act on the state, like saving the draft, use get(fresh=True))
+CHAT_STATE_LOCAL_TTL_SECONDS = int(os.getenv("CHAT_STATE_LOCAL_TTL_SECONDS", "120"))
+
+DEFAULT_SESSION = "default"
+
+
+def chat_session_id(email, session_id=None):
+    return f"{email}:{session_id or DEFAULT_SESSION}"
+
+
+class ChatStateStore:
+    """Per-conversation state (e.g. the drafted study plan) keyed by (email, session).
+
+    Same two tiers as the other caches: an in-process TTL cache in front of a
+    Mongo TTL collection, so a later request of the conversation finds the
+    state whichever worker serves it. Every update refreshes the expiry.
+    """
+
+    def __init__(self, collection, maxsize=CHAT_STATE_MAX_ENTRIES, ttl=CHAT_STATE_LOCAL_TTL_SECONDS,
+                 shared_ttl_hours=CHAT_STATE_TTL_HOURS):
+        self.collection = collection
+        self.shared_ttl_hours = shared_ttl_hours
+        self.lock = threading.Lock()
+        self.local = TTLCache(maxsize, ttl)
+        self.counters = {"local_hits": 0, "shared_hits": 0, "misses": 0, "updates": 0, "shared_errors": 0}
+
+    def _count_shared_error(self):
+        with self.lock:
+            self.counters["shared_errors"] += 1
+
+    def get(self, email, session_id=None, fresh=False):
+        """A copy of the conversation's state fields, {} if there is none.
+        fresh=True skips the in-process copy, for reads that must see other workers' writes."""
+        key = chat_session_id(email, session_id)
+        with self.lock:
+            state = None if fresh else self.local.get(key)
+            if state is not None:
+                self.counters["local_hits"] += 1
+                return copy.deepcopy(state)
+        state = None
+        try:
+            doc = self.collection.find_one(
+                {"_id": key, "expiresAt": {"$gt": datetime.utcnow()}},
+                {"_id": 0, "state": 1}
+            )
+            state = doc.get("state") if doc else None
+        except Exception as e:
+            print(f"Chat state read failed for {key}: {e}")
+            self._count_shared_error()
+        with self.lock:
+            if state is None:
+                self.counters["misses"] += 1
+                return {}
+            self.counters["shared_hits"] += 1
+            self.local[key] = state
+        return copy.deepcopy(state)
+
+    def update(self, email, session_id=None, **fields):
+        """Set state fields; a field set to None is removed."""
+        key = chat_session_id(email, session_id)
+        now = datetime.utcnow()
+        changes = {"$set": {"email": email, "updatedAt": now, "expiresAt": now + timedelta(hours=self.shared_ttl_hours)}}
+        for name, value in fields.items():
+            if value is None:
+                changes.setdefault("$unset", {})[f"state.{name}"] = ""
+            else:
+                changes["$set"][f"state.{name}"] = value
+        with self.lock:
+            self.local.pop(key, None)
+            self.counters["updates"] += 1
+        try:
+            doc = self.collection.find_one_and_update(
+                {"_id": key}, changes, projection={"_id": 0, "state": 1},
+                upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            print(f"Chat state write failed for {key}: {e}")
+            self._count_shared_error()
+            return False
+        with self.lock:
+            # The merged state Mongo returned, so this worker's next read needs no round trip
+            self.local[key] = (doc or {}).get("state") or {}
+        return True
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.local)
+        return dict(counters, local_size=size)
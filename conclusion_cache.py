@@ -0,0 +1,170 @@
+import os
+import copy
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+CONCLUSION_CACHE_ENABLED = os.getenv("CONCLUSION_CACHE_ENABLED", "1") == "1"
+CONCLUSION_CACHE_BUCKET_PCT = int(os.getenv("CONCLUSION_CACHE_BUCKET_PCT", "10"))  # width of a score bucket
+CONCLUSION_CACHE_MAX_ENTRIES = int(os.getenv("CONCLUSION_CACHE_MAX_ENTRIES", "2000"))  # in-process tier
+CONCLUSION_CACHE_TTL_SECONDS = int(os.getenv("CONCLUSION_CACHE_TTL_SECONDS", "3600"))  # in-process tier
+CONCLUSION_CACHE_SHARED_TTL_DAYS = int(os.getenv("CONCLUSION_CACHE_SHARED_TTL_DAYS", "30"))  # Mongo tier
+
+# Bump when the template prompt changes so old templates stop matching
+TEMPLATE_VERSION = 1
+
+NAME_PLACEHOLDER = "{{name}}"
+STREAM_PLACEHOLDER = "{{stream}}"
+
+PREMIER_INSTITUTES = ("iit", "nit", "iiit", "bits", "iim", "aiims", "nid", "nift")
+
+
+def institute_type(user):
+    """Coarse institute facet: the only part of the institute that shapes an analysis."""
+    if user.get("studentType") == "school":
+        return "school"
+    words = set((user.get("institute") or "").lower().replace(",", " ").replace(".", " ").split())
+    if words & set(PREMIER_INSTITUTES):
+        return "premier"
+    if "university" in words:
+        return "university"
+    if words:
+        return "college"
+    return "unknown"
+
+
+def student_segment(user):
+    """(studentType, class, major, institute type), normalized so spelling variants share templates."""
+    def norm(value):
+        return " ".join(str(value or "").lower().split())
+    return {
+        "studentType": norm(user.get("studentType")),
+        "class": norm(user.get("class")),
+        "major": norm(user.get("major")),
+        "instituteType": institute_type(user),
+    }
+
+
+def score_buckets(trait_scores, max_possible, width=CONCLUSION_CACHE_BUCKET_PCT):
+    """Lower bound (in %) of the bucket each trait's share of max_possible falls into."""
+    buckets = {}
+    for trait, score in sorted(trait_scores.items()):
+        pct = min(max(score / max_possible * 100, 0), 100) if max_possible else 0
+        buckets[trait] = min(int(pct // width) * width, 100 - width)
+    return buckets
+
+
+def template_key(segment, buckets):
+    raw = json.dumps({"v": TEMPLATE_VERSION, "segment": segment, "buckets": buckets}, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def personalize(template, user):
+    """Fill the name/stream placeholders of a cached analysis for one student."""
+    replacements = {
+        NAME_PLACEHOLDER: user.get("name") or "Student",
+        STREAM_PLACEHOLDER: user.get("major") or user.get("class") or "your stream",
+    }
+
+    def fill(value):
+        if isinstance(value, str):
+            for placeholder, text in replacements.items():
+                value = value.replace(placeholder, str(text))
+            return value
+        if isinstance(value, list):
+            return [fill(v) for v in value]
+        if isinstance(value, dict):
+            return {k: fill(v) for k, v in value.items()}
+        return value
+
+    return fill(copy.deepcopy(template))
+
+
+class ConclusionTemplateCache:
+    """Base quiz analyses per (student segment, quantized trait scores).
+
+    Templates are generated without personal details (placeholders stand in
+    for name and stream), so every student in the same segment whose scores
+    fall into the same buckets can be served one after personalize(). Same two
+    tiers as the LLM response cache: an in-process TTL cache in front of a
+    Mongo TTL collection shared by all workers.
+    """
+
+    def __init__(self, collection=None, maxsize=CONCLUSION_CACHE_MAX_ENTRIES, ttl=CONCLUSION_CACHE_TTL_SECONDS,
+                 shared_ttl_days=CONCLUSION_CACHE_SHARED_TTL_DAYS, enabled=CONCLUSION_CACHE_ENABLED):
+        self.collection = collection
+        self.shared_ttl_days = shared_ttl_days
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.local = TTLCache(maxsize, ttl)
+        self.counters = {"local_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0, "shared_errors": 0}
+
+    def _count_shared_error(self):
+        with self.lock:
+            self.counters["shared_errors"] += 1
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            template = self.local.get(key)
+            if template is not None:
+                self.counters["local_hits"] += 1
+                return template
+        template = None
+        if self.collection is not None:
+            try:
+                doc = self.collection.find_one(
+                    {"_id": key, "expiresAt": {"$gt": datetime.utcnow()}},
+                    {"template": 1}
+                )
+                template = doc["template"] if doc else None
+            except Exception as e:
+                print(f"Conclusion cache shared tier read failed: {e}")
+                self._count_shared_error()
+        with self.lock:
+            if template is None:
+                self.counters["misses"] += 1
+            else:
+                self.counters["shared_hits"] += 1
+                self.local[key] = template
+        return template
+
+    def set(self, key, template, segment=None, buckets=None):
+        if not self.enabled or not template:
+            return
+        with self.lock:
+            self.local[key] = template
+            self.counters["stores"] += 1
+        if self.collection is None:
+            return
+        try:
+            now = datetime.utcnow()
+            self.collection.replace_one(
+                {"_id": key},
+                {"segment": segment, "buckets": buckets, "template": template, "version": TEMPLATE_VERSION,
+                 "createdAt": now, "expiresAt": now + timedelta(days=self.shared_ttl_days)},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"Conclusion cache shared tier write failed: {e}")
+            self._count_shared_error()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.local)
+        lookups = counters["local_hits"] + counters["shared_hits"] + counters["misses"]
+        hits = counters["local_hits"] + counters["shared_hits"]
+        return dict(
+            counters,
+            enabled=self.enabled,
+            bucket_pct=CONCLUSION_CACHE_BUCKET_PCT,
+            local_size=size,
+            hit_rate=round(hits / lookups, 3) if lookups else None,
+        )
@@ -1,11 +1,155 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
 from dotenv import load_dotenv
 import os
+import threading
 
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
-client = MongoClient(MONGO_URI)
+if not MONGO_URI:
+    raise EnvironmentError("MONGO_URI not found. Check your .env file or os.environ.")
 
-db = client["carevo"]  # name your DB here
+# Database name defaults to the one in MONGO_URI, then "carevo"
+MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
+
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "100"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", "300000"))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", "10000"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "5000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "30000"))
+MONGO_COMPRESSORS = os.getenv("MONGO_COMPRESSORS", "zstd,snappy,zlib")
+
+
+def available_compressors(names):
+    # pymongo warns on every start about compressors whose module is missing, so drop them here
+    available = []
+    for name in (n.strip() for n in names.split(",")):
+        try:
+            if name == "zstd":
+                import zstandard  # noqa: F401
+            elif name == "snappy":
+                import snappy  # noqa: F401
+            elif name != "zlib":
+                continue
+        except ImportError:
+            continue
+        available.append(name)
+    return available
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters per server, fed by pymongo's CMAP events."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.servers = {}
+
+    def _server(self, address):
+        key = f"{address[0]}:{address[1]}"
+        if key not in self.servers:
+            self.servers[key] = {
+                "checked_out": 0, "max_checked_out": 0, "checkouts": 0, "checkout_failures": 0,
+                "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+                "connections_open": 0, "connections_created": 0, "pool_cleared": 0,
+            }
+        return self.servers[key]
+
+    def _record_wait(self, server, duration):
+        wait_ms = (duration or 0) * 1000
+        server["wait_ms_total"] += wait_ms
+        server["wait_ms_max"] = max(server["wait_ms_max"], wait_ms)
+
+    def connection_checked_out(self, event):
+        with self.lock:
+            server = self._server(event.address)
+            server["checked_out"] += 1
+            server["checkouts"] += 1
+            server["max_checked_out"] = max(server["max_checked_out"], server["checked_out"])
+            self._record_wait(server, event.duration)
+
+    def connection_check_out_failed(self, event):
+        with self.lock:
+            server = self._server(event.address)
+            server["checkout_failures"] += 1
+            self._record_wait(server, event.duration)
+
+    def connection_checked_in(self, event):
+        with self.lock:
+            self._server(event.address)["checked_out"] -= 1
+
+    def connection_created(self, event):
+        with self.lock:
+            server = self._server(event.address)
+            server["connections_open"] += 1
+            server["connections_created"] += 1
+
+    def connection_closed(self, event):
+        with self.lock:
+            self._server(event.address)["connections_open"] -= 1
+
+    def pool_cleared(self, event):
+        with self.lock:
+            self._server(event.address)["pool_cleared"] += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def snapshot(self):
+        with self.lock:
+            servers = {}
+            for address, stats in self.servers.items():
+                avg = stats["wait_ms_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+                servers[address] = dict(stats, wait_ms_avg=round(avg, 3))
+        return servers
+
+
+pool_metrics = PoolMetrics()
+enabled_compressors = available_compressors(MONGO_COMPRESSORS)
+
+# The one MongoClient for the whole process; main.py and every helper module share its pool
+client = MongoClient(
+    MONGO_URI,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    compressors=enabled_compressors,
+    event_listeners=[pool_metrics],
+)
+
+db = client[MONGO_DB_NAME] if MONGO_DB_NAME else client.get_default_database(default="carevo")
 users_collection = db["users"]
+
+
+def pool_diagnostics():
+    return {
+        "config": {
+            "maxPoolSize": MONGO_MAX_POOL_SIZE,
+            "minPoolSize": MONGO_MIN_POOL_SIZE,
+            "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+            "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+            "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+            "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+            "compressors": enabled_compressors,
+        },
+        "database": db.name,
+        "servers": pool_metrics.snapshot(),
+    }
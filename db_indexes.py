@@ -0,0 +1,207 @@
+import os
+import sys
+from datetime import datetime
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, PyMongoError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Expired quizzes are deleted this long after expiresAt, so a quiz that is
+# still open in a browser can be submitted for a while after it stops being served.
+# Only quizzes marked disposable expire: the reference student's quizzes and quizzes
+# with submissions (which /quiz/score-batch re-scores) are kept.
+QUIZ_EXPIRY_GRACE_SECONDS = int(os.getenv("QUIZ_EXPIRY_GRACE_SECONDS", str(2 * 24 * 3600)))
+
+INDEX_OPTIONS_CONFLICT = 85
+
+DISPOSABLE_BACKFILL = "quizzes_disposable_backfill"  # migrations marker
+DISPOSABLE_BACKFILL_BATCH = int(os.getenv("DISPOSABLE_BACKFILL_BATCH", "500"))
+
+# (collection, keys, options) - names are fixed so re-running is a no-op
+INDEXES = [
+    ("users", [("email", ASCENDING)], {"name": "email_unique", "unique": True}),
+
+    ("quizzes", [("studentId", ASCENDING), ("expiresAt", ASCENDING)], {"name": "studentId_expiresAt"}),
+    ("quizzes", [("studentId", ASCENDING), ("createdAt", DESCENDING)], {"name": "studentId_createdAt"}),
+    ("quizzes", [("quizId", ASCENDING)], {"name": "quizId_unique", "unique": True}),
+    ("quizzes", [("expiresAt", ASCENDING)], {"name": "expiresAt_ttl_disposable", "expireAfterSeconds": QUIZ_EXPIRY_GRACE_SECONDS,
+                                             "partialFilterExpression": {"disposable": True}}),
+
+    ("quiz_results", [("studentId", ASCENDING), ("createdAt", DESCENDING)], {"name": "studentId_createdAt"}),
+    ("quiz_results", [("resultId", ASCENDING)], {"name": "resultId_unique", "unique": True, "sparse": True}),
+    ("quiz_answers", [("quizId", ASCENDING), ("studentId", ASCENDING)], {"name": "quizId_studentId"}),
+    ("quiz_answers", [("resultId", ASCENDING)], {"name": "resultId_unique", "unique": True, "sparse": True}),
+
+    ("llm_cache", [("expiresAt", ASCENDING)], {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+
+    ("quiz_jobs", [("activeKey", ASCENDING)], {"name": "activeKey_unique", "unique": True, "sparse": True}),
+    ("quiz_jobs", [("status", ASCENDING), ("priority", DESCENDING), ("createdAt", ASCENDING)],
+     {"name": "status_priority_createdAt"}),
+    ("quiz_jobs", [("expiresAt", ASCENDING)], {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+
+    ("quiz_pool", [("segment", ASCENDING), ("createdAt", ASCENDING)], {"name": "segment_createdAt"}),
+    ("quiz_pool_segments", [("lastRequestedAt", ASCENDING)], {"name": "lastRequestedAt"}),
+
+    ("llm_quota", [("provider", ASCENDING), ("minute", ASCENDING)], {"name": "provider_minute"}),
+    ("llm_quota", [("expiresAt", ASCENDING)], {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+
+    ("llm_leases", [("expiresAt", ASCENDING)], {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+    ("conclusion_templates", [("expiresAt", ASCENDING)], {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+    ("chat_state", [("expiresAt", ASCENDING)], {"name": "expiresAt_ttl", "expireAfterSeconds": 0}),
+]
+
+# Replaced indexes, dropped on startup: (collection, name)
+OBSOLETE_INDEXES = [
+    ("quizzes", "expiresAt_ttl"),  # expired every quiz, answered or not
+    ("quiz_jobs", "status_createdAt"),  # replaced by status_priority_createdAt
+]
+
+
+def ensure_indexes(db):
+    """Create every index the app relies on. Safe to run on each startup."""
+    created = []
+    try:
+        for collection, name in OBSOLETE_INDEXES:
+            try:
+                if name in db[collection].index_information():
+                    db[collection].drop_index(name)
+                    print(f"Dropped obsolete index {collection}.{name}")
+            except OperationFailure as e:
+                print(f"WARNING: could not drop obsolete index {collection}.{name}: {e}")
+        for collection, keys, options in INDEXES:
+            try:
+                db[collection].create_index(keys, **options)
+                created.append(f"{collection}.{options['name']}")
+            except OperationFailure as e:
+                if e.code == INDEX_OPTIONS_CONFLICT and "expireAfterSeconds" in options:
+                    # TTL changed through the environment: update it in place
+                    try:
+                        db.command("collMod", collection, index={
+                            "name": options["name"],
+                            "expireAfterSeconds": options["expireAfterSeconds"],
+                        })
+                        created.append(f"{collection}.{options['name']}")
+                    except PyMongoError as mod_error:
+                        print(f"WARNING: could not update TTL of {collection}.{options['name']}: {mod_error}")
+                else:
+                    print(f"WARNING: could not create index {collection}.{options['name']}: {e}")
+    except PyMongoError as e:
+        print(f"WARNING: index bootstrap stopped early: {e}")
+    print(f"Mongo indexes ensured: {len(created)}/{len(INDEXES)}")
+    return created
+
+
+def backfill_disposable_quizzes(db, reference_student_id, batch_size=DISPOSABLE_BACKFILL_BATCH):
+    """One-time: mark quizzes stored before the "disposable" flag, so the partial TTL index
+    expires the unanswered ones too. Idempotent; a marker in `migrations` skips it afterwards."""
+    if db.migrations.find_one({"_id": DISPOSABLE_BACKFILL}):
+        return 0
+    marked = 0
+    try:
+        cursor = db.quizzes.find(
+            {"disposable": {"$exists": False}, "studentId": {"$ne": reference_student_id}},
+            {"quizId": 1}
+        )
+        batch = []
+        for doc in cursor:
+            batch.append(doc["quizId"])
+            if len(batch) >= batch_size:
+                marked += _mark_unanswered(db, batch)
+                batch = []
+        if batch:
+            marked += _mark_unanswered(db, batch)
+        db.migrations.update_one({"_id": DISPOSABLE_BACKFILL}, {"$set": {"doneAt": datetime.utcnow(), "marked": marked}},
+                                 upsert=True)
+    except PyMongoError as e:
+        print(f"WARNING: disposable quiz backfill stopped early, retried on next startup: {e}")
+    print(f"Quizzes marked disposable by backfill: {marked}")
+    return marked
+
+
+def _mark_unanswered(db, quiz_ids):
+    answered = set(db.quiz_answers.distinct("quizId", {"quizId": {"$in": quiz_ids}}))
+    unanswered = [q for q in quiz_ids if q not in answered]
+    if not unanswered:
+        return 0
+    result = db.quizzes.update_many(
+        {"quizId": {"$in": unanswered}, "disposable": {"$exists": False}},
+        {"$set": {"disposable": True}}
+    )
+    # A sheet submitted meanwhile: unmark its quiz again, as record_quiz_submission does
+    answered_since = db.quiz_answers.distinct("quizId", {"quizId": {"$in": unanswered}})
+    if answered_since:
+        db.quizzes.update_many({"quizId": {"$in": answered_since}}, {"$unset": {"disposable": ""}})
+    return result.modified_count
+
+
+def query_shapes(now=None):
+    """The hot queries the app issues, used by the explain report."""
+    now = now or datetime.utcnow()
+    return [
+        ("user by email", "users", {"email": "student@example.com"}, None),
+        ("active quiz for student", "quizzes", {"studentId": "student@example.com", "expiresAt": {"$gt": now}}, None),
+        ("quiz by id", "quizzes", {"quizId": "quiz-id", "studentId": "student@example.com"}, None),
+        ("latest quiz for student", "quizzes", {"studentId": "student@example.com"}, [("createdAt", DESCENDING)]),
+        ("latest result for student", "quiz_results", {"studentId": "student@example.com"}, [("createdAt", DESCENDING)]),
+        ("quiz result by id", "quiz_results", {"resultId": "result-id"}, None),
+        ("answers for quiz", "quiz_answers", {"quizId": "quiz-id"}, None),
+        ("next queued job", "quiz_jobs", {"status": "queued"}, [("priority", DESCENDING), ("createdAt", ASCENDING)]),
+        ("pooled quiz for segment", "quiz_pool", {"segment": "college|general"}, [("createdAt", ASCENDING)]),
+        ("key quota this minute", "llm_quota", {"provider": "gemini", "minute": now.replace(second=0, microsecond=0)}, None),
+    ]
+
+
+def _plan_stages(plan, stages, index_names):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan:
+            index_names.append(plan["indexName"])
+        for value in plan.values():
+            _plan_stages(value, stages, index_names)
+    elif isinstance(plan, list):
+        for value in plan:
+            _plan_stages(value, stages, index_names)
+
+
+def index_report(db):
+    """Explain each hot query and flag the ones that fall back to a collection scan."""
+    report = []
+    for name, collection, query, sort in query_shapes():
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explain = cursor.explain()
+        except OperationFailure as e:
+            report.append({"query": name, "collection": collection, "error": str(e)})
+            continue
+        stages, index_names = [], []
+        _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}), stages, index_names)
+        report.append({
+            "query": name,
+            "collection": collection,
+            "stages": stages,
+            "indexes": index_names,
+            "collectionScan": "COLLSCAN" in stages,
+            "inMemorySort": "SORT" in stages,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    # python db_indexes.py           -> create indexes
+    # python db_indexes.py --report  -> explain hot queries and flag collection scans
+    from database import db as database
+    if "--report" in sys.argv:
+        flagged = 0
+        for row in index_report(database):
+            if "error" in row:
+                print(f"?? {row['collection']}: {row['query']} ({row['error']})")
+                continue
+            flag = "COLLSCAN" if row["collectionScan"] else "ok"
+            flagged += row["collectionScan"]
+            print(f"{flag:>8}  {row['collection']}: {row['query']} -> {', '.join(row['stages'])}")
+        sys.exit(1 if flagged else 0)
+    ensure_indexes(database)
@@ -1,16 +1,202 @@
 import os
+import re
 import time
+import threading
 from dotenv import load_dotenv
+from quota_ledger import QuotaLedger, quota_backend, current_minute
 
 load_dotenv()  # <-- Ensure .env is loaded before reading keys
 
-GEMINI_KEYS = os.getenv("GEMINI_API_KEYS", "").split(",")
-DELAY_MINUTES = int(os.getenv("GEMINI_KEY_DELAY_MINUTES", "10"))
-if not GEMINI_KEYS or GEMINI_KEYS == [""]:
+GEMINI_KEYS = [k.strip() for k in os.getenv("GEMINI_API_KEYS", "").split(",") if k.strip()]
+if not GEMINI_KEYS:
     raise Exception("No Gemini API keys found in .env")
 
+GEMINI_KEY_RPM = float(os.getenv("GEMINI_KEY_RPM", "60"))  # refill rate of each key's token bucket
+GEMINI_KEY_BURST = float(os.getenv("GEMINI_KEY_BURST", "10"))  # bucket size
+GEMINI_KEY_MAX_IN_FLIGHT = int(os.getenv("GEMINI_KEY_MAX_IN_FLIGHT", "8"))
+GEMINI_KEY_COOLDOWN_SECONDS = float(os.getenv("GEMINI_KEY_COOLDOWN_SECONDS", "30"))  # after a 429, doubled per repeat
+GEMINI_KEY_ERROR_COOLDOWN_SECONDS = float(os.getenv("GEMINI_KEY_ERROR_COOLDOWN_SECONDS", "5"))  # after a 5xx
+GEMINI_KEY_MAX_COOLDOWN_SECONDS = float(os.getenv("GEMINI_KEY_MAX_COOLDOWN_SECONDS", "300"))
+GEMINI_KEY_WAIT_SECONDS = float(os.getenv("GEMINI_KEY_WAIT_SECONDS", "10"))  # how long acquire waits for a free key
+# Per-key quota summed over all workers (shared ledger); 0 = not enforced
+GEMINI_QUOTA_RPM = int(os.getenv("GEMINI_QUOTA_RPM", str(int(GEMINI_KEY_RPM))))
+GEMINI_QUOTA_TPM = int(os.getenv("GEMINI_QUOTA_TPM", "0"))
+
+
+def mask_key(key):
+    return f"...{key[-4:]}" if len(key) > 4 else "..."
+
+
+def retry_after_seconds(resp):
+    """Seconds the API asked us to back off for: Retry-After header or the RetryInfo detail Gemini puts in 429 bodies."""
+    header = resp.headers.get("Retry-After")
+    if header:
+        try:
+            return float(header)
+        except ValueError:
+            pass
+    match = re.search(r'"retryDelay"\s*:\s*"(\d+(?:\.\d+)?)s"', resp.text or "")
+    return float(match.group(1)) if match else None
+
+
+class KeyLease:
+    def __init__(self, key):
+        self.key = key
+        self.acquired_at = time.time()
+        self.released = False
+
+
+class GeminiKeyScheduler:
+    """Hands out Gemini API keys by load instead of by clock.
+
+    Each key has a token bucket (GEMINI_KEY_RPM, GEMINI_KEY_BURST), an in-flight
+    count and a cooldown that 429 and 5xx responses put it into. acquire() picks
+    the least-loaded usable key, round-robin among equals, so throughput grows
+    with the number of keys. Every lease must be handed back through release().
+    With a `ledger`, keys other workers have used up for this minute are skipped too.
+    """
+
+    def __init__(self, keys, rpm=GEMINI_KEY_RPM, burst=GEMINI_KEY_BURST, max_in_flight=GEMINI_KEY_MAX_IN_FLIGHT,
+                 ledger=None):
+        self.ledger = ledger
+        self.rpm = rpm
+        self.burst = burst
+        self.max_in_flight = max_in_flight
+        self.condition = threading.Condition()
+        self.next_index = 0
+        now = time.time()
+        self.keys = list(keys)
+        self.state = {
+            key: {
+                "tokens": burst, "refilled_at": now, "in_flight": 0, "cooldown_until": 0.0, "strikes": 0,
+                "requests": 0, "throttled": 0, "errors": 0,
+            }
+            for key in self.keys
+        }
+
+    def _refill(self, state, now):
+        if self.rpm <= 0:
+            state["tokens"] = self.burst
+            return
+        state["tokens"] = min(self.burst, state["tokens"] + (now - state["refilled_at"]) * self.rpm / 60)
+        state["refilled_at"] = now
+
+    def _pick(self, now, count_in_flight):
+        best = None
+        for offset in range(len(self.keys)):
+            key = self.keys[(self.next_index + offset) % len(self.keys)]
+            state = self.state[key]
+            self._refill(state, now)
+            if state["cooldown_until"] > now or state["tokens"] < 1:
+                continue
+            if self.ledger and self.ledger.is_exhausted(key, now):
+                continue
+            if count_in_flight and state["in_flight"] >= self.max_in_flight:
+                continue
+            # Fewest calls in flight first, then the fullest bucket; ties keep round-robin order
+            load = (state["in_flight"], -state["tokens"])
+            if best is None or load < best[0]:
+                best = (load, key)
+        if best is None:
+            return None
+        key = best[1]
+        self.next_index = (self.keys.index(key) + 1) % len(self.keys)
+        state = self.state[key]
+        state["tokens"] -= 1
+        state["requests"] += 1
+        if count_in_flight:
+            state["in_flight"] += 1
+        if self.ledger:
+            self.ledger.record(key, requests=1)
+        return key
+
+    def _next_ready_in(self, now):
+        waits = []
+        for key, state in self.state.items():
+            wait = max(state["cooldown_until"] - now, 0)
+            if state["tokens"] < 1 and self.rpm > 0:
+                wait = max(wait, (1 - state["tokens"]) * 60 / self.rpm)
+            if self.ledger and self.ledger.is_exhausted(key, now):
+                wait = max(wait, current_minute(now) + 60 - now)
+            waits.append(wait)
+        return min(waits) if waits else None
+
+    def acquire(self, timeout=GEMINI_KEY_WAIT_SECONDS):
+        """Lease the best available key, waiting up to `timeout` seconds for one; None if none frees up."""
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                now = time.time()
+                key = self._pick(now, count_in_flight=True)
+                if key:
+                    return KeyLease(key)
+                remaining = deadline - now
+                if remaining <= 0:
+                    return None
+                # Woken early by release(); otherwise sleep until a bucket refills or a cooldown ends
+                ready_in = self._next_ready_in(now)
+                self.condition.wait(min(remaining, ready_in if ready_in else remaining))
+
+    def release(self, lease, status_code=None, retry_after=None, error=False, tokens=0):
+        """Return a leased key with the outcome of the call that used it (and the tokens it spent, if known)."""
+        with self.condition:
+            if lease.released:
+                return
+            lease.released = True
+            if self.ledger and tokens:
+                self.ledger.record(lease.key, tokens=tokens)
+            state = self.state[lease.key]
+            state["in_flight"] -= 1
+            now = time.time()
+            if status_code == 429:
+                state["strikes"] += 1
+                state["throttled"] += 1
+                backoff = GEMINI_KEY_COOLDOWN_SECONDS * 2 ** (state["strikes"] - 1)
+                cooldown = retry_after if retry_after else backoff
+                state["cooldown_until"] = now + min(cooldown, GEMINI_KEY_MAX_COOLDOWN_SECONDS)
+                print(f"Gemini key {mask_key(lease.key)} rate limited, cooling down {min(cooldown, GEMINI_KEY_MAX_COOLDOWN_SECONDS):.0f}s")
+            elif status_code is not None and status_code >= 500:
+                state["errors"] += 1
+                state["cooldown_until"] = now + (retry_after or GEMINI_KEY_ERROR_COOLDOWN_SECONDS)
+            elif error:
+                # Transport failure: not the key's fault, so no cooldown
+                state["errors"] += 1
+            else:
+                state["strikes"] = 0
+            self.condition.notify_all()
+
+    def get_key(self):
+        """A key for callers that don't report back; counts against the bucket but not in-flight."""
+        with self.condition:
+            return self._pick(time.time(), count_in_flight=False)
+
+    def stats(self):
+        with self.condition:
+            now = time.time()
+            keys = {}
+            for i, key in enumerate(self.keys):
+                state = self.state[key]
+                self._refill(state, now)
+                keys[f"#{i + 1} {mask_key(key)}"] = {
+                    "in_flight": state["in_flight"],
+                    "tokens": round(state["tokens"], 2),
+                    "cooldown_seconds": round(max(state["cooldown_until"] - now, 0), 1),
+                    "requests": state["requests"],
+                    "throttled": state["throttled"],
+                    "errors": state["errors"],
+                }
+        return {
+            "rpm_per_key": self.rpm,
+            "burst": self.burst,
+            "max_in_flight": self.max_in_flight,
+            "keys": keys,
+        }
+
+
+# Singleton instances
+gemini_quota_ledger = QuotaLedger("gemini", quota_backend, rpm=GEMINI_QUOTA_RPM, tpm=GEMINI_QUOTA_TPM)
+gemini_key_scheduler = GeminiKeyScheduler(GEMINI_KEYS, ledger=gemini_quota_ledger)
+
+
 def get_active_gemini_key():
-    # Cycle keys every DELAY_MINUTES
-    now = int(time.time())
-    idx = (now // (DELAY_MINUTES * 60)) % len(GEMINI_KEYS)
-    return GEMINI_KEYS[idx].strip()
\ No newline at end of file
+    return gemini_key_scheduler.get_key()
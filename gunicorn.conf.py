@@ -0,0 +1,19 @@
+import os
+
+# Production server settings: gunicorn -c gunicorn.conf.py main:app
+#
+# LLM routes spend almost all of their time waiting on Gemini. With the default
+# sync worker every one of those requests pins a whole worker for up to
+# HTTP_READ_TIMEOUT seconds, so a handful of slow completions starves cheap
+# CRUD routes. gevent workers make the socket waits (httpx, pymongo) cooperative,
+# letting a single process hold `worker_connections` requests in flight.
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gevent")
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+# Only applies to sync/gthread workers; gevent workers heartbeat between greenlets
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "180"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
@@ -0,0 +1,166 @@
+import os
+import atexit
+import contextlib
+import threading
+from urllib.parse import urlsplit
+import httpx
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Pool sizing is per host: every origin (Gemini, Mistral, ...) gets its own client
+HTTP_POOL_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "20"))
+HTTP_POOL_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "10"))
+HTTP_POOL_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "120"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "120"))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", "30"))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "10"))
+
+try:
+    import h2  # noqa: F401  (httpx only needs it to be importable)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "1") == "1" and HTTP2_AVAILABLE
+
+_clients = {}  # {origin: httpx.Client}
+_stats = {}  # {origin: {"requests": ..., "pool_hits": ..., "pool_misses": ..., "errors": ...}}
+_lock = threading.Lock()
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=HTTP_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=HTTP_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=HTTP_POOL_KEEPALIVE_EXPIRY,
+    )
+
+
+def _timeout():
+    return httpx.Timeout(
+        connect=HTTP_CONNECT_TIMEOUT,
+        read=HTTP_READ_TIMEOUT,
+        write=HTTP_WRITE_TIMEOUT,
+        pool=HTTP_POOL_TIMEOUT,
+    )
+
+
+def _ensure_stats(origin):
+    if origin not in _stats:
+        _stats[origin] = {"requests": 0, "pool_hits": 0, "pool_misses": 0, "errors": 0}
+
+
+def get_client(url):
+    """Return the shared keep-alive client for the host of `url`."""
+    origin = _origin(url)
+    client = _clients.get(origin)
+    if client is not None:
+        return client
+    with _lock:
+        client = _clients.get(origin)
+        if client is None:
+            client = httpx.Client(http2=HTTP2_ENABLED, limits=_limits(), timeout=_timeout())
+            _clients[origin] = client
+            _ensure_stats(origin)
+            print(f"Created pooled HTTP client for {origin} (http2={HTTP2_ENABLED})")
+    return client
+
+
+def _record(origin, opened_connection, failed):
+    with _lock:
+        stats = _stats[origin]
+        stats["requests"] += 1
+        if opened_connection:
+            stats["pool_misses"] += 1
+        else:
+            stats["pool_hits"] += 1
+        if failed:
+            stats["errors"] += 1
+
+
+def request(method, url, **kwargs):
+    """Send a request through the pooled client, tracking connection reuse."""
+    client = get_client(url)
+    opened = []
+
+    # httpcore emits this event only when it has to open a fresh TCP connection
+    def trace(event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            opened.append(True)
+
+    extensions = dict(kwargs.pop("extensions", None) or {})
+    extensions["trace"] = trace
+    failed = True
+    try:
+        resp = client.request(method, url, extensions=extensions, **kwargs)
+        failed = False
+        return resp
+    finally:
+        _record(_origin(url), bool(opened), failed)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+@contextlib.contextmanager
+def stream(method, url, **kwargs):
+    """Like request(), but yields the response before the body is read."""
+    client = get_client(url)
+    opened = []
+
+    def trace(event_name, info):
+        if event_name == "connection.connect_tcp.started":
+            opened.append(True)
+
+    extensions = dict(kwargs.pop("extensions", None) or {})
+    extensions["trace"] = trace
+    failed = True
+    try:
+        with client.stream(method, url, extensions=extensions, **kwargs) as resp:
+            yield resp
+            failed = False
+    finally:
+        _record(_origin(url), bool(opened), failed)
+
+
+def get_pool_stats():
+    with _lock:
+        hosts = {}
+        for origin, stats in _stats.items():
+            total = stats["pool_hits"] + stats["pool_misses"]
+            hosts[origin] = dict(stats, hit_rate=round(stats["pool_hits"] / total, 3) if total else None)
+    return {
+        "http2": HTTP2_ENABLED,
+        "limits": {
+            "max_connections_per_host": HTTP_POOL_MAX_CONNECTIONS,
+            "max_keepalive_per_host": HTTP_POOL_MAX_KEEPALIVE,
+            "keepalive_expiry": HTTP_POOL_KEEPALIVE_EXPIRY,
+        },
+        "timeouts": {
+            "connect": HTTP_CONNECT_TIMEOUT,
+            "read": HTTP_READ_TIMEOUT,
+            "write": HTTP_WRITE_TIMEOUT,
+            "pool": HTTP_POOL_TIMEOUT,
+        },
+        "hosts": hosts,
+    }
+
+
+@atexit.register
+def close_all():
+    with _lock:
+        for client in _clients.values():
+            client.close()
+        _clients.clear()
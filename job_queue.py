@@ -0,0 +1,198 @@
+import os
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "5"))
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "600"))  # a running job is reclaimed after this
+JOB_MAX_CLAIMS = int(os.getenv("JOB_MAX_CLAIMS", "3"))
+JOB_RETENTION_HOURS = int(os.getenv("JOB_RETENTION_HOURS", "24"))
+JOB_SUBMIT_ATTEMPTS = int(os.getenv("JOB_SUBMIT_ATTEMPTS", "3"))  # inserts tried while a deduped job keeps finishing under us
+# Workers per process that only take PRIORITY_LIVE jobs, so a backlog of background work never starves requests
+JOB_RESERVED_WORKERS = int(os.getenv("JOB_RESERVED_WORKERS", "1"))
+
+PRIORITY_BACKGROUND = 0  # e.g. quiz pool refills
+PRIORITY_LIVE = 1  # a user is waiting on the result
+
+
+class JobQueue:
+    """Mongo-backed job queue worked by a pool of daemon threads.
+
+    Jobs live in `collection`, so any process can claim them: a job whose
+    worker died is picked up again once its lease runs out. Higher-priority
+    jobs are claimed first, and the first JOB_RESERVED_WORKERS threads only
+    claim live ones.
+    """
+
+    def __init__(self, collection, workers=JOB_WORKERS):
+        self.collection = collection
+        self.workers = workers
+        self.handlers = {}  # {job type: handler(payload, report_progress) -> result dict}
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+
+    def register(self, job_type, handler):
+        self.handlers[job_type] = handler
+
+    def submit(self, job_type, payload, dedupe_key=None, priority=PRIORITY_LIVE):
+        """Queue a job, or return the still-active job with the same dedupe_key."""
+        now = datetime.utcnow()
+        job = {
+            "_id": str(uuid.uuid4()),
+            "type": job_type,
+            "payload": payload,
+            "status": "queued",
+            "priority": priority,
+            "progress": {},
+            "claims": 0,
+            "createdAt": now,
+            "updatedAt": now,
+        }
+        if dedupe_key:
+            # Unique sparse index (db_indexes): only one queued/running job per key across all workers
+            job["activeKey"] = dedupe_key
+        for attempt in range(JOB_SUBMIT_ATTEMPTS):
+            try:
+                self.collection.insert_one(job)
+                break
+            except DuplicateKeyError:
+                # The active job can finish between our insert and this read; if so, insert again
+                existing = self.collection.find_one({"activeKey": dedupe_key})
+                if existing:
+                    return existing
+                if attempt == JOB_SUBMIT_ATTEMPTS - 1:
+                    raise
+        self.start()
+        self.wakeup.set()
+        return job
+
+    def get(self, job_id):
+        return self.collection.find_one({"_id": job_id})
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                # Keep at least one worker for background jobs, whatever JOB_RESERVED_WORKERS says
+                live_only = i < min(JOB_RESERVED_WORKERS, self.workers - 1)
+                thread = threading.Thread(target=self._worker_loop, args=(live_only,), name=f"job-worker-{i}",
+                                          daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def _claim(self, live_only=False):
+        now = datetime.utcnow()
+        query = {"$or": [
+            {"status": "queued"},
+            {"status": "running", "leaseUntil": {"$lt": now}},
+        ]}
+        if live_only:
+            query["priority"] = {"$gte": PRIORITY_LIVE}
+        return self.collection.find_one_and_update(
+            query,
+            {
+                "$set": {
+                    "status": "running",
+                    "worker": self.worker_id,
+                    "leaseUntil": now + timedelta(seconds=JOB_LEASE_SECONDS),
+                    "startedAt": now,
+                    "updatedAt": now,
+                },
+                "$inc": {"claims": 1},
+            },
+            sort=[("priority", -1), ("createdAt", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def _worker_loop(self, live_only=False):
+        while True:
+            try:
+                job = self._claim(live_only)
+            except Exception as e:
+                print(f"Job queue claim failed: {e}")
+                job = None
+            if not job:
+                self.wakeup.wait(JOB_POLL_SECONDS)
+                self.wakeup.clear()
+                continue
+            try:
+                self._run(job)
+            except Exception as e:
+                # Never let a Mongo hiccup kill the worker; the lease hands the job to someone else
+                print(f"Job queue worker error on job {job['_id']}: {e}")
+
+    def _lease_filter(self, job):
+        # worker alone is shared by this process's threads; claims tells this claim apart from a later one
+        return {"_id": job["_id"], "worker": self.worker_id, "claims": job["claims"]}
+
+    def _report_progress(self, job, progress):
+        now = datetime.utcnow()
+        self.collection.update_one(
+            self._lease_filter(job),
+            {"$set": {
+                "progress": progress,
+                "updatedAt": now,
+                "leaseUntil": now + timedelta(seconds=JOB_LEASE_SECONDS),
+            }}
+        )
+
+    def _finish(self, job, status, result=None, error=None):
+        """Store the outcome, unless the lease ran out and another claim now owns the job."""
+        now = datetime.utcnow()
+        finished = self.collection.update_one(
+            self._lease_filter(job),
+            {
+                "$set": {
+                    "status": status,
+                    "result": result,
+                    "error": error,
+                    "finishedAt": now,
+                    "updatedAt": now,
+                    "expiresAt": now + timedelta(hours=JOB_RETENTION_HOURS),
+                },
+                "$unset": {"activeKey": "", "leaseUntil": ""},
+            }
+        )
+        if not finished.matched_count:
+            print(f"Job {job['_id']} was taken over by another worker, dropping this {status} outcome")
+
+    def _run(self, job):
+        job_id = job["_id"]
+        handler = self.handlers.get(job["type"])
+        if not handler:
+            self._finish(job, "failed", error=f"No handler for job type {job['type']}")
+            return
+        if job["claims"] > JOB_MAX_CLAIMS:
+            self._finish(job, "failed", error="Job was abandoned too many times")
+            return
+
+        print(f"Running {job['type']} job {job_id} (claim {job['claims']})")
+        try:
+            result = handler(job["payload"], lambda progress: self._report_progress(job, progress))
+        except Exception as e:
+            print(f"Job {job_id} failed: {e}")
+            self._finish(job, "failed", error=str(e))
+            return
+        self._finish(job, "succeeded", result=result)
+
+
+def serialize_job(job):
+    return {
+        "jobId": job["_id"],
+        "type": job["type"],
+        "status": job["status"],
+        "progress": job.get("progress", {}),
+        "error": job.get("error"),
+        "createdAt": job["createdAt"].isoformat(),
+        "updatedAt": job["updatedAt"].isoformat(),
+    }
@@ -0,0 +1,147 @@
+import os
+import re
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))  # in-process tier
+LLM_CACHE_SHARED_TTL_SECONDS = int(os.getenv("LLM_CACHE_SHARED_TTL_SECONDS", "86400"))  # Mongo tier
+
+
+class _CountingTTLCache(TTLCache):
+    """TTLCache that reports LRU evictions and TTL expirations."""
+
+    def __init__(self, maxsize, ttl, on_evict, on_expire):
+        super().__init__(maxsize, ttl)
+        self.on_evict = on_evict
+        self.on_expire = on_expire
+
+    def popitem(self):
+        item = super().popitem()
+        self.on_evict()
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        if expired:
+            self.on_expire(len(expired))
+        return expired
+
+
+def normalize_prompt(prompt):
+    # Indentation inside triple-quoted prompts shouldn't split the cache
+    return re.sub(r"\s+", " ", prompt).strip()
+
+
+class LLMResponseCache:
+    """Two-tier cache for LLM completions: in-process LRU+TTL in front of a Mongo TTL collection."""
+
+    def __init__(self, collection=None, maxsize=LLM_CACHE_MAX_ENTRIES, ttl=LLM_CACHE_TTL_SECONDS,
+                 shared_ttl=LLM_CACHE_SHARED_TTL_SECONDS, enabled=LLM_CACHE_ENABLED):
+        self.collection = collection
+        self.shared_ttl = shared_ttl
+        self.enabled = enabled
+        # Re-entrant: the local tier reports evictions/expirations from inside get/set, which hold it already
+        self.lock = threading.RLock()
+        self.counters = {
+            "local_hits": 0, "shared_hits": 0, "misses": 0, "stores": 0,
+            "evictions": 0, "expirations": 0, "shared_errors": 0,
+        }
+        self.local = _CountingTTLCache(maxsize, ttl, self._count_eviction, self._count_expirations)
+
+    def _count_eviction(self):
+        with self.lock:
+            self.counters["evictions"] += 1
+
+    def _count_expirations(self, count):
+        with self.lock:
+            self.counters["expirations"] += count
+
+    def _count_shared_error(self):
+        with self.lock:
+            self.counters["shared_errors"] += 1
+
+    def make_key(self, model, prompt, extra=None):
+        raw = f"{model}\0{normalize_prompt(prompt)}"
+        if extra:
+            raw += f"\0{extra}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self.lock:
+            value = self.local.get(key)
+            if value is not None:
+                self.counters["local_hits"] += 1
+                return value
+
+        value = self._shared_get(key)
+        with self.lock:
+            if value is None:
+                self.counters["misses"] += 1
+                return None
+            self.counters["shared_hits"] += 1
+            self.local[key] = value
+        return value
+
+    def set(self, key, value, model=None, shared=True):
+        """shared=False keeps the value in the in-process tier only (short TTL, this worker)."""
+        if not self.enabled or value is None:
+            return
+        with self.lock:
+            self.local[key] = value
+            self.counters["stores"] += 1
+        if shared:
+            self._shared_set(key, value, model)
+
+    def _shared_get(self, key):
+        if self.collection is None:
+            return None
+        try:
+            doc = self.collection.find_one(
+                {"_id": key, "expiresAt": {"$gt": datetime.utcnow()}},
+                {"response": 1}
+            )
+            return doc["response"] if doc else None
+        except Exception as e:
+            print(f"LLM cache shared tier read failed: {e}")
+            self._count_shared_error()
+            return None
+
+    def _shared_set(self, key, value, model):
+        if self.collection is None:
+            return
+        try:
+            now = datetime.utcnow()
+            self.collection.replace_one(
+                {"_id": key},
+                {"model": model, "response": value, "createdAt": now,
+                 "expiresAt": now + timedelta(seconds=self.shared_ttl)},
+                upsert=True
+            )
+        except Exception as e:
+            print(f"LLM cache shared tier write failed: {e}")
+            self._count_shared_error()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.local)
+        lookups = counters["local_hits"] + counters["shared_hits"] + counters["misses"]
+        hits = counters["local_hits"] + counters["shared_hits"]
+        return dict(
+            counters,
+            enabled=self.enabled,
+            local_size=size,
+            local_maxsize=self.local.maxsize,
+            local_ttl=self.local.ttl,
+            shared_ttl=self.shared_ttl,
+            hit_rate=round(hits / lookups, 3) if lookups else None,
+        )
@@ -0,0 +1,143 @@
+import json
+import hashlib
+from quiz_scoring import TRAITS
+
+# Response schemas in the OpenAPI subset Gemini's responseSchema accepts
+QUESTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "id": {"type": "STRING"},
+        "text": {"type": "STRING"},
+        "options": {
+            "type": "ARRAY",
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "id": {"type": "STRING"},
+                    "text": {"type": "STRING"},
+                    "weights": {
+                        "type": "OBJECT",
+                        "properties": {trait: {"type": "INTEGER"} for trait in TRAITS},
+                        "required": TRAITS,
+                    },
+                },
+                "required": ["id", "text", "weights"],
+            },
+        },
+    },
+    "required": ["id", "text", "options"],
+}
+QUIZ_SCHEMA = {"type": "ARRAY", "items": QUESTION_SCHEMA}
+
+CONCLUSION_FIELDS = ["headline", "summary", "top_capabilities", "recommended_path", "strengths",
+                     "growth_areas", "suggested_next_steps", "confidence"]
+CONCLUSION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "headline": {"type": "STRING"},
+        "summary": {"type": "STRING"},
+        "top_capabilities": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "recommended_path": {"type": "STRING"},
+        "strengths": {"type": "STRING"},
+        "growth_areas": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "suggested_next_steps": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "confidence": {"type": "STRING"},
+    },
+    "required": CONCLUSION_FIELDS,
+    "propertyOrdering": CONCLUSION_FIELDS,
+}
+
+
+def gemini_generation_config(schema):
+    """generationConfig that makes Gemini answer with JSON matching `schema`."""
+    return {"responseMimeType": "application/json", "responseSchema": schema}
+
+
+def schema_fingerprint(schema):
+    """Short stable id of a schema, so cached answers are keyed by the output format they were asked in."""
+    if not schema:
+        return None
+    raw = json.dumps(schema, sort_keys=True, separators=(",", ":"))
+    return "json:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+class IncrementalArrayParser:
+    """Pulls the items of a top-level JSON array out of text that arrives in pieces.
+
+    feed() returns every object or array item that was closed by the new text,
+    so callers can validate items while the rest is still being generated. An
+    item that doesn't parse is skipped on its own, and whatever was completed
+    before a stream breaks off is kept. Text before the opening bracket (a
+    code fence, a preamble) is ignored.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0  # next character of buffer to scan
+        self.started = False
+        self.finished = False
+        self.depth = 0  # nesting inside the current item
+        self.in_string = False
+        self.escape = False
+        self.item_start = None
+
+    def feed(self, text):
+        items = []
+        self.buffer += text or ""
+        buf = self.buffer
+        i = self.pos
+        while i < len(buf) and not self.finished:
+            c = buf[i]
+            if not self.started:
+                self.started = c == "["
+            elif self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+            elif c == '"':
+                self.in_string = True
+            elif c in "{[":
+                if self.depth == 0:
+                    self.item_start = i
+                self.depth += 1
+            elif c in "}]":
+                if self.depth == 0:
+                    self.finished = c == "]"
+                else:
+                    self.depth -= 1
+                    if self.depth == 0:
+                        try:
+                            items.append(json.loads(buf[self.item_start:i + 1]))
+                        except json.JSONDecodeError:
+                            pass
+                        self.item_start = None
+            i += 1
+        # Only an unfinished item needs to be kept around
+        if self.item_start is None:
+            self.buffer, self.pos = "", 0
+        else:
+            self.buffer, self.pos = buf[self.item_start:], i - self.item_start
+            self.item_start = 0
+        return items
+
+
+def salvage_array(text):
+    """Every complete item of the first JSON array in `text`, even if the array itself is cut off or broken."""
+    return IncrementalArrayParser().feed(text)
+
+
+def parse_json_object(text):
+    """The first JSON object in `text` (code fences and surrounding prose are skipped), or None."""
+    if not text:
+        return None
+    start = text.find("{")
+    if start == -1:
+        return None
+    try:
+        value, _ = json.JSONDecoder().raw_decode(text, start)
+    except json.JSONDecodeError:
+        return None
+    return value if isinstance(value, dict) else None
@@ -0,0 +1,356 @@
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dotenv import load_dotenv
+import http_pool
+from gemini_key_manager import gemini_key_scheduler, retry_after_seconds
+from mistral_key_manager import mistral_key_manager
+from prompt_budget import estimate_tokens
+from resilience import CircuitBreaker
+from llm_json import gemini_generation_config
+
+load_dotenv()
+
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral-small-latest")
+MISTRAL_CHAT_URL = os.getenv("MISTRAL_CHAT_URL", "https://api.mistral.ai/v1/chat/completions")
+
+# Preference order while there are no latency samples yet
+LLM_PROVIDERS = [p.strip() for p in os.getenv("LLM_PROVIDERS", "gemini,mistral").split(",") if p.strip()]
+LLM_ROUTER_EWMA_ALPHA = float(os.getenv("LLM_ROUTER_EWMA_ALPHA", "0.2"))
+LLM_ROUTER_LATENCY_WINDOW = int(os.getenv("LLM_ROUTER_LATENCY_WINDOW", "200"))  # samples kept for p95
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))  # above this a provider goes last
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "1") == "1"
+LLM_HEDGE_CALL_SITES = set(s.strip() for s in os.getenv("LLM_HEDGE_CALL_SITES", "quiz_generate,chat").split(",") if s.strip())
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))  # p95 is trusted from this many samples on
+LLM_HEDGE_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_DELAY_SECONDS", "8"))  # used until then
+LLM_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("LLM_HEDGE_MIN_DELAY_SECONDS", "1"))
+LLM_ROUTER_WORKERS = int(os.getenv("LLM_ROUTER_WORKERS", "64"))  # bounds concurrent routed calls per process
+
+
+# --- Gemini request helpers (also used by the streaming path in main.py) ---
+
+def build_gemini_request(prompt, stream=False, json_schema=None):
+    """Return (url, headers, body, key lease) for a generateContent call, or None when no key is free.
+    With json_schema the answer is constrained to JSON matching it.
+    The lease must be handed back with release_gemini_key once the call is over."""
+    lease = gemini_key_scheduler.acquire()
+    if not lease:
+        print("ERROR: No Gemini API key available")
+        return None
+
+    if stream:
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse"
+    else:
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{GEMINI_MODEL}:generateContent"
+    headers = {"Content-Type": "application/json", "x-goog-api-key": lease.key}
+    data = {
+        "contents": [
+            {"parts": [{"text": prompt}]}
+        ]
+    }
+    if json_schema:
+        data["generationConfig"] = gemini_generation_config(json_schema)
+    return url, headers, data, lease
+
+def release_gemini_key(lease, resp=None, tokens=0):
+    """Report a call's outcome to the key scheduler; resp=None means the request itself failed"""
+    if resp is None:
+        gemini_key_scheduler.release(lease, error=True)
+        return
+    retry_after = retry_after_seconds(resp) if resp.status_code == 429 or resp.status_code >= 500 else None
+    gemini_key_scheduler.release(lease, resp.status_code, retry_after, tokens=tokens)
+
+def extract_gemini_text(resp):
+    """Pull the completion text out of a generateContent response, or None"""
+    print(f"Gemini API response status: {resp.status_code}")
+
+    if resp.status_code != 200:
+        print(f"Gemini API error: {resp.text}")
+        return None
+
+    result = resp.json()
+
+    # Check if response has the expected structure
+    if "candidates" not in result or not result["candidates"]:
+        print(f"Unexpected Gemini response structure: {result}")
+        return None
+
+    text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+
+    if not text:
+        print("Empty text response from Gemini API")
+        return None
+
+    return text
+
+
+# --- Provider adapters: complete(prompt, json_schema) -> text or None ---
+
+class NoKeyAvailable(Exception):
+    """Raised by a provider that could not make the call because all its API keys are busy or exhausted."""
+
+class ProviderError(Exception):
+    """Raised by a provider whose API answered with an error status."""
+
+    def __init__(self, provider, status_code):
+        super().__init__(f"{provider} API returned HTTP {status_code}")
+        self.provider = provider
+        self.status_code = status_code
+
+    def is_outage(self):
+        # 429s and other 4xx are about the key or the request; the key scheduler / quota ledger handles them
+        return self.status_code >= 500
+
+class GeminiProvider:
+    name = "gemini"
+    model = GEMINI_MODEL
+
+    def available(self):
+        return bool(gemini_key_scheduler.keys)
+
+    def complete(self, prompt, json_schema=None):
+        gemini_request = build_gemini_request(prompt, json_schema=json_schema)
+        if not gemini_request:
+            raise NoKeyAvailable(self.name)
+        url, headers, data, lease = gemini_request
+
+        print(f"Making Gemini API call to: {url[:50]}...")
+        resp = text = None
+        try:
+            resp = http_pool.post(url, headers=headers, json=data)
+            text = extract_gemini_text(resp)
+        finally:
+            release_gemini_key(lease, resp, tokens=estimate_tokens(prompt) + estimate_tokens(text))
+        if resp.status_code != 200:
+            raise ProviderError(self.name, resp.status_code)
+        return text
+
+
+class MistralProvider:
+    name = "mistral"
+    model = MISTRAL_MODEL
+
+    def available(self):
+        return bool(mistral_key_manager.load_keys().keys)
+
+    def complete(self, prompt, json_schema=None):
+        key = mistral_key_manager.get_active_key()
+        if not key:
+            raise NoKeyAvailable(self.name)
+        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {key}"}
+        data = {"model": MISTRAL_MODEL, "messages": [{"role": "user", "content": prompt}]}
+        if json_schema:
+            # JSON mode; the shape itself comes from the prompt
+            data["response_format"] = {"type": "json_object"}
+
+        print(f"Making Mistral API call to: {MISTRAL_CHAT_URL[:50]}...")
+        resp = http_pool.post(MISTRAL_CHAT_URL, headers=headers, json=data)
+        print(f"Mistral API response status: {resp.status_code}")
+        if resp.status_code != 200:
+            mistral_key_manager.record_usage(key)
+            if resp.status_code == 429:
+                mistral_key_manager.record_rate_limited(key, retry_after_seconds(resp))
+            print(f"Mistral API error: {resp.text}")
+            raise ProviderError(self.name, resp.status_code)
+        result = resp.json()
+        usage = result.get("usage") or {}
+        mistral_key_manager.record_usage(key, tokens=usage.get("total_tokens", 0))
+        choices = result.get("choices") or [{}]
+        text = choices[0].get("message", {}).get("content")
+        if not text:
+            print("Empty text response from Mistral API")
+            return None
+        return text
+
+
+PROVIDERS = {"gemini": GeminiProvider(), "mistral": MistralProvider()}
+
+
+class ProviderStats:
+    """Latency (EWMA and a window for p95) and error rate of one provider's calls."""
+
+    def __init__(self):
+        self.ewma = None
+        self.error_rate = 0.0
+        self.samples = deque(maxlen=LLM_ROUTER_LATENCY_WINDOW)
+        self.counters = {"calls": 0, "failures": 0, "no_key": 0, "rejected": 0, "wins": 0, "hedged": 0, "hedge_wins": 0}
+
+    def record(self, elapsed, ok):
+        self.counters["calls"] += 1
+        self.error_rate += LLM_ROUTER_EWMA_ALPHA * ((0.0 if ok else 1.0) - self.error_rate)
+        if not ok:
+            self.counters["failures"] += 1
+            return
+        # Only answered calls count towards latency; failures are often fast and would flatter a provider
+        self.samples.append(elapsed)
+        self.ewma = elapsed if self.ewma is None else self.ewma + LLM_ROUTER_EWMA_ALPHA * (elapsed - self.ewma)
+
+    def p95(self):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class LLMRouter:
+    """Sends a prompt to the fastest healthy provider and falls back to the next one.
+
+    Providers are ranked by EWMA latency; ones failing more than
+    LLM_ROUTER_MAX_ERROR_RATE of recent calls go last. For hedged call sites,
+    if the first provider has not answered within its p95 latency, the next one
+    is asked too and the first valid answer wins. The slower call is left to
+    finish in the background so its key lease is released normally.
+    Each provider sits behind a circuit breaker (resilience.py) and is skipped
+    while its circuit is open.
+    """
+
+    def __init__(self, providers, order=LLM_PROVIDERS):
+        self.providers = [providers[name] for name in order if name in providers]
+        self.stats = {p.name: ProviderStats() for p in self.providers}
+        self.breakers = {p.name: CircuitBreaker(f"llm:{p.name}") for p in self.providers}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=LLM_ROUTER_WORKERS, thread_name_prefix="llm-router")
+
+    def ranked(self):
+        # Providers behind an open circuit are left out entirely, so an outage fails fast
+        available = [p for p in self.providers if p.available() and self.breakers[p.name].available()]
+        with self.lock:
+            # sorted() is stable, so unmeasured providers keep LLM_PROVIDERS order
+            return sorted(available, key=lambda p: (
+                self.stats[p.name].error_rate > LLM_ROUTER_MAX_ERROR_RATE,
+                self.stats[p.name].ewma if self.stats[p.name].ewma is not None else float("inf"),
+            ))
+
+    def hedge_delay(self, provider):
+        with self.lock:
+            stats = self.stats[provider.name]
+            p95 = stats.p95() if len(stats.samples) >= LLM_HEDGE_MIN_SAMPLES else None
+        return max(p95 if p95 is not None else LLM_HEDGE_DELAY_SECONDS, LLM_HEDGE_MIN_DELAY_SECONDS)
+
+    def is_available(self, name):
+        """Whether the named provider has keys and a circuit that would let a call through."""
+        provider = next((p for p in self.providers if p.name == name), None)
+        return bool(provider) and provider.available() and self.breakers[name].available()
+
+    def all_open(self):
+        """True when every configured provider is behind an open circuit."""
+        return not self.ranked()
+
+    def _call(self, provider, prompt, validate, json_schema=None):
+        breaker = self.breakers[provider.name]
+        if not breaker.allow():
+            return provider, None
+        start = time.time()
+        text = None
+        outcome = "success"  # what the call says about the provider's health
+        try:
+            text = provider.complete(prompt, json_schema)
+        except NoKeyAvailable:
+            # Out of quota is not an outage: leave the circuit and the latency stats alone
+            breaker.record_skipped()
+            with self.lock:
+                self.stats[provider.name].counters["no_key"] += 1
+            return provider, None
+        except ProviderError as e:
+            print(f"Error calling {provider.name}: {e}")
+            outcome = "failure" if e.is_outage() else "rejected"
+        except Exception as e:
+            # Timeouts and transport errors
+            print(f"Exception calling {provider.name}: {e}")
+            outcome = "failure"
+        # Only 5xx, timeouts and transport errors count against the circuit;
+        # an empty or invalid answer still shows the provider is up
+        if outcome == "failure":
+            breaker.record_failure()
+        elif outcome == "rejected":
+            breaker.record_skipped()
+            with self.lock:
+                self.stats[provider.name].counters["rejected"] += 1
+        else:
+            breaker.record_success()
+        ok = bool(text) and (validate is None or validate(text))
+        with self.lock:
+            self.stats[provider.name].record(time.time() - start, ok)
+        return provider, (text if ok else None)
+
+    def record_call(self, name, elapsed, ok):
+        """Latency/error stats for a call made outside complete(), e.g. a streamed one."""
+        with self.lock:
+            self.stats[name].record(elapsed, ok)
+
+    def _won(self, provider, hedged=False):
+        with self.lock:
+            self.stats[provider.name].counters["wins"] += 1
+            if hedged:
+                self.stats[provider.name].counters["hedge_wins"] += 1
+
+    def complete(self, prompt, call_site="other", validate=None, json_schema=None):
+        """Return (text, model) from the first provider with a valid answer, or (None, None).
+        validate(text) can reject answers that came back but are unusable; json_schema asks for JSON output."""
+        candidates = self.ranked()
+        hedge = LLM_HEDGE_ENABLED and call_site in LLM_HEDGE_CALL_SITES and len(candidates) > 1
+        if not hedge:
+            for provider in candidates:
+                _, text = self._call(provider, prompt, validate, json_schema)
+                if text:
+                    self._won(provider)
+                    return text, provider.model
+            return None, None
+
+        pending = {self.executor.submit(self._call, candidates[0], prompt, validate, json_schema)}
+        next_index = 1
+        delay = self.hedge_delay(candidates[0])
+        while pending:
+            done, pending = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+            for future in done:
+                provider, text = future.result()
+                if text:
+                    self._won(provider, hedged=provider is not candidates[0])
+                    return text, provider.model
+            if next_index < len(candidates) and (not done or not pending):
+                # Too slow (or already failed): bring in the next provider
+                provider = candidates[next_index]
+                next_index += 1
+                if done:
+                    print(f"LLM router: {candidates[next_index - 2].name} failed, failing over to {provider.name}")
+                else:
+                    print(f"LLM router: no answer within {delay:.1f}s, hedging with {provider.name}")
+                    with self.lock:
+                        self.stats[provider.name].counters["hedged"] += 1
+                pending.add(self.executor.submit(self._call, provider, prompt, validate, json_schema))
+                delay = self.hedge_delay(provider)
+            elif not pending:
+                break
+            else:
+                delay = None  # nothing left to add, wait for what is running
+        return None, None
+
+    def snapshot(self):
+        with self.lock:
+            providers = {}
+            for provider in self.providers:
+                stats = self.stats[provider.name]
+                p95 = stats.p95()
+                providers[provider.name] = dict(
+                    stats.counters,
+                    model=provider.model,
+                    ewma_seconds=round(stats.ewma, 3) if stats.ewma is not None else None,
+                    p95_seconds=round(p95, 3) if p95 is not None else None,
+                    error_rate=round(stats.error_rate, 3),
+                    samples=len(stats.samples),
+                )
+        for provider in self.providers:
+            providers[provider.name]["available"] = provider.available()
+            providers[provider.name]["circuit"] = self.breakers[provider.name].stats()["state"]
+        return {
+            "order": [p.name for p in self.ranked()],
+            "hedging": LLM_HEDGE_ENABLED,
+            "hedge_call_sites": sorted(LLM_HEDGE_CALL_SITES),
+            "providers": providers,
+        }
+
+
+llm_router = LLMRouter(PROVIDERS)
@@ -3,79 +3,182 @@ import uuid
 import random
 import json
 import re
-import requests
-from flask import Flask, request, jsonify, make_response
-from flask_pymongo import PyMongo
+from flask import Flask, request, jsonify, make_response, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import os
+import threading
 from werkzeug.security import generate_password_hash, check_password_hash
 import jwt
-from gemini_key_manager import get_active_gemini_key
+from pymongo.errors import DuplicateKeyError
+from gemini_key_manager import gemini_key_scheduler
+import http_pool
+from llm_cache import LLMResponseCache
+from job_queue import JobQueue, serialize_job
+from quiz_pool import QuizPoolManager
+from reference_quiz import ReferenceQuizProvider
+from user_cache import UserProfileCache
+from profile_digest import ProfileDigestStore, prompt_profile, summarize_quiz_result
+from prompt_budget import PromptAssembler, prompt_metrics, estimate_tokens
+from quota_ledger import LEDGERS
+from llm_router import llm_router, GEMINI_MODEL, NoKeyAvailable, ProviderError, build_gemini_request, release_gemini_key
+from resilience import backoff_delay, llm_retry_budget, resilience_snapshot
+from quiz_scoring import compile_quiz, load_compiled, score_batch
+from single_flight import SingleFlight, flight_key
+from quiz_chunks import QUIZ_TOTAL_QUESTIONS, generate_chunked_quiz, parse_chunk, chunk_is_usable, is_valid_question
+from conclusion_cache import (ConclusionTemplateCache, student_segment, score_buckets, template_key, personalize,
+                              institute_type, NAME_PLACEHOLDER, STREAM_PLACEHOLDER, CONCLUSION_CACHE_BUCKET_PCT)
+from chat_state import ChatStateStore
+from chat_intents import chat_intents, STATIC_REPLIES, STUDY_PLAN_CREATED_REPLY, FALLBACK_INTENT
+from llm_json import QUIZ_SCHEMA, CONCLUSION_SCHEMA, CONCLUSION_FIELDS, IncrementalArrayParser, parse_json_object, schema_fingerprint
+from db_indexes import ensure_indexes, backfill_disposable_quizzes, index_report
+from database import db, pool_diagnostics
 
 import time
 
-def call_gemini_api_with_retry(prompt, max_retries=3):
-    """Call Gemini API with retry mechanism"""
+def call_gemini_api_with_retry(prompt, max_retries=3, use_cache=True, call_site="other"):
+    """Call Gemini API with retry mechanism: jittered backoff, bounded by the shared retry budget"""
+    llm_retry_budget.record_request()
     for attempt in range(max_retries):
         try:
-            result = call_gemini_api(prompt)
+            result = call_gemini_api(prompt, use_cache=use_cache, call_site=call_site)
             if result:
                 return result
-            print(f"Attempt {attempt + 1} failed, retrying...")
-            time.sleep(2)  # Wait 2 seconds before retry
+            print(f"Attempt {attempt + 1} failed")
         except Exception as e:
             print(f"Attempt {attempt + 1} error: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2)
-            else:
+            if attempt == max_retries - 1:
                 raise e
+        if attempt == max_retries - 1 or not can_retry_llm():
+            break
+        time.sleep(backoff_delay(attempt))
     return None
 
-
-def call_gemini_api(prompt):
+def can_retry_llm():
+    """Retry only while some provider's circuit is closed and the retry budget allows it"""
+    if llm_router.all_open():
+        print("All LLM providers are unavailable (circuits open), not retrying")
+        return False
+    if not llm_retry_budget.try_retry():
+        print("LLM retry budget exhausted, not retrying")
+        return False
+    return True
+
+
+def call_gemini_api(prompt, use_cache=True, call_site="other", validate=None, json_schema=None):
+    """Complete a prompt through the LLM router (Gemini first, Mistral as fallback/hedge).
+    use_cache=False opts a call site out of the shared response cache; call_site names the
+    caller in the prompt/response size metrics; validate(text) rejects unusable answers;
+    json_schema asks for schema-constrained JSON (part of the cache key)."""
     try:
-        API_KEY = get_active_gemini_key()
-        if not API_KEY: 
-            print("ERROR: No Gemini API key available")
-            return None
-            
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-2.0-flash:generateContent?key={API_KEY}"
-        headers = {"Content-Type": "application/json"}
-        data = {
-            "contents": [
-                {"parts": [{"text": prompt}]}
-            ]
-        }
-        
-        print(f"Making Gemini API call to: {url[:50]}...")
-        resp = requests.post(url, headers=headers, json=data, timeout=120)
-        
-        print(f"Gemini API response status: {resp.status_code}")
-        
-        if resp.status_code != 200:
-            print(f"Gemini API error: {resp.text}")
-            return None
-            
-        result = resp.json()
-        
-        # Check if response has the expected structure
-        if "candidates" not in result or not result["candidates"]:
-            print(f"Unexpected Gemini response structure: {result}")
-            return None
-            
-        text = result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
-        
-        if not text:
-            print("Empty text response from Gemini API")
-            return None
-            
+        cache_key = llm_cache.make_key(GEMINI_MODEL, prompt, schema_fingerprint(json_schema)) if use_cache else None
+        if cache_key:
+            cached = llm_cache.get(cache_key)
+            if cached is not None:
+                prompt_metrics.record_call(call_site, prompt, cached, cached=True)
+                return cached
+
+        text, model = llm_router.complete(prompt, call_site=call_site, validate=validate, json_schema=json_schema)
+        prompt_metrics.record_call(call_site, prompt, text)
+        if text and cache_key:
+            # Keyed on GEMINI_MODEL: a fallback model's answer stays out of the long-TTL shared tier
+            llm_cache.set(cache_key, text, model=model, shared=model == GEMINI_MODEL)
         return text
-        
+
     except Exception as e:
         print(f"Exception in call_gemini_api: {str(e)}")
+        prompt_metrics.record_call(call_site, prompt, None)
         return None
 
+def stream_json_items(prompt, json_schema, is_valid_item, limit, call_site="other"):
+    """Stream a JSON-array answer from Gemini and return its valid items, parsed as each one completes.
+    Stops reading once `limit` items are in; if the stream breaks off, the items completed so far are kept."""
+    # Same breaker and latency stats as routed Gemini calls
+    breaker = llm_router.breakers["gemini"]
+    if not breaker.allow():
+        return []
+    parser = IncrementalArrayParser()
+    items = []
+    raw_chunks = []
+    start = time.time()
+    outcome = "success"  # what the stream says about Gemini's health, as in LLMRouter._call
+    stream = stream_gemini_api(prompt, json_schema=json_schema)
+    try:
+        for chunk in stream:
+            raw_chunks.append(chunk)
+            items.extend(item for item in parser.feed(chunk) if is_valid_item(item))
+            if len(items) >= limit:
+                break
+    except NoKeyAvailable:
+        breaker.record_skipped()
+        return []
+    except ProviderError as e:
+        print(f"Error streaming JSON from Gemini: {e}")
+        outcome = "failure" if e.is_outage() else "rejected"
+    except Exception as e:
+        print(f"Exception while streaming JSON from Gemini: {e}")
+        # A stream that breaks off after some output still showed Gemini up
+        outcome = "success" if raw_chunks else "failure"
+    finally:
+        # Closing the generator ends the HTTP stream and hands the key back
+        stream.close()
+    if outcome == "failure":
+        breaker.record_failure()
+    elif outcome == "rejected":
+        breaker.record_skipped()
+    else:
+        breaker.record_success()
+    llm_router.record_call("gemini", time.time() - start, bool(items))
+    prompt_metrics.record_call(call_site, prompt, "".join(raw_chunks) or None)
+    return items[:limit]
+
+def stream_gemini_api(prompt, json_schema=None):
+    """Yield completion text chunks from streamGenerateContent as Gemini produces them"""
+    gemini_request = build_gemini_request(prompt, stream=True, json_schema=json_schema)
+    if not gemini_request:
+        raise NoKeyAvailable("No Gemini API key available")
+    url, headers, data, lease = gemini_request
+
+    print(f"Making streaming Gemini API call to: {url[:50]}...")
+    resp = None
+    streamed = []
+    try:
+        with http_pool.stream("POST", url, headers=headers, json=data) as resp:
+            print(f"Gemini stream response status: {resp.status_code}")
+            if resp.status_code != 200:
+                resp.read()
+                print(f"Gemini API error: {resp.text}")
+                raise ProviderError("gemini", resp.status_code)
+
+            for line in resp.iter_lines():
+                # SSE frames look like "data: {...generateContent response...}"
+                if not line.startswith("data:"):
+                    continue
+                chunk = json.loads(line[len("data:"):].strip() or "{}")
+                candidates = chunk.get("candidates") or [{}]
+                parts = candidates[0].get("content", {}).get("parts", [])
+                text = "".join(part.get("text", "") for part in parts)
+                if text:
+                    streamed.append(text)
+                    yield text
+    finally:
+        # The key counts as in flight for as long as the stream is open
+        release_gemini_key(lease, resp, tokens=estimate_tokens(prompt) + estimate_tokens("".join(streamed)))
+
+def format_gemini_stream(chunks):
+    """Apply format_gemini_response line by line as streamed chunks arrive"""
+    pending = ""
+    for chunk in chunks:
+        pending += chunk
+        if "\n" not in pending:
+            continue
+        # Only complete lines are formatted; the trailing partial line waits for more text
+        complete, pending = pending.rsplit("\n", 1)
+        lines = [line.rstrip("\r") for line in complete.split("\n")]
+        yield format_gemini_response("\n".join(lines)) + "\n"
+    if pending:
+        yield format_gemini_response(pending)
+
 def format_gemini_response(text):
     # Bold section titles (lines ending with ':')
     text = re.sub(r"^(.*:)", r"**\1**", text, flags=re.MULTILINE)
@@ -99,40 +202,123 @@ app = Flask(__name__)
 
 CORS(app, origins="*", supports_credentials=True, allow_headers=["*"], methods=["GET", "POST", "PATCH", "DELETE", "OPTIONS"])
 
-# Configure MongoDB
-app.config["MONGO_URI"] = os.getenv("MONGO_URI")
 app.secret_key = os.getenv("SECRET_KEY") or "your-secret-key-here"
 
-# Debug if MONGO_URI is missing
-if not app.config["MONGO_URI"]:
-    raise EnvironmentError("MONGO_URI not found. Check your .env file or os.environ.")
+# MongoDB: one shared, tuned connection pool for the whole process (see database.py)
+users = db.users
+
+# Short-TTL profile cache for the read-heavy routes; every write goes through update_user_document
+user_profiles = UserProfileCache(users)
+
+# Size-bounded profile summaries for prompts, rebuilt on every profile write
+profile_digests = ProfileDigestStore(db.profile_digests, users)
+
+def update_user_document(email, update):
+    """Apply an update to a user's document, drop their cached profile and rebuild their digest"""
+    result = users.update_one({"email": email}, update)
+    user_profiles.invalidate(email)
+    if result.matched_count:
+        profile_digests.refresh_quietly(email)
+    return result
+
+# Shared LLM response cache (in-process LRU in front of the llm_cache collection)
+llm_cache = LLMResponseCache(db.llm_cache)
+
+# Concurrent identical LLM requests (same endpoint, student and inputs) share one computation,
+# across workers through leases in the llm_leases collection
+llm_flights = SingleFlight(db.llm_leases)
 
-# Initialize Mongo connection
-mongo = PyMongo(app)
+# Per-conversation chat state (drafted study plans), shared across workers
+chat_state = ChatStateStore(db.chat_state)
 
-# Check if mongo instance is valid
-if not mongo:
-    raise RuntimeError("Failed to initialize PyMongo. Check MONGO_URI connection.")
+# Shared quiz analyses per (segment, score buckets), personalized on the way out
+conclusion_templates = ConclusionTemplateCache(db.conclusion_templates)
 
-# Get the "users" collection from the MongoDB database
-users = mongo.db.users  # ✅ Only accessed after Mongo is confirmed working
+# Example quiz shown to Gemini when generating new quizzes
+reference_quizzes = ReferenceQuizProvider(db.quizzes)
+
+def bootstrap_db():
+    ensure_indexes(db)
+    backfill_disposable_quizzes(db, reference_quizzes.student_id)
+
+# Create/verify indexes (incl. TTL expiry of old quizzes) without holding up startup
+threading.Thread(target=bootstrap_db, name="ensure-indexes", daemon=True).start()
 
 QUIZ_CACHE_DAYS = int(os.getenv("QUIZ_CACHE_DAYS", "7"))
-TRAITS = ["analytical", "creative", "leadership", "sociable", "structured"]
+QUIZ_RESULT_MAX_WAIT_SECONDS = float(os.getenv("QUIZ_RESULT_MAX_WAIT_SECONDS", "25"))  # cap on /quiz/result?wait=
+QUIZ_RESULT_STREAM_SECONDS = float(os.getenv("QUIZ_RESULT_STREAM_SECONDS", "120"))  # how long the SSE variant waits
+QUIZ_RESULT_POLL_SECONDS = float(os.getenv("QUIZ_RESULT_POLL_SECONDS", "0.5"))
+
+# --- Server-Sent Events Utilities ---
+
+def wants_stream(data=None):
+    """Streaming is opt-in: ?stream=1, {"stream": true} or Accept: text/event-stream"""
+    if request.args.get("stream") in ("1", "true"):
+        return True
+    if data and data.get("stream") is True:
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+def sse_event(payload, event=None):
+    message = f"event: {event}\n" if event else ""
+    return message + f"data: {json.dumps(payload)}\n\n"
+
+def sse_response(events):
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
-# --- Enhanced AI Quiz Generation Utilities ---
+def stream_llm_response(prompt, result_key, use_cache=True, call_site="other"):
+    """Forward Gemini tokens as SSE "delta" events, then a "done" event with the full text"""
+    cache_key = llm_cache.make_key(GEMINI_MODEL, prompt) if use_cache else None
+    cached = llm_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        prompt_metrics.record_call(call_site, prompt, cached, cached=True)
+        return stream_static_response(format_gemini_response(cached), result_key)
 
-def call_llm_generate_quiz(student_profile):
-    """Generate personalized quiz questions based on student profile, with reference quiz support and relaxed length check"""
-    try:
-        major = student_profile.get('major', student_profile.get('class', 'General'))
+    def events():
+        raw_chunks = []
+        full_text = ""
+
+        def collect(chunks):
+            for chunk in chunks:
+                raw_chunks.append(chunk)
+                yield chunk
 
-        # --- Reference Quiz Retrieval ---
-        reference_quiz_doc = mongo.db.quizzes.find_one({"studentId": "pulkitjhamb@gmail.com"}, sort=[("createdAt", -1)])
-        reference_quiz = reference_quiz_doc["questions"] if reference_quiz_doc and "questions" in reference_quiz_doc else None
+        try:
+            for text in format_gemini_stream(collect(stream_gemini_api(prompt))):
+                full_text += text
+                yield sse_event({"delta": text})
+        except Exception as e:
+            print(f"Exception while streaming Gemini response: {e}")
+            prompt_metrics.record_call(call_site, prompt, None)
+            yield sse_event({"error": str(e)}, event="error")
+            return
+        prompt_metrics.record_call(call_site, prompt, "".join(raw_chunks) or None)
+        if not full_text:
+            yield sse_event({"error": "No response from Gemini API"}, event="error")
+            return
+        if cache_key:
+            llm_cache.set(cache_key, "".join(raw_chunks), model=GEMINI_MODEL)
+        yield sse_event({result_key: full_text}, event="done")
+    return sse_response(events())
+
+def stream_static_response(text, result_key):
+    """Send an already-known reply with the same event sequence as stream_llm_response"""
+    def events():
+        yield sse_event({"delta": text})
+        yield sse_event({result_key: text}, event="done")
+    return sse_response(events())
 
-        # --- Prompt Construction ---
-        prompt = f"""Generate a psychometric quiz for a {major} student. 
+# --- Enhanced AI Quiz Generation Utilities ---
+
+def build_quiz_chunk_prompt(major, chunk, reference_quiz):
+    """Prompt for one chunk of a quiz: chunk["size"] questions that mainly probe chunk["traits"]"""
+    focus = ", ".join(chunk["traits"])
+    return f"""Generate {chunk["size"]} psychometric quiz questions for a {major} student.
+These questions should mainly tell apart students who are strong or weak in: {focus}.
 Return ONLY a JSON array with this exact structure:
 
 [
@@ -151,77 +337,93 @@ Return ONLY a JSON array with this exact structure:
 
 CRITICAL REQUIREMENTS:
 - Return ONLY the JSON array starting with [ and ending with ]
-- Use question ids q1, q2, q3... up to qN (N between 25 and 30)
+- Exactly {chunk["size"]} questions, ids q1, q2, q3...
 - Each option must have weights for all 5 traits: analytical, creative, leadership, sociable, structured
 - Weight values must be integers 0-3
 - Questions should be relevant to {major} field
 - NO markdown formatting, NO explanations, ONLY the JSON array
 
 Reference Quiz Example (for inspiration, do NOT copy directly):
-{json.dumps(reference_quiz, indent=2) if reference_quiz else "No reference quiz available."}
+{reference_quiz or "No reference quiz available."}
 """
-        response = call_gemini_api(prompt)
-        if not response:
-            print("No response from Gemini API")
-            return None
 
-        response_text = response.strip()
-        print(f"RAW GEMINI RESPONSE:\nLength: {len(response_text)}\nFull response: {response_text}\n{'='*50}")
+def call_llm_generate_quiz(student_profile):
+    """Generate personalized quiz questions based on student profile, with reference quiz support.
+    The quiz is asked for in concurrent chunks (quiz_chunks.py) that are merged and renumbered."""
+    try:
+        major = student_profile.get('major', student_profile.get('class', 'General'))
 
-        # Extract JSON array
-        json_match = re.search(r'\[.*\]', response_text, re.DOTALL)
-        if json_match:
-            response_text = json_match.group(0)
-        else:
-            start_idx = response_text.find('[')
-            end_idx = response_text.rfind(']')
-            if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-                response_text = response_text[start_idx:end_idx+1]
-            else:
-                print("Could not extract JSON array from Gemini response")
-                return None
-        response_text = response_text.strip()
+        # --- Reference Quiz Retrieval (cached, compact JSON) ---
+        reference_quiz = reference_quizzes.get_serialized()
+
+        def complete(prompt, chunk):
+            # Every generation must be a fresh quiz, so no response cache here.
+            # Stream from Gemini in JSON mode, checking each question as soon as it is closed
+            questions = []
+            streamed = llm_router.is_available("gemini")
+            if streamed:
+                questions = stream_json_items(prompt, QUIZ_SCHEMA, is_valid_question, chunk["size"], call_site="quiz_generate")
+            if chunk_is_usable(questions, chunk["size"]):
+                return questions
+            # Asking again after a stream that came up short is a retry
+            if streamed and not llm_retry_budget.try_retry():
+                return questions
+            # Stream failed or came up short: routed call, which can hedge and fail over to Mistral
+            text = call_gemini_api(
+                prompt, use_cache=False, call_site="quiz_generate", json_schema=QUIZ_SCHEMA,
+                validate=lambda text: chunk_is_usable(parse_chunk(text, chunk["size"]), chunk["size"])
+            )
+            routed = parse_chunk(text, chunk["size"])
+            return routed if len(routed) > len(questions) else questions
 
-        print(f"CLEANED RESPONSE:\nLength: {len(response_text)}\nContent: {response_text}\n{'='*50}")
+        quiz_data = generate_chunked_quiz(lambda chunk: build_quiz_chunk_prompt(major, chunk, reference_quiz), complete)
+        if quiz_data:
+            print(f"Generated quiz with {len(quiz_data)} questions")
+        return quiz_data
 
-        # Try to parse the JSON
-        quiz_data = json.loads(response_text)
+    except Exception as e:
+        print(f"Error generating quiz: {e}")
+        return None
 
-        # Relaxed validation: accept 25-30 questions
-        if not isinstance(quiz_data, list):
-            print(f"Response is not a list: {type(quiz_data)}")
-            return None
+MAX_POINTS_PER_QUESTION = 3  # option weights go from 0 to 3 per trait
 
-        if not (25 <= len(quiz_data) <= 30):
-            print(f"Expected 25-30 questions, got {len(quiz_data)}")
-            return None
+def max_trait_score(question_count=None):
+    """Highest score a trait can reach in a quiz of question_count questions"""
+    return (question_count or QUIZ_TOTAL_QUESTIONS) * MAX_POINTS_PER_QUESTION
 
-        # Quick validation of first question structure
-        if quiz_data and 'id' in quiz_data[0] and 'text' in quiz_data[0] and 'options' in quiz_data[0]:
-            print("Quiz structure looks valid")
-            return quiz_data
-        else:
-            print("Invalid quiz structure")
+def call_llm_conclusion(student_id, trait_scores, question_count=None):
+    """Generate personalized conclusion based on trait scores and student profile.
+    Students of the same segment whose scores fall into the same buckets share one generated
+    analysis (conclusion_cache.py); only the name and stream are filled in per student."""
+    try:
+        # Get student profile
+        user = user_profiles.get(student_id)
+        if not user:
             return None
+        max_possible = max_trait_score(question_count)
+        if not conclusion_templates.enabled:
+            return generate_conclusion(user, trait_scores, max_possible)
+
+        segment = student_segment(user)
+        buckets = score_buckets(trait_scores, max_possible)
+        key = template_key(segment, buckets)
+        template = conclusion_templates.get(key)
+        if template is None:
+            template = generate_conclusion(user, trait_scores, max_possible, buckets=buckets)
+            if not template:
+                return None
+            conclusion_templates.set(key, template, segment, buckets)
+        return personalize(template, user)
 
-    except json.JSONDecodeError as e:
-        print(f"JSON parsing error: {e}")
-        print(f"Problematic text: {response_text[:200] if 'response_text' in locals() else 'No response text'}")
-        return None
     except Exception as e:
-        print(f"Error generating quiz: {e}")
+        print(f"ERROR: Exception in call_llm_conclusion: {e}")
         return None
 
-def call_llm_conclusion(student_id, trait_scores):
-    """Generate personalized conclusion based on trait scores and student profile"""
+def generate_conclusion(user, trait_scores, max_possible, buckets=None):
+    """Ask the LLM for a quiz analysis. With `buckets` it writes a reusable template instead:
+    no personal details, name/stream placeholders and score ranges rather than exact scores"""
     try:
-        # Get student profile
-        user = users.find_one({"email": student_id})
-        if not user:
-            return None
-            
         # Calculate percentages
-        max_possible = 30 * 3  # 30 questions, max 3 points per trait
         trait_percentages = {trait: (score / max_possible) * 100 for trait, score in trait_scores.items()}
         
         grade_class = user.get('class', 'Not specified')
@@ -230,7 +432,8 @@ def call_llm_conclusion(student_id, trait_scores):
         grade_mapping = {'IX': '9th grade', 'X': '10th grade', 'XI': '11th grade', 'XII': '12th grade'}
         readable_grade = grade_mapping.get(grade_class, grade_class)
         
-        student_context = f"""
+        # Profile lines may be trimmed to fit the prompt budget; the scores never are
+        profile_context = f"""
         Student Profile:
         - Name: {user.get('name', 'Student')}
         - Current School Grade: {readable_grade} (Class {grade_class} - Indian secondary school student)
@@ -240,7 +443,16 @@ def call_llm_conclusion(student_id, trait_scores):
         - Career Interests: {', '.join(user.get('careerInterests', ['Exploring options']))}
         - Skills: {', '.join(user.get('skills', ['Developing']))}
         - Extracurricular: {len(user.get('extracurricularActivities', []))} activities
-        
+        """
+        if buckets:
+            profile_context = f"""
+        Student Profile (this analysis will be shown to every student with this profile and similar scores):
+        - Name: write {NAME_PLACEHOLDER} wherever you would use the student's name
+        - Current School Grade: {readable_grade} (Class {grade_class} - Indian secondary school student)
+        - Institute type: {institute_type(user)}
+        - Stream/Subjects: write {STREAM_PLACEHOLDER} wherever you would name their stream or major
+        """
+        scores_context = f"""
         IMPORTANT: This student is in {readable_grade} of Indian secondary school (ages 14-18). They are NOT in college.
         
         Psychometric Scores:
@@ -250,13 +462,23 @@ def call_llm_conclusion(student_id, trait_scores):
         - Social: {trait_scores['sociable']}/{max_possible} ({trait_percentages['sociable']:.1f}%)
         - Structured: {trait_scores['structured']}/{max_possible} ({trait_percentages['structured']:.1f}%)
         """
+        if buckets:
+            scores_context = f"""
+        IMPORTANT: This student is in {readable_grade} of Indian secondary school (ages 14-18). They are NOT in college.
+        
+        Psychometric Scores (ranges; do NOT quote exact numbers):
+        - Analytical: {buckets['analytical']}-{buckets['analytical'] + CONCLUSION_CACHE_BUCKET_PCT}%
+        - Creative: {buckets['creative']}-{buckets['creative'] + CONCLUSION_CACHE_BUCKET_PCT}%
+        - Leadership: {buckets['leadership']}-{buckets['leadership'] + CONCLUSION_CACHE_BUCKET_PCT}%
+        - Social: {buckets['sociable']}-{buckets['sociable'] + CONCLUSION_CACHE_BUCKET_PCT}%
+        - Structured: {buckets['structured']}-{buckets['structured'] + CONCLUSION_CACHE_BUCKET_PCT}%
+        """
         
         # Adjust analysis based on student type
         if user.get('studentType') == 'school':
-            prompt = f"""You are a school career counselor talking to a {readable_grade} student in Indian secondary school. This is a SCHOOL STUDENT, NOT a college student. Give ONLY school-appropriate advice.
-
-            {student_context}
-
+            intro = f"""You are a school career counselor talking to a {readable_grade} student in Indian secondary school. This is a SCHOOL STUDENT, NOT a college student. Give ONLY school-appropriate advice.
+            """
+            instructions = f"""
             STRICT RULES:
             - NO company names (Google, Microsoft, TCS, etc.)
             - NO professional terms (internships, networking, GitHub, IEEE, professional societies)
@@ -318,10 +540,9 @@ def call_llm_conclusion(student_id, trait_scores):
               "confidence": "high"
             }}"""
         else:
-            prompt = f"""You are an expert career counselor and psychologist with 15+ years of experience in Indian education and career development. Analyze this student's comprehensive psychometric test results and create an in-depth, personalized career profile.
-
-            {student_context}
-
+            intro = f"""You are an expert career counselor and psychologist with 15+ years of experience in Indian education and career development. Analyze this student's comprehensive psychometric test results and create an in-depth, personalized career profile.
+            """
+            instructions = f"""
             Create a detailed, comprehensive analysis with rich content:
 
             1. **Headline**: Create a unique, inspiring personality archetype title (e.g., "The Strategic Innovator", "The Analytical Leader")
@@ -371,36 +592,42 @@ def call_llm_conclusion(student_id, trait_scores):
               "confidence": "high"
             }}"""
 
-        response = call_gemini_api(prompt)
+        if buckets:
+            instructions += f"""
+
+            Refer to the student only as {NAME_PLACEHOLDER} and to their stream/major only as {STREAM_PLACEHOLDER}. Do not invent other personal details."""
+
+        prompt = (
+            PromptAssembler("conclusion")
+            .add(intro)
+            .add(profile_context, priority=1, name="profile")
+            .add(scores_context)
+            .add(instructions)
+            .build()
+        )
+        # An answer that isn't a JSON object fails over to the next provider instead of failing the request
+        response = call_gemini_api(prompt, call_site="conclusion", json_schema=CONCLUSION_SCHEMA,
+                                   validate=lambda text: parse_json_object(text) is not None)
         
         
         # Debug: Check if we got a response at all
         if not response:
-            print("ERROR: No response from Gemini API in call_llm_conclusion")
+            print("ERROR: No response from Gemini API in generate_conclusion")
             return None
         
         print(f"DEBUG: Raw Gemini response length: {len(response)}")
         print(f"DEBUG: Raw Gemini response: {response[:500]}...")
         
-        # Clean and parse response
-        response_text = response.strip()
-        response_text = re.sub(r'```json\s*', '', response_text)
-        response_text = re.sub(r'```\s*$', '', response_text)
-        
-        print(f"DEBUG: Cleaned response length: {len(response_text)}")
-        print(f"DEBUG: Cleaned response: {response_text[:500]}...")
-        
-        try:
-            conclusion_data = json.loads(response_text)
-            print(f"DEBUG: Successfully parsed JSON with keys: {list(conclusion_data.keys())}")
-        except json.JSONDecodeError as e:
-            print(f"ERROR: JSON parsing failed: {e}")
-            print(f"ERROR: Problematic text: {response_text[:1000]}")
+        # JSON mode answers are bare JSON; the parser also copes with code fences or prose around it
+        conclusion_data = parse_json_object(response)
+        if conclusion_data is None:
+            print("ERROR: JSON parsing failed")
+            print(f"ERROR: Problematic text: {response[:1000]}")
             return None
+        print(f"DEBUG: Successfully parsed JSON with keys: {list(conclusion_data.keys())}")
         
         # Validate structure
-        required_fields = ['headline', 'summary', 'top_capabilities', 'recommended_path', 'strengths', 'growth_areas', 'suggested_next_steps', 'confidence']
-        missing_fields = [field for field in required_fields if field not in conclusion_data]
+        missing_fields = [field for field in CONCLUSION_FIELDS if field not in conclusion_data]
         if missing_fields:
             print(f"ERROR: Missing required fields in conclusion: {missing_fields}")
             print(f"ERROR: Available fields: {list(conclusion_data.keys())}")
@@ -409,63 +636,141 @@ def call_llm_conclusion(student_id, trait_scores):
         print("SUCCESS: AI conclusion generated successfully")
         return conclusion_data
         
-    except json.JSONDecodeError as e:
-        print(f"ERROR: JSON parsing error in conclusion: {e}")
-        print(f"ERROR: Response text: {response_text if 'response_text' in locals() else 'No response text'}")
-        return None
     except Exception as e:
-        print(f"ERROR: Exception in call_llm_conclusion: {e}")
+        print(f"ERROR: Exception in generate_conclusion: {e}")
         print(f"ERROR: Response: {response if 'response' in locals() else 'No response'}")
         return None
 
+def is_valid_quiz(quiz_json):
+    return bool(quiz_json) and isinstance(quiz_json, list) and (25 <= len(quiz_json) <= 30)
+
+def store_generated_quiz(student_id, quiz_json):
+    """Persist a freshly generated quiz for a student and return its quizId"""
+    now = datetime.utcnow()
+    quiz_id = str(uuid.uuid4())
+    db.quizzes.insert_one({
+        "studentId": student_id,
+        "quizId": quiz_id,
+        "questions": quiz_json,
+        "scoring": compile_quiz(quiz_json),
+        "createdAt": now,
+        "expiresAt": now + timedelta(days=QUIZ_CACHE_DAYS),
+        # Picked up by the TTL index; the reference quiz is never deleted
+        "disposable": student_id != reference_quizzes.student_id
+    })
+    reference_quizzes.notify_inserted(student_id)
+    return quiz_id
+
+def get_compiled_quiz(quiz_doc):
+    """Scoring matrix for a quiz; quizzes stored before compilation existed are compiled once here"""
+    compiled = quiz_doc.get("scoring")
+    if not compiled:
+        compiled = compile_quiz(quiz_doc["questions"])
+        db.quizzes.update_one({"_id": quiz_doc["_id"]}, {"$set": {"scoring": compiled}})
+    return load_compiled(quiz_doc["quizId"], compiled)
+
+def run_quiz_generation_job(payload, report_progress):
+    """Job handler for "quiz_generate": runs the LLM attempts off the request path"""
+    student_id = payload["studentId"]
+    # Latest profile: the cached copy is dropped on every profile write
+    user = user_profiles.get(student_id)
+    if not user:
+        raise ValueError("Student not found.")
+
+    print(f"Generating personalized quiz for {student_id} using their latest profile...")
+    # One attempt: failed chunks are already retried inside generate_chunked_quiz (bounded by the
+    # shared retry budget), so retrying the whole quiz here would multiply the provider calls
+    report_progress({"stage": "generating", "attempt": 1, "maxAttempts": 1})
+    quiz_json = call_llm_generate_quiz(user)
+    if not is_valid_quiz(quiz_json):
+        print(f"Personalized quiz generation failed for {student_id}.")
+        raise RuntimeError("Failed to generate quiz questions. Please try again after some time.")
+
+    report_progress({"stage": "saving", "attempt": 1, "maxAttempts": 1})
+    return {"quizId": store_generated_quiz(student_id, quiz_json)}
+
+def run_quiz_conclusion_job(payload, report_progress):
+    """Job handler for "quiz_conclusion": analyses a deferred submission"""
+    result = db.quiz_results.find_one({"resultId": payload["resultId"]})
+    if not result:
+        raise ValueError("Quiz result not found.")
+    report_progress({"stage": "analysing"})
+    if not complete_quiz_result(result):
+        raise RuntimeError("Failed to generate analysis")
+    return {"resultId": payload["resultId"]}
+
+job_queue = JobQueue(db.quiz_jobs)
+job_queue.register("quiz_generate", run_quiz_generation_job)
+job_queue.register("quiz_conclusion", run_quiz_conclusion_job)
+# Start workers now so jobs left behind by a restarted process get picked up again
+job_queue.start()
+
+# Ready-made quizzes per (studentType, major/class), refilled through the job queue
+quiz_pool = QuizPoolManager(
+    db.quiz_pool,
+    db.quiz_pool_segments,
+    job_queue,
+    call_llm_generate_quiz,
+    is_valid_quiz
+)
+quiz_pool.start()
+
 # --- Quiz Endpoints ---
 
 @app.route("/quiz/generate", methods=["POST"])
 def generate_quiz():
     data = request.get_json()
     student_id = data.get("studentId")
-    # Always fetch the latest user profile for quiz generation
-    user = users.find_one({"email": student_id})
+    # No LLM call on this path: double clicks and retries share the job through its dedupe key
+    body, status = start_quiz_generation(student_id)
+    return jsonify(body), status
+
+def start_quiz_generation(student_id):
+    """Serve the current/pooled quiz or queue generation; returns (body, status) for /quiz/generate"""
+    # Latest profile: the cached copy is dropped on every profile write
+    user = user_profiles.get(student_id)
     if not user:
-        return jsonify({"error": "Student not found."}), 404
+        return {"error": "Student not found."}, 404
     now = datetime.utcnow()
-    quiz_doc = mongo.db.quizzes.find_one({
+    quiz_doc = db.quizzes.find_one({
         "studentId": student_id,
         "expiresAt": {"$gt": now}
     })
     if quiz_doc:
-        return jsonify({
+        return {
             "quizId": quiz_doc["quizId"],
             "questions": quiz_doc["questions"]
-        }), 200
-
-    # Give Gemini more time to generate before erroring out
-    print(f"Generating personalized quiz for {student_id} using their latest profile...")
-    quiz_json = None
-    max_attempts = 3
-    for attempt in range(max_attempts):
-        quiz_json = call_llm_generate_quiz(user)
-        if quiz_json and isinstance(quiz_json, list) and (25 <= len(quiz_json) <= 30):
-            break
-        print(f"Quiz generation attempt {attempt+1} failed, retrying...")
-        time.sleep(3)  # Wait a bit longer between attempts
-
-    if not quiz_json or not isinstance(quiz_json, list) or not (25 <= len(quiz_json) <= 30):
-        print(f"Personalized quiz generation failed for {student_id} after {max_attempts} attempts.")
-        return jsonify({"error": "Failed to generate quiz questions. Please try again after some time."}), 500
-
-    quiz_id = str(uuid.uuid4())
-    mongo.db.quizzes.insert_one({
-        "studentId": student_id,
-        "quizId": quiz_id,
-        "questions": quiz_json,
-        "createdAt": now,
-        "expiresAt": now + timedelta(days=QUIZ_CACHE_DAYS)
-    })
-    return jsonify({
-        "quizId": quiz_id,
-        "questions": quiz_json
-    }), 200
+        }, 200
+
+    # Hand out a pre-generated quiz for the student's segment when one is ready
+    pooled_questions = quiz_pool.take(user)
+    if pooled_questions:
+        return {
+            "quizId": store_generated_quiz(student_id, pooled_questions),
+            "questions": pooled_questions
+        }, 200
+
+    # Pool is empty: generate on the job workers; the client polls /quiz/jobs/<jobId>
+    job = job_queue.submit("quiz_generate", {"studentId": student_id}, dedupe_key=f"quiz_generate:{student_id}")
+    return {
+        "jobId": job["_id"],
+        "status": job["status"],
+        "statusUrl": f"/quiz/jobs/{job['_id']}"
+    }, 202
+
+@app.route("/quiz/jobs/<job_id>", methods=["GET"])
+def get_quiz_job(job_id):
+    job = job_queue.get(job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+
+    body = serialize_job(job)
+    if job["status"] == "succeeded":
+        quiz_doc = db.quizzes.find_one({"quizId": job["result"]["quizId"]})
+        if quiz_doc:
+            body["quizId"] = quiz_doc["quizId"]
+            body["questions"] = quiz_doc["questions"]
+    return jsonify(body), 200
 
 @app.route("/quiz/submit", methods=["POST"])
 def submit_quiz():
@@ -473,49 +778,224 @@ def submit_quiz():
     student_id = data.get("studentId")
     quiz_id = data.get("quizId")
     answers = data.get("answers")  # {question_id: option_id}
-    quiz_doc = mongo.db.quizzes.find_one({"quizId": quiz_id, "studentId": student_id})
+    if wants_deferred(data):
+        # Scores now, analysis on the job workers; no LLM call on this path to coalesce
+        body, status = finish_quiz_submission(student_id, quiz_id, answers, deferred=True)
+        return jsonify(body), status
+    # A resubmitted answer sheet waits for the analysis already being generated for it
+    body, status = llm_flights.do(
+        flight_key("quiz_submit", student_id, {"quizId": quiz_id, "answers": answers}),
+        lambda: finish_quiz_submission(student_id, quiz_id, answers)
+    )
+    return jsonify(body), status
+
+def wants_deferred(data=None):
+    """Deferred submit is opt-in: ?deferred=1 or {"deferred": true}"""
+    if request.args.get("deferred") in ("1", "true"):
+        return True
+    return bool(data and data.get("deferred") is True)
+
+def finish_quiz_submission(student_id, quiz_id, answers, deferred=False):
+    """Score and store one answer sheet, then analyse it inline or on the job workers.
+    Returns (body, status) for /quiz/submit"""
+    quiz_doc = db.quizzes.find_one({"quizId": quiz_id, "studentId": student_id})
     if not quiz_doc:
-        return jsonify({"error": "Quiz not found"}), 404
-
-    trait_scores = {t: 0 for t in TRAITS}
-    for q in quiz_doc["questions"]:
-        qid = q["id"]
-        opt_id = answers.get(qid)
-        opt = next((o for o in q["options"] if o["id"] == opt_id), None)
-        if opt:
-            for t, v in opt["weights"].items():
-                trait_scores[t] += v
-
-    mongo.db.quiz_answers.insert_one({
-        "studentId": student_id,
-        "quizId": quiz_id,
-        "answers": answers,
-        "submittedAt": datetime.utcnow()
-    })
+        return {"error": "Quiz not found"}, 404
+
+    trait_scores = get_compiled_quiz(quiz_doc).score(answers)
+    result = record_quiz_submission(student_id, quiz_id, answers, trait_scores, len(quiz_doc["questions"]))
+
+    if deferred:
+        if quiz_result_status(result) != "ready":
+            if result.get("status") == "failed":
+                # A new attempt: pollers should wait for it, not see the old failure
+                db.quiz_results.update_one(
+                    {"resultId": result["resultId"], "status": "failed"},
+                    {"$set": {"status": "pending", "updatedAt": datetime.utcnow()}}
+                )
+                result = dict(result, status="pending")
+            job_queue.submit("quiz_conclusion", {"resultId": result["resultId"]},
+                             dedupe_key=f"quiz_conclusion:{result['resultId']}")
+        body, status = quiz_result_body(result)
+        body.update({
+            "resultId": result["resultId"],
+            "traitScores": trait_scores,
+            "resultUrl": f"/quiz/result?resultId={result['resultId']}"
+        })
+        return body, 200 if status == 200 else 202
 
     # Only use LLM for analysis, no fallback
-    conclusion_json = call_llm_conclusion(student_id, trait_scores)
+    conclusion_json = complete_quiz_result(result)
     if not conclusion_json:
-        return jsonify({"error": "Failed to generate analysis"}), 500
+        return {"error": "Failed to generate analysis"}, 500
+    return conclusion_json, 200
 
-    mongo.db.quiz_results.insert_one({
-        "studentId": student_id,
-        "quizId": quiz_id,
-        "resultJson": conclusion_json,
-        "createdAt": datetime.utcnow()
-    })
-    return jsonify(conclusion_json), 200
+def quiz_result_id(student_id, quiz_id, answers):
+    """Same student, quiz and answers -> same result id, so a resubmit finds the stored analysis"""
+    canonical = json.dumps({"quizId": quiz_id, "answers": answers}, sort_keys=True, separators=(",", ":"))
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"carevo:quiz-result:{student_id}:{canonical}"))
+
+def record_quiz_submission(student_id, quiz_id, answers, trait_scores, question_count=None):
+    """Store the answer sheet and its result document once per result id; returns the result document"""
+    result_id = quiz_result_id(student_id, quiz_id, answers)
+    now = datetime.utcnow()
+    try:
+        db.quiz_answers.update_one(
+            {"resultId": result_id},
+            {"$setOnInsert": {
+                "studentId": student_id,
+                "quizId": quiz_id,
+                "answers": answers,
+                "submittedAt": now
+            }},
+            upsert=True
+        )
+        db.quiz_results.update_one(
+            {"resultId": result_id},
+            {"$setOnInsert": {
+                "studentId": student_id,
+                "quizId": quiz_id,
+                "traitScores": trait_scores,
+                "questionCount": question_count,
+                "status": "pending",
+                "createdAt": now
+            }},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass  # a concurrent submit of the same sheet inserted it first
+    # Answered quizzes are kept past expiry so their answer sheets can still be re-scored
+    db.quizzes.update_one({"quizId": quiz_id, "disposable": True}, {"$unset": {"disposable": ""}})
+    return db.quiz_results.find_one({"resultId": result_id})
+
+def quiz_question_count(result):
+    """Length of the quiz a result was scored on; results stored before questionCount look it up"""
+    if result.get("questionCount"):
+        return result["questionCount"]
+    quiz_doc = db.quizzes.find_one({"quizId": result.get("quizId")}, {"questions": 1})
+    return len(quiz_doc["questions"]) if quiz_doc else None
+
+def complete_quiz_result(result):
+    """Generate and store the conclusion of a result document unless it already has one"""
+    if result.get("resultJson"):
+        return result["resultJson"]
+    conclusion_json = call_llm_conclusion(result["studentId"], result["traitScores"], quiz_question_count(result))
+    now = datetime.utcnow()
+    if not conclusion_json:
+        db.quiz_results.update_one(
+            {"resultId": result["resultId"], "status": {"$ne": "ready"}},
+            {"$set": {"status": "failed", "updatedAt": now}}
+        )
+        return None
+    db.quiz_results.update_one(
+        {"resultId": result["resultId"]},
+        {"$set": {"status": "ready", "resultJson": conclusion_json, "updatedAt": now}}
+    )
+    return conclusion_json
+
+def latest_quiz_conclusion(student_id):
+    """resultJson of the student's newest analysed quiz, or None"""
+    doc = db.quiz_results.find_one(
+        {"studentId": student_id, "resultJson": {"$exists": True}},
+        {"resultJson": 1},
+        sort=[("createdAt", -1)]
+    )
+    return doc["resultJson"] if doc else None
+
+def quiz_result_status(result):
+    # Results stored before deferred submits existed have no status but always a resultJson
+    return result.get("status") or ("ready" if result.get("resultJson") else "pending")
+
+def quiz_result_body(result):
+    """(body, status code) for a result document in any state"""
+    status = quiz_result_status(result)
+    if status == "ready":
+        return result["resultJson"], 200
+    if status == "failed":
+        return {"error": "Failed to generate analysis", "status": "failed", "resultId": result.get("resultId")}, 500
+    return {"status": "pending", "resultId": result.get("resultId"), "traitScores": result.get("traitScores")}, 202
+
+@app.route("/quiz/score-batch", methods=["POST"])
+def score_quiz_batch():
+    """Re-score submissions in bulk.
+
+    Either pass {"submissions": [{"quizId", "studentId", "answers"}, ...]} or
+    {"quizId": ...} to re-score every stored answer sheet for that quiz.
+    """
+    data = request.get_json(silent=True) or {}
+    submissions = data.get("submissions")
+    if submissions is not None:
+        if not isinstance(submissions, list):
+            return jsonify({"error": "submissions must be a list"}), 400
+        for i, s in enumerate(submissions):
+            if not isinstance(s, dict) or not isinstance(s.get("quizId"), str) or not isinstance(s.get("answers"), dict):
+                return jsonify({"error": f"submissions[{i}] needs a quizId string and an answers object"}), 400
+    else:
+        quiz_id = data.get("quizId")
+        if not quiz_id:
+            return jsonify({"error": "Provide submissions or quizId"}), 400
+        submissions = list(db.quiz_answers.find(
+            {"quizId": quiz_id},
+            {"_id": 0, "quizId": 1, "studentId": 1, "answers": 1}
+        ))
+
+    quiz_ids = list({s.get("quizId") for s in submissions})
+    compiled_by_quiz = {}
+    for quiz_doc in db.quizzes.find({"quizId": {"$in": quiz_ids}}, {"quizId": 1, "questions": 1, "scoring": 1}):
+        compiled_by_quiz[quiz_doc["quizId"]] = get_compiled_quiz(quiz_doc)
+
+    scores = score_batch(compiled_by_quiz, submissions)
+    return jsonify({
+        "results": [
+            {"quizId": s.get("quizId"), "studentId": s.get("studentId"), "traitScores": trait_scores}
+            for s, trait_scores in zip(submissions, scores)
+        ]
+    }), 200
 
 @app.route("/quiz/result", methods=["GET"])
 def get_quiz_result():
+    """Latest (or ?resultId=) quiz analysis. A pending one is waited for up to ?wait= seconds,
+    or pushed over SSE when it is ready (?stream=1 / Accept: text/event-stream)"""
     student_id = request.args.get("studentId")
-    result = mongo.db.quiz_results.find_one(
-        {"studentId": student_id},
-        sort=[("createdAt", -1)]
-    )
+    result_id = request.args.get("resultId")
+    query = {}
+    if student_id:
+        query["studentId"] = student_id
+    if result_id:
+        query["resultId"] = result_id
+    result = db.quiz_results.find_one(query, sort=[("createdAt", -1)]) if query else None
     if not result:
         return jsonify({"error": "No result found"}), 404
-    return jsonify(result["resultJson"]), 200
+
+    if wants_stream():
+        return sse_response(quiz_result_events(result))
+    try:
+        wait = min(float(request.args.get("wait") or 0), QUIZ_RESULT_MAX_WAIT_SECONDS)
+    except ValueError:
+        wait = 0
+    body, status = quiz_result_body(wait_for_quiz_result(result, wait))
+    return jsonify(body), status
+
+def wait_for_quiz_result(result, timeout):
+    """Re-read a pending result until it is ready/failed or `timeout` seconds have passed"""
+    deadline = time.time() + timeout
+    while quiz_result_status(result) == "pending" and result.get("resultId") and time.time() < deadline:
+        time.sleep(QUIZ_RESULT_POLL_SECONDS)
+        result = db.quiz_results.find_one({"resultId": result["resultId"]}) or result
+    return result
+
+def quiz_result_events(result):
+    """SSE: a "pending" event with the trait scores, then "done" with the analysis (or "error")"""
+    if quiz_result_status(result) == "pending":
+        yield sse_event({"status": "pending", "resultId": result.get("resultId"), "traitScores": result.get("traitScores")})
+        result = wait_for_quiz_result(result, QUIZ_RESULT_STREAM_SECONDS)
+    body, status = quiz_result_body(result)
+    if status == 200:
+        yield sse_event({"result": body}, event="done")
+    elif status == 202:
+        yield sse_event({"error": "Analysis is still being generated", "resultId": result.get("resultId")}, event="error")
+    else:
+        yield sse_event(body, event="error")
 
 # SIGNUP ROUTE
 @app.route("/signup", methods=["POST"])
@@ -557,8 +1037,11 @@ def signup():
     else:
         user_doc["class"] = ""  # Will be filled later
 
-    # Insert into MongoDB
-    users.insert_one(user_doc)
+    # Insert into MongoDB; the unique email index settles concurrent signups for the same address
+    try:
+        users.insert_one(user_doc)
+    except DuplicateKeyError:
+        return jsonify({"message": "User already exists"}), 409
     
     # Generate JWT token to automatically log them in
     token = jwt.encode(
@@ -722,7 +1205,7 @@ def check_auth():
         payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
         email = payload['email']
         
-        user = users.find_one({"email": email}, {"_id": 0, "password": 0})
+        user = user_profiles.get(email)
         if user:
             return jsonify({
                 "authenticated": True,
@@ -743,7 +1226,7 @@ def get_user():
     if not email:
         return jsonify({"message": "Missing email"}), 400
 
-    user = users.find_one({"email": email}, {"_id": 0, "password": 0})
+    user = user_profiles.get(email)
     if not user:
         return jsonify({"message": "User not found"}), 404
 
@@ -769,8 +1252,8 @@ def ai():
         except jwt.InvalidTokenError:
             return jsonify({"error": "Invalid token"}), 401
 
-        user = users.find_one({"email": email}, {"_id": 0, "password": 0})
-        res = mongo.db.quiz_results.find_one({"email": email}, {"_id": 0, "password": 0})
+        profile = profile_digests.get(email)
+        res = db.quiz_results.find_one({"email": email}, {"_id": 0, "password": 0})
 
         if not email:
             return jsonify({"error": "Email not found in token"}), 400
@@ -781,10 +1264,20 @@ def ai():
         if not prompt:
             return jsonify({"error": "No prompt provided"}), 400
 
-        updprompt = f" this is information about the User/the person you are chatting with : {user} and this is the psycometric quiz results : {res} and this is thePrompt: {prompt} answer in 50 words or less"
+        updprompt = (
+            PromptAssembler("ai")
+            .add(" this is information about the User/the person you are chatting with : ")
+            .add(prompt_profile(profile or {}, "chat"), priority=1, name="profile")
+            .add(" and this is the psycometric quiz results : ")
+            .add(str(res), priority=0, name="quiz results")
+            .add(" and this is thePrompt: ")
+            .add(prompt, priority=2, name="message")
+            .add(" answer in 50 words or less")
+            .build()
+        )
 
         # Call your AI function
-        plan = call_gemini_api(updprompt)
+        plan = call_gemini_api(updprompt, call_site="ai")
 
         return jsonify({
             "email": email,
@@ -832,8 +1325,8 @@ def update_user():
     if not update_fields:
         return jsonify({"error": "No fields to update"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": update_fields}
     )
     
@@ -850,8 +1343,8 @@ def update_cgpa():
     if not email or cgpa is None:
         return jsonify({"error": "Missing email or cgpa"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"cgpa": cgpa}}
     )
     if result.matched_count:
@@ -867,8 +1360,8 @@ def update_projects():
     if not email or projects is None:
         return jsonify({"error": "Missing email or projects"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"projects": projects}}
     )
     if result.matched_count:
@@ -884,8 +1377,8 @@ def update_experiences():
     if not email or experiences is None:
         return jsonify({"error": "Missing email or experiences"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"experiences": experiences}}
     )
     if result.matched_count:
@@ -901,8 +1394,8 @@ def update_certifications():
     if not email or certifications is None:
         return jsonify({"error": "Missing email or certifications"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"certifications": certifications}}
     )
     if result.matched_count:
@@ -918,8 +1411,8 @@ def update_term_data():
     if not email or term_data is None:
         return jsonify({"error": "Missing email or term data"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"termData": term_data}}
     )
     if result.matched_count:
@@ -935,8 +1428,8 @@ def update_extracurricular():
     if not email or extracurricular_activities is None:
         return jsonify({"error": "Missing email or extracurricular activities"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"extracurricularActivities": extracurricular_activities}}
     )
     if result.matched_count:
@@ -952,8 +1445,8 @@ def update_subjects():
     if not email or subjects is None:
         return jsonify({"error": "Missing email or subjects"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"subjects": subjects}}
     )
     if result.matched_count:
@@ -969,8 +1462,8 @@ def update_study_plan():
     if not email or study_plan is None:
         return jsonify({"error": "Missing email or study plan"}), 400
 
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"studyPlan": study_plan}}
     )
     if result.matched_count:
@@ -984,29 +1477,38 @@ def academic_planning():
     if not email:
         return jsonify({"error": "Email required"}), 400
 
-    user = users.find_one({"email": email}, {"_id": 0, "password": 0})
-    if not user:
+    profile = profile_digests.get(email)
+    if not profile:
         return jsonify({"error": "User not found"}), 404
 
-    quiz_result = user.get("quiz_result")
+    quiz_result = (user_profiles.get(email, ["quiz_result"]) or {}).get("quiz_result")
     if not quiz_result:
-        quiz_doc = mongo.db.quiz_results.find_one({"studentId": email}, sort=[("createdAt", -1)])
-        quiz_result = quiz_doc["resultJson"] if quiz_doc else None
+        quiz_result = latest_quiz_conclusion(email)
 
-    if not user or not quiz_result:
+    if not quiz_result:
+        missing_plan = "Your academic plan cannot be generated until you complete your profile and quiz. Please make sure you have filled out your profile and completed the quiz for a personalized plan."
+        if wants_stream(data):
+            return stream_static_response(missing_plan, "plan")
         return jsonify({
-            "plan": "Your academic plan cannot be generated until you complete your profile and quiz. Please make sure you have filled out your profile and completed the quiz for a personalized plan."
+            "plan": missing_plan
         })
 
-    plan_prompt = f"""
+    plan_prompt = (
+        PromptAssembler("academic_plan")
+        .add("""
     You are an expert academic counselor for Indian students.
     ONLY use the information provided below. If any information is missing, DO NOT ask the user for it. Generate a concise, actionable, and achievable academic plan for the next 6 months.
 
     Student Profile:
-    {json.dumps(user, indent=2)}
+    """)
+        .add(prompt_profile(profile, "academic_plan"), priority=1, name="profile")
+        .add("""
 
     Quiz Analysis:
-    {json.dumps(quiz_result, indent=2)}
+    """)
+        .add(json.dumps(quiz_result, indent=2), priority=2, name="quiz analysis",
+             summary=json.dumps(summarize_quiz_result(quiz_result), ensure_ascii=False))
+        .add("""
 
     The plan should:
     - Be tailored to the student's strengths, growth areas, and recommended career path from the quiz analysis
@@ -1016,57 +1518,79 @@ def academic_planning():
     - Use clear, encouraging language
 
     Return only the plan text. Do NOT ask for more information.
-    """
+    """)
+        .build()
+    )
 
-    try:
-        plan = call_gemini_api(plan_prompt)
-    except Exception as e:
-        plan = "Sorry, could not generate a personalized academic plan at this time."
+    if wants_stream(data):
+        return stream_llm_response(plan_prompt, "plan", call_site="academic_plan")
 
+    def generate_plan():
+        try:
+            return call_gemini_api(plan_prompt, call_site="academic_plan")
+        except Exception as e:
+            return "Sorry, could not generate a personalized academic plan at this time."
+
+    # Keyed by the prompt itself, so a changed profile or quiz result is a different flight
+    plan = llm_flights.do(flight_key("academic_plan", email, plan_prompt), generate_plan)
     return jsonify({"plan": plan})
 
-@app.route("/mental_health_chat", methods=["POST"])
-def mental_health_chat():
-    data = request.get_json()
-    message = data.get("message")
-    
-    if not message:
-        return jsonify({"error": "Missing message"}), 400
-    
-    # Get user email from JWT token in cookies
-    token = request.cookies.get('auth_token')
-    if not token:
-        return jsonify({"error": "Authentication required"}), 401
-    
-    try:
-        payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
-        email = payload['email']
-    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
-        return jsonify({"error": "Invalid or expired token"}), 401
-    
-    # Fetch student details
-    user = users.find_one({"email": email}, {"_id": 0, "password": 0})
-    if not user:
-        return jsonify({"error": "User not found"}), 404
-    
-    # Compose prompt for AI based on message content
-    message_lower = message.lower()
-    
-    if "anxious" in message_lower or "stressed" in message_lower or "worried" in message_lower:
-        prompt = (
-            "You are a caring friend talking to an Indian student who feels anxious. "
-            "First, offer gentle consolation in about 100 words, using a friendly and supportive tone. "
-            "Then, ask them kindly to share more about what's making them feel this way. "
-            "Do not give solutions or advice yet. Just listen and show empathy, like a friend would."
-            f"\n\nStudent's message: {message}\nFriend:"
-        )
-    elif "academic planning" in message_lower or "academic journey" in message_lower or "subjects" in message_lower or "courses" in message_lower:
-        quiz_result = user.get("quiz_result")
-        if not quiz_result:
-            quiz_doc = mongo.db.quiz_results.find_one({"studentId": email}, sort=[("createdAt", -1)])
-            quiz_result = quiz_doc["resultJson"] if quiz_doc else None
+def build_study_plan_prompt(profile, current_grades):
+    """Study plan prompt shared by the chat flow and /save-study-plan"""
+    return (
+        PromptAssembler("study_plan")
+        .add("You are an expert academic counselor for Indian students. Create a comprehensive, detailed study plan.\n\nStudent Profile: ")
+        .add(prompt_profile(profile, "study_plan"), priority=1, name="profile")
+        .add("\nCurrent Academic Performance: ")
+        .add(json.dumps(current_grades, ensure_ascii=False, default=str), priority=2, name="grades")
+        .add("""
+
+Based on their profile and performance, create a detailed, structured study plan with:
+
+1. **Grade Analysis**: Compare current performance with past trends and identify areas for improvement
+2. **Goal Assessment**: Evaluate if their goals are realistic and achievable
+3. **Comprehensive Study Plan**: Include:
+   - Weekly study schedule with specific time slots
+   - Subject-wise focus areas with priority levels
+   - Time management strategies and techniques
+   - Study techniques and learning methods
+   - Progress tracking methods and milestones
+   - Exam preparation timeline with specific dates
+   - Daily and weekly goals
+   - Study environment recommendations
+   - Break and rest schedules
+   - Motivation and stress management tips
+
+Format the response as a detailed, actionable study plan that can be saved and followed. Make it comprehensive and practical for Indian students. Include specific actionable items and detailed strategies.""")
+        .build()
+    )
+
+# Chat intent handlers: (message, email, profile, session_id) -> (call_site, prompt).
+# A call_site of None means the second value is the final reply and no LLM call is made.
+
+def chat_static_reply(intent):
+    def handler(message, email, profile, session_id):
+        return None, STATIC_REPLIES[intent]
+    return handler
+
+def chat_anxious_prompt(message, email, profile, session_id):
+    return "chat", (
+        "You are a caring friend talking to an Indian student who feels anxious. "
+        "First, offer gentle consolation in about 100 words, using a friendly and supportive tone. "
+        "Then, ask them kindly to share more about what's making them feel this way. "
+        "Do not give solutions or advice yet. Just listen and show empathy, like a friend would."
+        f"\n\nStudent's message: {message}\nFriend:"
+    )
+
+def chat_academic_plan_prompt(message, email, profile, session_id):
+    quiz_result = (user_profiles.get(email, ["quiz_result"]) or {}).get("quiz_result")
+    if not quiz_result:
+        quiz_result = latest_quiz_conclusion(email)
 
-        prompt = f"""
+    call_site = "academic_plan"
+    return call_site, (
+        PromptAssembler(call_site)
+        .add("""
         You are an expert academic counselor for Indian students.
         Based on the student's profile and quiz analysis below, generate a concise academic plan for the next 6 months.
 
@@ -1078,18 +1602,31 @@ def mental_health_chat():
         - Use only the information provided below. Do NOT ask the user for more info.
 
         STUDENT PROFILE:
-        {json.dumps(user, indent=2)}
+        """)
+        .add(prompt_profile(profile, "academic_plan"), priority=1, name="profile")
+        .add("""
 
         QUIZ ANALYSIS:
-        {json.dumps(quiz_result, indent=2)}
+        """)
+        .add(json.dumps(quiz_result, indent=2), priority=2, name="quiz analysis",
+             summary=json.dumps(summarize_quiz_result(quiz_result), ensure_ascii=False))
+        .add("""
 
         Return only the plan and the 5 bullet points.
-        """
-    elif "goals" in message_lower and ("academic" in message_lower or "study" in message_lower):
-        # User is providing their academic goals
-        prompt = f"""You are an academic counselor for Indian students. The student has shared their academic goals: {message}
+        """)
+        .build()
+    )
 
-Based on their goals and profile: {user}
+def chat_goals_prompt(message, email, profile, session_id):
+    # User is providing their academic goals
+    call_site = "goals"
+    return call_site, (
+        PromptAssembler(call_site)
+        .add("You are an academic counselor for Indian students. The student has shared their academic goals: ")
+        .add(message, priority=2, name="message")
+        .add("\n\nBased on their goals and profile: ")
+        .add(prompt_profile(profile, "goals"), priority=1, name="profile")
+        .add("""
 
 1. Acknowledge their goals and show understanding
 2. Ask if they want you to create a comprehensive study plan
@@ -1101,96 +1638,46 @@ Based on their goals and profile: {user}
    - Progress tracking methods
 4. Ask for confirmation to proceed
 
-Keep response under 100 words and be encouraging."""
-    elif "yes" in message_lower and ("create" in message_lower or "plan" in message_lower or "proceed" in message_lower):
-        # User confirmed to create study plan
-        current_grades = {}
-        if user.get("studentType") == "college" and user.get("cgpa"):
-            current_grades["CGPA"] = user["cgpa"]
-        elif user.get("studentType") == "school":
-            if user.get("termData"):
-                current_grades["Term Data"] = user["termData"]
-            if user.get("subjects"):
-                current_grades["Subjects"] = user["subjects"]
-        
-        # Create comprehensive study plan
-        study_plan_prompt = f"""You are an expert academic counselor for Indian students. Create a comprehensive, detailed study plan.
-
-Student Profile: {user}
-Current Academic Performance: {current_grades}
-
-Based on their profile and performance, create a detailed, structured study plan with:
-
-1. **Grade Analysis**: Compare current performance with past trends and identify areas for improvement
-2. **Goal Assessment**: Evaluate if their goals are realistic and achievable
-3. **Comprehensive Study Plan**: Include:
-   - Weekly study schedule with specific time slots
-   - Subject-wise focus areas with priority levels
-   - Time management strategies and techniques
-   - Study techniques and learning methods
-   - Progress tracking methods and milestones
-   - Exam preparation timeline with specific dates
-   - Daily and weekly goals
-   - Study environment recommendations
-   - Break and rest schedules
-   - Motivation and stress management tips
-
-Format the response as a detailed, actionable study plan that can be saved and followed. Make it comprehensive and practical for Indian students. Include specific actionable items and detailed strategies."""
-
-        try:
-            study_plan_response = call_gemini_api(study_plan_prompt)
-            
-            prompt = f"""Perfect! I've created a comprehensive study plan for you based on your academic profile and goals.
-
-Here's what I've included:
-• Analysis of your current performance
-• Personalized study schedule
-• Subject-wise focus areas
-• Time management strategies
-• Study techniques and exam preparation timeline
-
-Would you like me to save this study plan to your Study Plan page so you can track your progress and manage your tasks?
+Keep response under 100 words and be encouraging.""")
+        .build()
+    )
 
-Just say "Yes, save it" and I'll add it to your Study Plan page with actionable tasks you can check off as you complete them."""
-            
-        except Exception as e:
-            prompt = f"Sorry, there was an error creating your study plan. Please try again. Error: {str(e)}"
-    elif "save" in message_lower and ("yes" in message_lower or "okay" in message_lower):
-        # User wants to save the study plan
-        prompt = """Excellent! I've saved your study plan to your Study Plan page. 
-
-You can now:
-• Visit the Study Plan page to see your complete plan
-• Check off tasks as you complete them
-• Add new tasks or edit existing ones
-• Track your progress over time
-
-Your study plan is now ready to help you achieve your academic goals! 🎯"""
-    elif "satisfied" in message_lower or "good" in message_lower or "perfect" in message_lower or "great" in message_lower:
-        # User is satisfied with the plan
-        prompt = """Great! I'm glad you're satisfied with the study plan. 
-
-Would you like me to save this study plan to your Study Plan page so you can track your progress and manage your tasks?
-
-Just say "Yes, save it" and I'll add it to your Study Plan page with actionable tasks you can check off as you complete them."""
-    elif "not satisfied" in message_lower or "change" in message_lower or "modify" in message_lower or "different" in message_lower:
-        # User wants changes to the plan
-        prompt = """I understand you'd like some changes to the study plan. 
-
-Please let me know what specific aspects you'd like me to modify:
-• Study schedule timing
-• Subject priorities
-• Study techniques
-• Time management approach
-• Or any other specific areas
-
-I'll create a revised plan that better meets your needs."""
-    else:
-        # For specific subject/course queries, provide detailed responses
-        if any(word in message_lower for word in ["math", "mathematics", "english", "grammar", "science", "physics", "chemistry", "biology", "history", "geography", "economics", "computer", "programming"]):
-            prompt = f"""You are an expert academic counselor for Indian students. The student is asking about: {message}
+def chat_create_plan(message, email, profile, session_id):
+    # User confirmed to create study plan
+    current_grades = profile.get("grades", {})
+    
+    # Create comprehensive study plan
+    study_plan_prompt = build_study_plan_prompt(profile, current_grades)
 
-Student Profile: {user}
+    try:
+        study_plan_response = call_gemini_api(study_plan_prompt, use_cache=False, call_site="study_plan")
+        if not study_plan_response:
+            raise Exception("No response from Gemini API")
+        # Kept with the conversation so /save-study-plan saves this plan instead of generating another
+        chat_state.update(email, session_id, studyPlanDraft={
+            "content": study_plan_response,
+            "grades": current_grades,
+            "createdAt": datetime.now().isoformat(),
+        })
+        return None, STUDY_PLAN_CREATED_REPLY
+    except Exception as e:
+        return None, f"Sorry, there was an error creating your study plan. Please try again. Error: {str(e)}"
+
+def chat_modify_plan(message, email, profile, session_id):
+    # The student wants a different plan: the current draft must not be saved
+    chat_state.update(email, session_id, studyPlanDraft=None)
+    return None, STATIC_REPLIES["modify_plan"]
+
+def chat_subject_help_prompt(message, email, profile, session_id):
+    # For specific subject/course queries, provide detailed responses
+    call_site = "subject_help"
+    return call_site, (
+        PromptAssembler(call_site)
+        .add("You are an expert academic counselor for Indian students. The student is asking about: ")
+        .add(message, priority=2, name="message")
+        .add("\n\nStudent Profile: ")
+        .add(prompt_profile(profile, "subject_help"), priority=1, name="profile")
+        .add("""
 
 Provide a comprehensive, detailed response that includes:
 
@@ -1204,12 +1691,72 @@ Provide a comprehensive, detailed response that includes:
 4. **Progress Tracking**: How to measure improvement
 5. **Additional Resources**: Online courses, apps, or supplementary materials
 
-Make the response detailed, practical, and actionable. Include specific book recommendations, study schedules, and practice exercises. Keep it comprehensive and helpful for Indian students."""
-        else:
-            prompt = f"You are an academic counselor for Indian students. Here is the student's profile: {user}.\n\nStudent's message: {message}\n\nRespond empathetically and helpfully, considering their background. Provide practical academic and career guidance. Keep response under 100 words and use Indian context."
+Make the response detailed, practical, and actionable. Include specific book recommendations, study schedules, and practice exercises. Keep it comprehensive and helpful for Indian students.""")
+        .build()
+    )
+
+def chat_reply_prompt(message, email, profile, session_id):
+    call_site = "chat"
+    return call_site, (
+        PromptAssembler(call_site)
+        .add("You are an academic counselor for Indian students. Here is the student's profile: ")
+        .add(prompt_profile(profile, "chat"), priority=1, name="profile")
+        .add(".\n\nStudent's message: ")
+        .add(message, priority=2, name="message")
+        .add("\n\nRespond empathetically and helpfully, considering their background. Provide practical academic and career guidance. Keep response under 100 words and use Indian context.")
+        .build()
+    )
+
+CHAT_INTENT_HANDLERS = {
+    "anxious": chat_anxious_prompt,
+    "academic_plan": chat_academic_plan_prompt,
+    "goals": chat_goals_prompt,
+    "create_plan": chat_create_plan,
+    "save_plan": chat_static_reply("save_plan"),
+    "modify_plan": chat_modify_plan,
+    "satisfied": chat_static_reply("satisfied"),
+    "subject_help": chat_subject_help_prompt,
+    FALLBACK_INTENT: chat_reply_prompt,
+}
+
+@app.route("/mental_health_chat", methods=["POST"])
+def mental_health_chat():
+    data = request.get_json()
+    message = data.get("message")
+    
+    if not message:
+        return jsonify({"error": "Missing message"}), 400
+    
+    # Get user email from JWT token in cookies
+    token = request.cookies.get('auth_token')
+    if not token:
+        return jsonify({"error": "Authentication required"}), 401
     
     try:
-        reply = call_gemini_api(prompt)
+        payload = jwt.decode(token, app.secret_key, algorithms=['HS256'])
+        email = payload['email']
+    except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
+        return jsonify({"error": "Invalid or expired token"}), 401
+    
+    # Fetch student details (prompt-sized digest, not the whole user document)
+    profile = profile_digests.get(email)
+    if not profile:
+        return jsonify({"error": "User not found"}), 404
+    
+    intent = chat_intents.classify(message)
+    call_site, prompt = CHAT_INTENT_HANDLERS.get(intent, chat_reply_prompt)(message, email, profile, data.get("sessionId"))
+    if call_site is None:
+        # Canned reply: nothing for the LLM to add
+        chat_intents.record_static()
+        if wants_stream(data):
+            return stream_static_response(prompt, "reply")
+        return jsonify({"reply": prompt})
+    
+    if wants_stream(data):
+        return stream_llm_response(prompt, "reply", call_site=call_site)
+
+    try:
+        reply = call_gemini_api(prompt, call_site=call_site)
         return jsonify({"reply": reply})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1255,48 +1802,29 @@ def save_study_plan():
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid or expired token"}), 401
     
-    # Fetch student details
-    user = users.find_one({"email": email}, {"_id": 0, "password": 0})
-    if not user:
+    # Fetch student details (prompt-sized digest, not the whole user document)
+    profile = profile_digests.get(email)
+    if not profile:
         return jsonify({"error": "User not found"}), 404
     
-    # Analyze current academic performance
-    current_grades = {}
-    if user.get("studentType") == "college":
-        if user.get("cgpa"):
-            current_grades["CGPA"] = user["cgpa"]
-    elif user.get("studentType") == "school":
-        if user.get("termData"):
-            current_grades["Term Data"] = user["termData"]
-        if user.get("subjects"):
-            current_grades["Subjects"] = user["subjects"]
-    
-    # Create comprehensive study plan
-    study_plan_prompt = f"""You are an expert academic counselor for Indian students. Create a comprehensive, detailed study plan.
-
-Student Profile: {user}
-Current Academic Performance: {current_grades}
-
-Based on their profile and performance, create a detailed, structured study plan with:
-
-1. **Grade Analysis**: Compare current performance with past trends and identify areas for improvement
-2. **Goal Assessment**: Evaluate if their goals are realistic and achievable
-3. **Comprehensive Study Plan**: Include:
-   - Weekly study schedule with specific time slots
-   - Subject-wise focus areas with priority levels
-   - Time management strategies and techniques
-   - Study techniques and learning methods
-   - Progress tracking methods and milestones
-   - Exam preparation timeline with specific dates
-   - Daily and weekly goals
-   - Study environment recommendations
-   - Break and rest schedules
-   - Motivation and stress management tips
-
-Format the response as a detailed, actionable study plan that can be saved and followed. Make it comprehensive and practical for Indian students. Include specific actionable items and detailed strategies."""
+    # The plan drafted earlier in the chat, if any; generated here only when there is none.
+    # Read from Mongo, not this worker's copy: another worker may have replaced or cleared it
+    session_id = data.get("sessionId")
+    draft = chat_state.get(email, session_id, fresh=True).get("studyPlanDraft")
+    if draft and draft.get("grades", {}) != profile.get("grades", {}):
+        draft = None  # drafted before the grades changed
 
     try:
-        study_plan_response = call_gemini_api(study_plan_prompt)
+        if draft:
+            current_grades = draft.get("grades", {})
+            study_plan_response = draft["content"]
+        else:
+            # Analyze current academic performance
+            current_grades = profile.get("grades", {})
+
+            # Create comprehensive study plan
+            study_plan_prompt = build_study_plan_prompt(profile, current_grades)
+            study_plan_response = call_gemini_api(study_plan_prompt, use_cache=False, call_site="study_plan")
         
         # Generate a structured study plan object with comprehensive tasks
         study_plan = {
@@ -1358,12 +1886,14 @@ Format the response as a detailed, actionable study plan that can be saved and f
         }
         
         # Save to database
-        result = users.update_one(
-            {"email": email},
+        result = update_user_document(
+            email,
             {"$set": {"studyPlan": study_plan}}
         )
         
         if result.matched_count:
+            # Saved once; a later save starts from a new plan
+            chat_state.update(email, session_id, studyPlanDraft=None)
             return jsonify({
                 "message": "Study plan saved successfully",
                 "study_plan": study_plan
@@ -1381,8 +1911,8 @@ def save_quiz_result():
     quiz_result = data.get("quiz_result")
     if not email or quiz_result is None:
         return jsonify({"error": "Missing email or quiz_result"}), 400
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$set": {"quiz_result": quiz_result}}
     )
     if result.matched_count:
@@ -1394,7 +1924,7 @@ def get_user_quiz_result():
     email = request.args.get("email")
     if not email:
         return jsonify({"error": "Email required"}), 400
-    user = users.find_one({"email": email}, {"_id": 0, "quiz_result": 1})
+    user = user_profiles.get(email, ["quiz_result"])
     if not user or "quiz_result" not in user:
         return jsonify({"quiz_result": None}), 200
     return jsonify({"quiz_result": user["quiz_result"]}), 200
@@ -1404,8 +1934,8 @@ def delete_quiz_result():
     email = request.args.get("email")
     if not email:
         return jsonify({"error": "Email required"}), 400
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$unset": {"quiz_result": ""}}
     )
     if result.matched_count:
@@ -1422,7 +1952,7 @@ def save_academic_plan():
     if not email or not academic_plan:
         return jsonify({"error": "Missing email or academic plan"}), 400
 
-    result = mongo.db.quiz_results.update_one(
+    result = db.quiz_results.update_one(
         {"studentId": email},
         {"$set": {"accepted_study_plan": academic_plan}},
         upsert=True
@@ -1439,7 +1969,7 @@ def get_study_plan():
         return jsonify({"error": "Email required"}), 400
 
     # Get overall percentage from users database
-    user = mongo.db.users.find_one({"email": email}, {"_id": 0, "termData": 1})
+    user = user_profiles.get(email, ["termData"])
     overall_percentage = None
     if user and "termData" in user and user["termData"]:
         valid_terms = [term for term in user["termData"] if term.get("percentage")]
@@ -1448,7 +1978,7 @@ def get_study_plan():
             overall_percentage = round(avg, 1)
 
     # Get study plan and tasks from quiz_results database
-    quiz_doc = mongo.db.quiz_results.find_one({"studentId": email}, {"_id": 0, "accepted_study_plan": 1, "tasks": 1})
+    quiz_doc = db.quiz_results.find_one({"studentId": email}, {"_id": 0, "accepted_study_plan": 1, "tasks": 1})
     study_plan = quiz_doc.get("accepted_study_plan") if quiz_doc else None
     tasks = quiz_doc.get("tasks") if quiz_doc and "tasks" in quiz_doc else []
 
@@ -1474,7 +2004,7 @@ def get_projects():
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid token"}), 401
     
-    user = users.find_one({"email": email}, {"_id": 0, "projects": 1})
+    user = user_profiles.get(email, ["projects"])
     projects = user.get("projects", []) if user else []
     return jsonify({"projects": projects}), 200
 
@@ -1499,8 +2029,8 @@ def add_project():
         "createdAt": datetime.utcnow().isoformat()
     }
     
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$push": {"projects": project}}
     )
     
@@ -1521,8 +2051,8 @@ def delete_project(project_id):
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid token"}), 401
     
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$pull": {"projects": {"id": project_id}}}
     )
     
@@ -1545,7 +2075,7 @@ def get_work_experience():
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid token"}), 401
     
-    user = users.find_one({"email": email}, {"_id": 0, "workExperience": 1})
+    user = user_profiles.get(email, ["workExperience"])
     work_experience = user.get("workExperience", []) if user else []
     return jsonify({"workExperience": work_experience}), 200
 
@@ -1571,8 +2101,8 @@ def add_work_experience():
         "createdAt": datetime.utcnow().isoformat()
     }
     
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$push": {"workExperience": experience}}
     )
     
@@ -1593,8 +2123,8 @@ def delete_work_experience(experience_id):
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid token"}), 401
     
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$pull": {"workExperience": {"id": experience_id}}}
     )
     
@@ -1617,7 +2147,7 @@ def get_events():
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid token"}), 401
     
-    user = users.find_one({"email": email}, {"_id": 0, "events": 1})
+    user = user_profiles.get(email, ["events"])
     events = user.get("events", []) if user else []
     return jsonify({"events": events}), 200
 
@@ -1644,8 +2174,8 @@ def add_event():
         "createdAt": datetime.utcnow().isoformat()
     }
     
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$push": {"events": event}}
     )
     
@@ -1666,8 +2196,8 @@ def delete_event(event_id):
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid token"}), 401
     
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$pull": {"events": {"id": event_id}}}
     )
     
@@ -1690,7 +2220,7 @@ def get_semesters():
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid token"}), 401
     
-    user = users.find_one({"email": email}, {"_id": 0, "semesters": 1})
+    user = user_profiles.get(email, ["semesters"])
     semesters = user.get("semesters", []) if user else []
     
     # Calculate overall CGPA
@@ -1726,8 +2256,8 @@ def add_semester():
         "createdAt": datetime.utcnow().isoformat()
     }
     
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$push": {"semesters": semester}}
     )
     
@@ -1748,8 +2278,8 @@ def delete_semester(semester_id):
     except (jwt.ExpiredSignatureError, jwt.InvalidTokenError):
         return jsonify({"error": "Invalid token"}), 401
     
-    result = users.update_one(
-        {"email": email},
+    result = update_user_document(
+        email,
         {"$pull": {"semesters": {"id": semester_id}}}
     )
     
@@ -1757,6 +2287,75 @@ def delete_semester(semester_id):
         return jsonify({"message": "Semester deleted"}), 200
     return jsonify({"error": "Semester not found"}), 404
 
+# --- Diagnostics Endpoints ---
+
+@app.route("/diagnostics/http-pool", methods=["GET"])
+def http_pool_diagnostics():
+    return jsonify(http_pool.get_pool_stats()), 200
+
+@app.route("/diagnostics/llm-cache", methods=["GET"])
+def llm_cache_diagnostics():
+    return jsonify(llm_cache.stats()), 200
+
+@app.route("/diagnostics/quiz-pool", methods=["GET"])
+def quiz_pool_diagnostics():
+    return jsonify(quiz_pool.stats()), 200
+
+@app.route("/diagnostics/user-cache", methods=["GET"])
+def user_cache_diagnostics():
+    return jsonify({"profiles": user_profiles.stats(), "digests": profile_digests.stats()}), 200
+
+@app.route("/diagnostics/prompt-sizes", methods=["GET"])
+def prompt_size_diagnostics():
+    return jsonify(prompt_metrics.snapshot()), 200
+
+@app.route("/diagnostics/gemini-keys", methods=["GET"])
+def gemini_key_diagnostics():
+    return jsonify(gemini_key_scheduler.stats()), 200
+
+@app.route("/diagnostics/llm-router", methods=["GET"])
+def llm_router_diagnostics():
+    return jsonify(llm_router.snapshot()), 200
+
+@app.route("/diagnostics/llm-resilience", methods=["GET"])
+def llm_resilience_diagnostics():
+    return jsonify(resilience_snapshot()), 200
+
+@app.route("/diagnostics/chat-intents", methods=["GET"])
+def chat_intents_diagnostics():
+    return jsonify(chat_intents.stats()), 200
+
+@app.route("/diagnostics/chat-state", methods=["GET"])
+def chat_state_diagnostics():
+    return jsonify(chat_state.stats()), 200
+
+@app.route("/diagnostics/conclusion-cache", methods=["GET"])
+def conclusion_cache_diagnostics():
+    return jsonify(conclusion_templates.stats()), 200
+
+@app.route("/diagnostics/single-flight", methods=["GET"])
+def single_flight_diagnostics():
+    return jsonify(llm_flights.stats()), 200
+
+@app.route("/diagnostics/llm-quota", methods=["GET"])
+def llm_quota_diagnostics():
+    quotas = {provider: ledger.utilization() for provider, ledger in LEDGERS.items()}
+    if "gemini" in quotas:
+        quotas["gemini"] = LEDGERS["gemini"].utilization(gemini_key_scheduler.keys)
+    return jsonify(quotas), 200
+
+@app.route("/diagnostics/mongo-pool", methods=["GET"])
+def mongo_pool_diagnostics():
+    return jsonify(pool_diagnostics()), 200
+
+@app.route("/diagnostics/indexes", methods=["GET"])
+def index_diagnostics():
+    report = index_report(db)
+    return jsonify({
+        "collectionScans": [row["query"] for row in report if row.get("collectionScan")],
+        "queries": report
+    }), 200
+
 # --- Current Date/Time Endpoint ---
 
 @app.route("/current-date", methods=["GET"])
@@ -1,92 +1,173 @@
 import os
 import time
 import threading
-import requests
+from concurrent.futures import ThreadPoolExecutor
+import http_pool
+from quota_ledger import QuotaLedger, quota_backend
 
 ROTATION_INTERVAL = 600  # 10 minutes in seconds
-HEALTH_CHECK_URL = "https://api.mistral.ai/v1/health"  # Replace with actual health endpoint if different
+HEALTH_CHECK_URL = os.getenv("MISTRAL_HEALTH_CHECK_URL", "https://api.mistral.ai/v1/health")
+HEALTH_CHECK_INTERVAL = float(os.getenv("MISTRAL_HEALTH_CHECK_INTERVAL", "60"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("MISTRAL_HEALTH_CHECK_TIMEOUT", "5"))
+HEALTH_CHECK_WORKERS = int(os.getenv("MISTRAL_HEALTH_CHECK_WORKERS", "8"))
+# Per-key quota summed over all workers (shared ledger); 0 = not enforced
+MISTRAL_QUOTA_RPM = int(os.getenv("MISTRAL_QUOTA_RPM", "0"))
+MISTRAL_QUOTA_TPM = int(os.getenv("MISTRAL_QUOTA_TPM", "0"))
+# How long a key that got a 429 is left alone when the response says nothing more specific
+MISTRAL_RATE_LIMIT_COOLDOWN = float(os.getenv("MISTRAL_RATE_LIMIT_COOLDOWN", "60"))
+
+
+class KeySnapshot:
+    """Immutable view of the configured keys, ranked for selection.
+
+    `ranked` holds the healthy keys, fastest first (all keys when none is
+    healthy, so there is always something to try). Snapshots are swapped
+    whole, never edited, so readers need no lock.
+    """
+
+    def __init__(self, source, keys, ranked):
+        self.source = source  # the MISTRAL_API_KEYS string it was built from
+        self.keys = keys
+        self.ranked = ranked
+
 
 class MistralKeyManager:
+    """Picks Mistral API keys from a snapshot that background health probes keep ranked.
+
+    Nothing blocks at import: keys count as healthy until the first probe
+    round (run concurrently, off the calling thread) says otherwise.
+    """
+
     def __init__(self):
-        self.keys = []
+        self.ledger = QuotaLedger("mistral", quota_backend, rpm=MISTRAL_QUOTA_RPM, tpm=MISTRAL_QUOTA_TPM)
         self.key_stats = {}  # {key: {"last_checked": ..., "healthy": ..., "avg_response": ...}}
-        self.current_index = 0
-        self.last_rotation = time.time()
+        self.cooldown_until = {}  # {key: time}, keys the API rate-limited
         self.lock = threading.Lock()
+        self.snapshot = KeySnapshot(None, (), ())
+        self.rotation = 0
+        self.last_rotation = time.time()
+        self.wakeup = threading.Event()
         self.load_keys()
-        self.health_check_all_keys()
-        self.rotation_thread = threading.Thread(target=self.rotate_keys_loop, daemon=True)
-        self.rotation_thread.start()
+        self.health_thread = threading.Thread(target=self.health_check_loop, name="mistral-health", daemon=True)
+        self.health_thread.start()
 
     def load_keys(self):
+        """Return the current snapshot, rebuilding it only if MISTRAL_API_KEYS changed."""
         keys_str = os.getenv("MISTRAL_API_KEYS", "")
-        self.keys = [k.strip() for k in keys_str.split(",") if k.strip()]
-        for k in self.keys:
-            if k not in self.key_stats:
-                self.key_stats[k] = {"last_checked": 0, "healthy": True, "avg_response": None}
+        snapshot = self.snapshot
+        if keys_str == snapshot.source:
+            return snapshot
+        with self.lock:
+            if keys_str != self.snapshot.source:
+                keys = tuple(dict.fromkeys(k.strip() for k in keys_str.split(",") if k.strip()))
+                for k in keys:
+                    self.key_stats.setdefault(k, {"last_checked": 0, "healthy": True, "avg_response": None})
+                self._rebuild(keys_str, keys)
+                self.wakeup.set()  # probe new keys right away
+            return self.snapshot
+
+    def _rebuild(self, source, keys):
+        # Caller holds self.lock
+        healthy = sorted(
+            (k for k in keys if self.key_stats[k]["healthy"]),
+            key=lambda k: self.key_stats[k]["avg_response"] or float("inf")
+        )
+        self.snapshot = KeySnapshot(source, keys, tuple(healthy) or keys)
 
     def health_check_key(self, key):
         try:
             start = time.time()
             headers = {"Authorization": f"Bearer {key}"}
-            resp = requests.get(HEALTH_CHECK_URL, headers=headers, timeout=5)
+            resp = http_pool.get(HEALTH_CHECK_URL, headers=headers, timeout=HEALTH_CHECK_TIMEOUT)
             healthy = resp.status_code == 200
             elapsed = time.time() - start
         except Exception:
             healthy = False
             elapsed = None
-        self.key_stats[key]["last_checked"] = time.time()
-        self.key_stats[key]["healthy"] = healthy
-        if healthy and elapsed is not None:
-            prev = self.key_stats[key]["avg_response"]
-            self.key_stats[key]["avg_response"] = (
-                elapsed if prev is None else (prev + elapsed) / 2
-            )
-        return healthy
+        return healthy, elapsed
 
     def health_check_all_keys(self):
-        self.load_keys()
-        for k in self.keys:
-            self.health_check_key(k)
+        """Probe every key concurrently, then publish a re-ranked snapshot."""
+        snapshot = self.load_keys()
+        if not snapshot.keys:
+            return
+        with ThreadPoolExecutor(max_workers=min(len(snapshot.keys), HEALTH_CHECK_WORKERS)) as pool:
+            results = list(zip(snapshot.keys, pool.map(self.health_check_key, snapshot.keys)))
+        with self.lock:
+            now = time.time()
+            for key, (healthy, elapsed) in results:
+                stats = self.key_stats[key]
+                stats["last_checked"] = now
+                stats["healthy"] = healthy
+                if healthy and elapsed is not None:
+                    prev = stats["avg_response"]
+                    stats["avg_response"] = elapsed if prev is None else (prev + elapsed) / 2
+            if self.snapshot.source == snapshot.source:
+                self._rebuild(snapshot.source, snapshot.keys)
+
+    def health_check_loop(self):
+        while True:
+            try:
+                self.health_check_all_keys()
+            except Exception as e:
+                print(f"Mistral key health check failed: {e}")
+            self.wakeup.wait(HEALTH_CHECK_INTERVAL)
+            self.wakeup.clear()
+
+    def is_usable(self, key):
+        """Quota left this minute and not cooling down after a 429."""
+        with self.lock:
+            cooling = self.cooldown_until.get(key, 0) > time.time()
+        return not cooling and not self.ledger.is_exhausted(key)
 
     def get_next_working_key(self):
-        self.load_keys()
-        sorted_keys = sorted(
-            [k for k in self.keys if self.key_stats[k]["healthy"]],
-            key=lambda k: self.key_stats[k]["avg_response"] or float("inf")
-        )
-        return sorted_keys[0] if sorted_keys else None
+        """Fastest healthy key with quota left this minute."""
+        for key in self.load_keys().ranked:
+            if self.is_usable(key):
+                return key
+        return None
 
-    def rotate_keys_loop(self):
-        while True:
-            time.sleep(5)
-            self.load_keys()
+    def get_active_key(self):
+        snapshot = self.load_keys()
+        ranked = snapshot.ranked
+        if not ranked:
+            return None
+        with self.lock:
             now = time.time()
             if now - self.last_rotation > ROTATION_INTERVAL:
                 self.last_rotation = now
-                self.current_index = (self.current_index + 1) % len(self.keys)
-            # Health check current key
-            current_key = self.keys[self.current_index] if self.keys else None
-            if current_key and not self.health_check_key(current_key):
-                # Switch to next healthy key
-                next_key = self.get_next_working_key()
-                if next_key:
-                    self.current_index = self.keys.index(next_key)
+                self.rotation += 1
+            start = self.rotation % len(ranked)
+        # Usually the first candidate; the scan only runs past keys that are out of quota
+        for offset in range(len(ranked)):
+            key = ranked[(start + offset) % len(ranked)]
+            if self.is_usable(key):
+                return key
+        # Every key is out of quota this minute: no key, so the router fails over
+        return None
 
-    def get_active_key(self):
-        self.load_keys()
-        if not self.keys:
-            return None
-        current_key = self.keys[self.current_index]
-        if not self.key_stats[current_key]["healthy"]:
-            next_key = self.get_next_working_key()
-            if next_key:
-                self.current_index = self.keys.index(next_key)
-                current_key = next_key
-        return current_key
+    def record_usage(self, key, tokens=0):
+        """Count one request (and its tokens) against the key in the shared quota ledger"""
+        self.ledger.record(key, requests=1, tokens=tokens)
+
+    def record_rate_limited(self, key, retry_after=None):
+        """Rest a key the API answered 429 for: for retry_after seconds, or the default cooldown"""
+        with self.lock:
+            self.cooldown_until[key] = time.time() + (retry_after or MISTRAL_RATE_LIMIT_COOLDOWN)
+
+    def stats(self):
+        snapshot = self.load_keys()
+        with self.lock:
+            return {
+                "keys": len(snapshot.keys),
+                "healthy": sum(1 for k in snapshot.keys if self.key_stats[k]["healthy"]),
+                "avg_response": {
+                    f"#{i + 1} ...{k[-4:]}": self.key_stats[k]["avg_response"] for i, k in enumerate(snapshot.ranked)
+                },
+            }
 
 # Singleton instance
 mistral_key_manager = MistralKeyManager()
 
 def get_active_mistral_key():
-    return mistral_key_manager.get_active_key()
\ No newline at end of file
+    return mistral_key_manager.get_active_key()
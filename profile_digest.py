@@ -0,0 +1,213 @@
+import os
+import json
+import threading
+from datetime import datetime
+from cachetools import TTLCache
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_DIGEST_MAX_ITEMS = int(os.getenv("PROFILE_DIGEST_MAX_ITEMS", "5"))  # per list, newest first
+PROFILE_DIGEST_MAX_TEXT = int(os.getenv("PROFILE_DIGEST_MAX_TEXT", "160"))  # characters per string
+PROFILE_DIGEST_CACHE_TTL_SECONDS = int(os.getenv("PROFILE_DIGEST_CACHE_TTL_SECONDS", "30"))
+
+# Bump when build_digest changes shape; older stored digests are rebuilt on read.
+# Digests built on an earlier day are rebuilt too, so past events drop out of upcomingEvents.
+DIGEST_VERSION = 1
+
+IDENTITY_FIELDS = ["name", "studentType", "class", "year", "major", "course", "institute"]
+
+# Digest sections each kind of prompt gets
+PROMPT_FIELDS = {
+    "chat": IDENTITY_FIELDS + ["grades", "quizResult"],
+    "goals": IDENTITY_FIELDS + ["grades", "careerInterests", "skills"],
+    "subject_help": IDENTITY_FIELDS + ["grades"],
+    "academic_plan": IDENTITY_FIELDS + ["grades", "semesters", "projects", "workExperience",
+                                        "certifications", "extracurricularActivities", "careerInterests", "skills"],
+    # Study plan prompts list current grades separately
+    "study_plan": IDENTITY_FIELDS + ["semesters", "upcomingEvents", "openStudyTasks", "careerInterests"],
+}
+
+QUIZ_RESULT_FIELDS = ["headline", "recommended_path", "top_capabilities", "strengths", "growth_areas"]
+
+
+def _compact(value, depth=0):
+    """Bound a stored value: long strings are cut, lists keep their newest items, nesting is flattened."""
+    if isinstance(value, str):
+        if len(value) > PROFILE_DIGEST_MAX_TEXT:
+            return value[:PROFILE_DIGEST_MAX_TEXT - 3].rstrip() + "..."
+        return value
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if depth >= 2:
+        return None
+    if isinstance(value, list):
+        return [_compact(v, depth + 1) for v in value[-PROFILE_DIGEST_MAX_ITEMS:]]
+    if isinstance(value, dict):
+        compacted = {}
+        for k, v in value.items():
+            if k in ("id", "_id", "createdAt", "link", "certificate"):
+                continue
+            v = _compact(v, depth + 1)
+            if v not in (None, "", [], {}):
+                compacted[k] = v
+        return compacted
+    return _compact(str(value), depth)
+
+
+def _titles(items):
+    titles = [item.get("title") for item in (items or []) if isinstance(item, dict) and item.get("title")]
+    return [_compact(t) for t in titles[-PROFILE_DIGEST_MAX_ITEMS:]]
+
+
+def summarize_grades(user):
+    """Same shape the study plan prompts have always used for "Current Academic Performance"."""
+    grades = {}
+    if user.get("studentType") == "college":
+        if user.get("cgpa"):
+            grades["CGPA"] = user["cgpa"]
+    elif user.get("studentType") == "school":
+        if user.get("termData"):
+            grades["Term Data"] = _compact(user["termData"])
+        if user.get("subjects"):
+            grades["Subjects"] = _compact(user["subjects"])
+    return grades
+
+
+def summarize_quiz_result(result):
+    if not isinstance(result, dict):
+        return _compact(result)
+    return _compact({k: result[k] for k in QUIZ_RESULT_FIELDS if k in result})
+
+
+def _today():
+    return datetime.utcnow().date().isoformat()
+
+
+def build_digest(user, today=None):
+    """Size-bounded summary of a user document for use in prompts."""
+    today = today or _today()
+    digest = {k: _compact(user[k]) for k in IDENTITY_FIELDS if user.get(k) not in (None, "")}
+
+    grades = summarize_grades(user)
+    if grades:
+        digest["grades"] = grades
+    if user.get("semesters"):
+        digest["semesters"] = [
+            {"semester": s.get("semester_number"), "sgpa": s.get("sgpa")}
+            for s in user["semesters"][-PROFILE_DIGEST_MAX_ITEMS:] if isinstance(s, dict)
+        ]
+    for field in ("projects", "workExperience"):
+        if user.get(field):
+            digest[field] = _titles(user[field])
+    for field in ("certifications", "extracurricularActivities", "careerInterests", "skills"):
+        if user.get(field):
+            digest[field] = _compact(user[field])
+
+    upcoming = sorted(
+        (e for e in user.get("events") or [] if isinstance(e, dict) and str(e.get("date", "")) >= today),
+        key=lambda e: str(e.get("date"))
+    )
+    if upcoming:
+        digest["upcomingEvents"] = [
+            {"title": _compact(e.get("title", "")), "date": e.get("date")}
+            for e in upcoming[:PROFILE_DIGEST_MAX_ITEMS]
+        ]
+    study_plan = user.get("studyPlan")
+    if isinstance(study_plan, dict):
+        open_tasks = [t for t in study_plan.get("tasks") or [] if isinstance(t, dict) and not t.get("completed")]
+        if open_tasks:
+            digest["openStudyTasks"] = _titles(open_tasks[:PROFILE_DIGEST_MAX_ITEMS])
+    if user.get("quiz_result"):
+        digest["quizResult"] = summarize_quiz_result(user["quiz_result"])
+    return digest
+
+
+def prompt_profile(digest, prompt_type):
+    """Compact JSON of the digest sections a prompt type needs."""
+    selected = {k: digest[k] for k in PROMPT_FIELDS[prompt_type] if k in digest}
+    return json.dumps(selected, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+class ProfileDigestStore:
+    """Precomputed profile digests in `collection`, one document per email.
+
+    Digests are rebuilt whenever the user document is written (refresh) and
+    built lazily for users that have not been written since the store existed.
+    A short per-process TTL cache sits in front of the collection.
+    """
+
+    def __init__(self, collection, users, ttl=PROFILE_DIGEST_CACHE_TTL_SECONDS):
+        self.collection = collection
+        self.users = users
+        self.lock = threading.Lock()
+        self.local = TTLCache(5000, ttl)
+        self.counters = {"local_hits": 0, "stored_hits": 0, "builds": 0, "refresh_errors": 0}
+
+    def get(self, email):
+        """Return the digest for a user, or None if the user does not exist."""
+        if not email:
+            return None
+        with self.lock:
+            digest = self.local.get(email)
+            if digest is not None:
+                self.counters["local_hits"] += 1
+                return digest
+
+        doc = self.collection.find_one({"_id": email}, {"digest": 1, "version": 1, "builtOn": 1})
+        if doc and doc.get("version") == DIGEST_VERSION and doc.get("builtOn") == _today():
+            with self.lock:
+                self.counters["stored_hits"] += 1
+                self.local[email] = doc["digest"]
+            return doc["digest"]
+        return self._rebuild(email, lazy=True)
+
+    def refresh(self, email):
+        """Rebuild and store the digest from the current user document."""
+        return self._rebuild(email)
+
+    def _rebuild(self, email, lazy=False):
+        with self.lock:
+            self.local.pop(email, None)
+        user = self.users.find_one({"email": email}, {"_id": 0, "password": 0})
+        if not user:
+            self.collection.delete_one({"_id": email})
+            return None
+        today = _today()
+        digest = build_digest(user, today)
+        doc = {"version": DIGEST_VERSION, "builtOn": today, "digest": digest, "updatedAt": datetime.utcnow()}
+        if lazy:
+            # Only fill a missing or outdated digest, never overwrite one a concurrent write just stored
+            try:
+                self.collection.replace_one(
+                    {"_id": email, "$or": [{"version": {"$ne": DIGEST_VERSION}}, {"builtOn": {"$ne": today}}]},
+                    doc,
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                return digest
+        else:
+            self.collection.replace_one({"_id": email}, doc, upsert=True)
+        with self.lock:
+            self.counters["builds"] += 1
+            self.local[email] = digest
+        return digest
+
+    def refresh_quietly(self, email):
+        # Used on the write path: a failed rebuild must not fail the user's write
+        try:
+            self.refresh(email)
+        except Exception as e:
+            print(f"Profile digest refresh failed for {email}: {e}")
+            self.counters["refresh_errors"] += 1
+            try:
+                self.collection.delete_one({"_id": email})
+            except Exception:
+                pass
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, local_size=len(self.local), local_ttl=self.local.ttl)
@@ -0,0 +1,190 @@
+import os
+import re
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Token budget per call site; PROMPT_BUDGETS="chat=600,study_plan=2500" overrides single entries
+DEFAULT_PROMPT_BUDGETS = {
+    "ai": 600,
+    "chat": 800,
+    "goals": 800,
+    "subject_help": 1000,
+    "academic_plan": 2500,
+    "study_plan": 1500,
+    "conclusion": 2000,
+}
+PROMPT_BUDGET_DEFAULT = int(os.getenv("PROMPT_BUDGET_DEFAULT", "4000"))
+# A trimmed section keeps at least this many tokens (and always its trim marker)
+PROMPT_SECTION_MIN_TOKENS = int(os.getenv("PROMPT_SECTION_MIN_TOKENS", "40"))
+
+TRIM_MARKER = " ...[trimmed]"
+
+# Words and single punctuation marks; whitespace is free, as in BPE vocabularies
+_TOKEN_PIECES = re.compile(r"\w+|[^\w\s]")
+
+
+def _parse_budgets(raw):
+    budgets = dict(DEFAULT_PROMPT_BUDGETS)
+    for entry in raw.split(","):
+        name, _, value = entry.partition("=")
+        if name.strip() and value.strip().isdigit():
+            budgets[name.strip()] = int(value)
+    return budgets
+
+
+PROMPT_BUDGETS = _parse_budgets(os.getenv("PROMPT_BUDGETS", ""))
+
+
+def _piece_tokens(piece):
+    # Roughly one token per 4 characters of a word, one per punctuation mark
+    if piece[0].isalnum() or piece[0] == "_":
+        return (len(piece) + 3) // 4
+    return 1
+
+
+def estimate_tokens(text):
+    """Local approximation of the model's token count; no tokenizer download needed."""
+    if not text:
+        return 0
+    return sum(_piece_tokens(piece) for piece in _TOKEN_PIECES.findall(text))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text after the last whole word that fits in max_tokens, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    allowance = max_tokens - estimate_tokens(TRIM_MARKER)
+    if allowance <= 0:
+        return ""
+    used = 0
+    end = 0
+    for match in _TOKEN_PIECES.finditer(text):
+        used += _piece_tokens(match.group())
+        if used > allowance:
+            break
+        end = match.end()
+    return text[:end] + TRIM_MARKER if end else ""
+
+
+def budget_for(call_site):
+    return PROMPT_BUDGETS.get(call_site, PROMPT_BUDGET_DEFAULT)
+
+
+class PromptMetrics:
+    """Prompt and response sizes per call site, in estimated tokens."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sites = {}
+
+    def _site(self, call_site):
+        if call_site not in self.sites:
+            self.sites[call_site] = {
+                "calls": 0, "cached": 0, "failed": 0,
+                "prompt_tokens_total": 0, "prompt_tokens_max": 0,
+                "response_tokens_total": 0, "response_tokens_max": 0,
+                "assembled": 0, "trimmed": 0, "over_budget": 0, "trimmed_sections": {},
+            }
+        return self.sites[call_site]
+
+    def record_call(self, call_site, prompt, response, cached=False):
+        prompt_tokens = estimate_tokens(prompt)
+        response_tokens = estimate_tokens(response)
+        with self.lock:
+            site = self._site(call_site)
+            site["calls"] += 1
+            site["cached"] += cached
+            site["failed"] += response is None
+            site["prompt_tokens_total"] += prompt_tokens
+            site["prompt_tokens_max"] = max(site["prompt_tokens_max"], prompt_tokens)
+            site["response_tokens_total"] += response_tokens
+            site["response_tokens_max"] = max(site["response_tokens_max"], response_tokens)
+
+    def record_assembly(self, call_site, trimmed_sections, over_budget):
+        with self.lock:
+            site = self._site(call_site)
+            site["assembled"] += 1
+            site["trimmed"] += bool(trimmed_sections)
+            site["over_budget"] += over_budget
+            for name in trimmed_sections:
+                site["trimmed_sections"][name] = site["trimmed_sections"].get(name, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            sites = {}
+            for call_site, stats in self.sites.items():
+                calls = stats["calls"]
+                sites[call_site] = dict(
+                    stats,
+                    trimmed_sections=dict(stats["trimmed_sections"]),
+                    budget=budget_for(call_site),
+                    prompt_tokens_avg=round(stats["prompt_tokens_total"] / calls, 1) if calls else None,
+                    response_tokens_avg=round(stats["response_tokens_total"] / calls, 1) if calls else None,
+                )
+        return sites
+
+
+prompt_metrics = PromptMetrics()
+
+
+class _Section:
+    def __init__(self, text, priority, name, summary, min_tokens):
+        self.text = text
+        self.priority = priority
+        self.name = name
+        self.summary = summary
+        self.min_tokens = max(min_tokens, estimate_tokens(TRIM_MARKER) + 1)
+        self.tokens = estimate_tokens(text)
+
+
+class PromptAssembler:
+    """Builds a prompt from ordered sections and fits it into the call site's token budget.
+
+    Sections added without a priority (instructions, output format) are always
+    kept as-is. Sections with a priority are shrunk lowest priority first, in
+    two rounds: every section that has a `summary` is first replaced by it, and
+    only if the prompt still doesn't fit are sections truncated, each down to
+    no less than its `min_tokens` and always ending in the trim marker. A
+    prompt that can't be fit that way is sent over budget (and counted).
+    """
+
+    def __init__(self, call_site, budget=None):
+        self.call_site = call_site
+        self.budget = budget or budget_for(call_site)
+        self.sections = []
+
+    def add(self, text, priority=None, name=None, summary=None, min_tokens=PROMPT_SECTION_MIN_TOKENS):
+        self.sections.append(_Section(text or "", priority, name, summary, min_tokens))
+        return self
+
+    def build(self):
+        over = sum(s.tokens for s in self.sections) - self.budget
+        trimmed = []
+        optional = sorted((s for s in self.sections if s.priority is not None), key=lambda s: s.priority)
+        # Summaries first: they keep a section's meaning, truncation doesn't
+        for section in optional:
+            if over <= 0:
+                break
+            if section.summary is None:
+                continue
+            summary_tokens = estimate_tokens(section.summary)
+            if summary_tokens < section.tokens:
+                over -= section.tokens - summary_tokens
+                section.text, section.tokens = section.summary, summary_tokens
+                trimmed.append(section.name or f"priority {section.priority}")
+        for section in optional:
+            if over <= 0:
+                break
+            if section.tokens <= section.min_tokens:
+                continue
+            before = section.tokens
+            section.text = truncate_to_tokens(section.text, max(section.tokens - over, section.min_tokens))
+            section.tokens = estimate_tokens(section.text)
+            over -= before - section.tokens
+            name = section.name or f"priority {section.priority}"
+            if section.tokens < before and name not in trimmed:
+                trimmed.append(name)
+        prompt_metrics.record_assembly(self.call_site, trimmed, over > 0)
+        return "".join(s.text for s in self.sections)
@@ -0,0 +1,118 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+from quiz_scoring import TRAITS
+from resilience import backoff_delay, llm_retry_budget
+from llm_json import salvage_array
+
+load_dotenv()
+
+QUIZ_TOTAL_QUESTIONS = int(os.getenv("QUIZ_TOTAL_QUESTIONS", "30"))
+QUIZ_MIN_QUESTIONS = int(os.getenv("QUIZ_MIN_QUESTIONS", "25"))  # a merged quiz shorter than this is a failure
+QUIZ_CHUNK_SIZE = int(os.getenv("QUIZ_CHUNK_SIZE", "10"))
+QUIZ_CHUNK_ATTEMPTS = int(os.getenv("QUIZ_CHUNK_ATTEMPTS", "3"))  # per chunk; only failed chunks are re-asked
+QUIZ_CHUNK_MIN_FILL = float(os.getenv("QUIZ_CHUNK_MIN_FILL", "0.8"))  # share of a chunk that must be well-formed
+QUIZ_CHUNK_WORKERS = int(os.getenv("QUIZ_CHUNK_WORKERS", "16"))
+
+_executor = ThreadPoolExecutor(max_workers=QUIZ_CHUNK_WORKERS, thread_name_prefix="quiz-chunk")
+
+
+def plan_chunks(total=QUIZ_TOTAL_QUESTIONS, size=QUIZ_CHUNK_SIZE, traits=TRAITS):
+    """Split a quiz into chunks of at most `size` questions, dealing the traits out so each chunk has its own focus."""
+    count = max(1, -(-total // size))
+    base, extra = divmod(total, count)
+    return [
+        {"index": i, "size": base + (1 if i < extra else 0), "traits": traits[i::count] or list(traits)}
+        for i in range(count)
+    ]
+
+
+def _valid_weight(value):
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 3
+
+
+def is_valid_question(question):
+    if not isinstance(question, dict) or not isinstance(question.get("text"), str) or not question["text"].strip():
+        return False
+    options = question.get("options")
+    if not isinstance(options, list) or len(options) < 2:
+        return False
+    for option in options:
+        if not isinstance(option, dict) or not option.get("id") or not option.get("text"):
+            return False
+        weights = option.get("weights")
+        if not isinstance(weights, dict) or not all(_valid_weight(weights.get(t)) for t in TRAITS):
+            return False
+    return True
+
+
+def parse_chunk(text, size):
+    """Well-formed questions from one chunk's answer (at most `size`); malformed items are dropped one by one,
+    and the complete items of a cut-off answer are kept."""
+    return [q for q in salvage_array(text) if is_valid_question(q)][:size]
+
+
+def chunk_is_usable(questions, size):
+    return len(questions) >= max(1, int(size * QUIZ_CHUNK_MIN_FILL))
+
+
+def merge_chunks(chunks):
+    """Concatenate chunk questions in chunk order, drop repeated question texts and renumber q1..qN."""
+    merged = []
+    seen = set()
+    for questions in chunks:
+        for q in questions:
+            key = " ".join(q["text"].lower().split())
+            if key in seen:
+                continue
+            seen.add(key)
+            merged.append(dict(q, id=f"q{len(merged) + 1}"))
+    return merged[:QUIZ_TOTAL_QUESTIONS]
+
+
+def generate_chunked_quiz(make_prompt, complete, plan=None, attempts=QUIZ_CHUNK_ATTEMPTS):
+    """Generate the chunks of `plan` concurrently and merge them into one quiz, or return None.
+
+    make_prompt(chunk) builds a chunk's prompt, complete(prompt, chunk) returns
+    the well-formed questions the model produced for it. Wall-clock time is about that of the slowest chunk;
+    chunks that fail are retried on their own (jittered backoff, shared retry
+    budget) while the good ones are kept.
+    """
+    plan = plan or plan_chunks()
+    results = {}
+
+    def run(chunk):
+        return complete(make_prompt(chunk), chunk)[:chunk["size"]]
+
+    failing = list(plan)
+    for _ in plan:
+        llm_retry_budget.record_request()
+    for attempt in range(attempts):
+        if attempt:
+            failing = [c for c in failing if llm_retry_budget.try_retry()]
+            if not failing:
+                break
+            time.sleep(backoff_delay(attempt - 1))
+        futures = [(chunk, _executor.submit(run, chunk)) for chunk in failing]
+        failing = []
+        for chunk, future in futures:
+            try:
+                questions = future.result()
+            except Exception as e:
+                print(f"Quiz chunk {chunk['index'] + 1} raised: {e}")
+                questions = []
+            # A short chunk is still kept (the best try so far) in case the other chunks make up for it
+            if len(questions) > len(results.get(chunk["index"], [])):
+                results[chunk["index"]] = questions
+            if not chunk_is_usable(results.get(chunk["index"], []), chunk["size"]):
+                print(f"Quiz chunk {chunk['index'] + 1}/{len(plan)} failed ({len(questions)}/{chunk['size']} valid questions)")
+                failing.append(chunk)
+        if not failing:
+            break
+
+    quiz = merge_chunks([results[c["index"]] for c in plan if c["index"] in results])
+    if len(quiz) < QUIZ_MIN_QUESTIONS:
+        print(f"Chunked quiz generation produced {len(quiz)} questions, need at least {QUIZ_MIN_QUESTIONS}")
+        return None
+    return quiz
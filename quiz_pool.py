@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from job_queue import PRIORITY_BACKGROUND
+
+load_dotenv()
+
+QUIZ_POOL_SIZE = int(os.getenv("QUIZ_POOL_SIZE", "3"))  # ready quizzes kept per segment, 0 disables the pool
+QUIZ_POOL_SWEEP_SECONDS = int(os.getenv("QUIZ_POOL_SWEEP_SECONDS", "900"))
+QUIZ_POOL_ACTIVE_DAYS = int(os.getenv("QUIZ_POOL_ACTIVE_DAYS", "30"))  # segments requested recently are kept warm
+QUIZ_POOL_MAX_FAILURES = int(os.getenv("QUIZ_POOL_MAX_FAILURES", "2"))
+# Extra segments to warm before anyone asks, e.g. "college:Computer Science,school:XII"
+QUIZ_POOL_SEGMENTS = os.getenv("QUIZ_POOL_SEGMENTS", "")
+
+
+def segment_for(profile):
+    """Map a student profile to its pool segment: (segment key, studentType, label)."""
+    student_type = (profile.get("studentType") or "school").strip().lower()
+    label = profile.get("major", profile.get("class", "General")) or "General"
+    label = str(label).strip() or "General"
+    return f"{student_type}|{label.lower()}", student_type, label
+
+
+def profile_for_segment(student_type, label):
+    # call_llm_generate_quiz only reads the major/class out of the profile
+    if student_type == "college":
+        return {"studentType": student_type, "major": label}
+    return {"studentType": student_type, "class": label}
+
+
+class QuizPoolManager:
+    """Keeps QUIZ_POOL_SIZE validated quizzes ready per (studentType, major/class) segment.
+
+    Quizzes are handed out with an atomic find_one_and_delete and refilled by
+    background-priority "quiz_pool_refill" jobs on the shared job queue, so
+    only one process refills a given segment at a time and live quiz jobs go
+    first. take() only notes the segment; the sweeper thread records the
+    demand and queues the refill, off the request path.
+    """
+
+    def __init__(self, collection, segments_collection, job_queue, generate_quiz, is_valid_quiz,
+                 size=QUIZ_POOL_SIZE):
+        self.collection = collection
+        self.segments = segments_collection
+        self.job_queue = job_queue
+        self.generate_quiz = generate_quiz
+        self.is_valid_quiz = is_valid_quiz
+        self.size = size
+        self.sweeper = None
+        self.wakeup = threading.Event()
+        self.taken = {}  # {segment: (studentType, label)} handed out since the sweeper last looked
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "refills_scheduled": 0, "generated": 0, "failed": 0}
+        job_queue.register("quiz_pool_refill", self._refill_job)
+
+    def enabled(self):
+        return self.size > 0
+
+    def take(self, profile):
+        """Pop a ready quiz for this profile's segment, or None if the pool is empty."""
+        if not self.enabled():
+            return None
+        segment, student_type, label = segment_for(profile)
+        doc = self.collection.find_one_and_delete({"segment": segment}, sort=[("createdAt", 1)])
+        with self.lock:
+            self.counters["hits" if doc else "misses"] += 1
+            self.taken[segment] = (student_type, label)
+        self.wakeup.set()
+        return doc["questions"] if doc else None
+
+    def refill_taken(self):
+        """Record demand for the segments take() saw and top them up."""
+        with self.lock:
+            taken, self.taken = self.taken, {}
+        now = datetime.utcnow()
+        for segment, (student_type, label) in taken.items():
+            self.segments.update_one(
+                {"_id": segment},
+                {"$set": {"studentType": student_type, "label": label, "lastRequestedAt": now}},
+                upsert=True
+            )
+            self.schedule_refill(segment, student_type, label)
+
+    def schedule_refill(self, segment, student_type, label):
+        if self.collection.count_documents({"segment": segment}) >= self.size:
+            return
+        self.job_queue.submit(
+            "quiz_pool_refill",
+            {"segment": segment, "studentType": student_type, "label": label},
+            dedupe_key=f"quiz_pool_refill:{segment}",
+            priority=PRIORITY_BACKGROUND
+        )
+        with self.lock:
+            self.counters["refills_scheduled"] += 1
+
+    def _refill_job(self, payload, report_progress):
+        segment = payload["segment"]
+        profile = profile_for_segment(payload["studentType"], payload["label"])
+        added = failures = 0
+        while failures < QUIZ_POOL_MAX_FAILURES:
+            ready = self.collection.count_documents({"segment": segment})
+            if ready >= self.size:
+                break
+            report_progress({"stage": "generating", "ready": ready, "target": self.size})
+            questions = self.generate_quiz(profile)
+            if not self.is_valid_quiz(questions):
+                failures += 1
+                with self.lock:
+                    self.counters["failed"] += 1
+                continue
+            self.collection.insert_one({
+                "segment": segment,
+                "questions": questions,
+                "createdAt": datetime.utcnow()
+            })
+            added += 1
+            with self.lock:
+                self.counters["generated"] += 1
+        return {"segment": segment, "added": added, "failures": failures}
+
+    def sweep(self):
+        """Top up every configured or recently requested segment."""
+        self.refill_taken()
+        for entry in filter(None, (s.strip() for s in QUIZ_POOL_SEGMENTS.split(","))):
+            student_type, _, label = entry.partition(":")
+            segment, student_type, label = segment_for(profile_for_segment(student_type.strip().lower(), label))
+            self.schedule_refill(segment, student_type, label)
+
+        since = datetime.utcnow() - timedelta(days=QUIZ_POOL_ACTIVE_DAYS)
+        for doc in self.segments.find({"lastRequestedAt": {"$gte": since}}):
+            self.schedule_refill(doc["_id"], doc["studentType"], doc["label"])
+
+    def _sweep_loop(self):
+        next_sweep = 0
+        while True:
+            try:
+                if time.time() >= next_sweep:
+                    next_sweep = time.time() + QUIZ_POOL_SWEEP_SECONDS
+                    self.sweep()
+                else:
+                    self.refill_taken()
+            except Exception as e:
+                print(f"Quiz pool sweep failed: {e}")
+            # take() wakes us early so a drained segment is refilled without waiting for the full sweep
+            self.wakeup.wait(max(next_sweep - time.time(), 0))
+            self.wakeup.clear()
+
+    def start(self):
+        if not self.enabled():
+            return
+        with self.lock:
+            if self.sweeper:
+                return
+            self.sweeper = threading.Thread(target=self._sweep_loop, name="quiz-pool-sweeper", daemon=True)
+            self.sweeper.start()
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        pools = {}
+        if self.enabled():
+            for row in self.collection.aggregate([{"$group": {"_id": "$segment", "ready": {"$sum": 1}}}]):
+                pools[row["_id"]] = row["ready"]
+        return dict(counters, target_size=self.size, segments=pools)
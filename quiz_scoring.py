@@ -0,0 +1,117 @@
+import threading
+import numpy as np
+from cachetools import LRUCache
+
+TRAITS = ["analytical", "creative", "leadership", "sociable", "structured"]
+SCORING_VERSION = 1
+
+_compiled_cache = LRUCache(maxsize=512)  # {quizId: CompiledQuiz}
+_cache_lock = threading.Lock()
+
+
+def _weight(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def compile_quiz(questions):
+    """Compile quiz questions into the compact form stored next to them in Mongo.
+
+    Everything is stored as lists (question/option ids can't be used as Mongo
+    keys safely). `weights` is a questions x (options + 1) x traits array; the
+    extra all-zero option slot is where unanswered or unknown choices land.
+    """
+    questions = questions or []
+    max_options = max((len(q.get("options", [])) for q in questions), default=0)
+    weights = np.zeros((len(questions), max_options + 1, len(TRAITS)), dtype=np.int16)
+    option_ids = []
+    for qi, q in enumerate(questions):
+        ids = []
+        for oi, option in enumerate(q.get("options", [])):
+            ids.append(option.get("id"))
+            for t, v in (option.get("weights") or {}).items():
+                if t in TRAITS:
+                    weights[qi, oi, TRAITS.index(t)] = _weight(v)
+        option_ids.append(ids)
+    return {
+        "version": SCORING_VERSION,
+        "traits": TRAITS,
+        "questionIds": [q.get("id") for q in questions],
+        "optionIds": option_ids,
+        "weights": weights.tolist(),
+    }
+
+
+class CompiledQuiz:
+    def __init__(self, compiled):
+        self.traits = compiled["traits"]
+        self.weights = np.asarray(compiled["weights"], dtype=np.int32)
+        if not compiled["questionIds"]:
+            # No questions: the list form loses the option/trait axes, and every score is zero
+            self.weights = np.zeros((0, 1, len(self.traits)), dtype=np.int32)
+        self.unanswered = self.weights.shape[1] - 1
+        self.question_rows = np.arange(self.weights.shape[0])
+        # {question id: (row, {option id: column})}, first option wins on duplicate ids
+        self.option_index = {}
+        for qi, (qid, ids) in enumerate(zip(compiled["questionIds"], compiled["optionIds"])):
+            if qid in self.option_index:
+                continue
+            columns = {}
+            for oi, opt_id in enumerate(ids):
+                columns.setdefault(opt_id, oi)
+            self.option_index[qid] = (qi, columns)
+
+    def answer_vector(self, answers):
+        choices = np.full(len(self.question_rows), self.unanswered, dtype=np.int64)
+        for qid, opt_id in (answers or {}).items():
+            entry = self.option_index.get(qid)
+            if entry:
+                choices[entry[0]] = entry[1].get(opt_id, self.unanswered)
+        return choices
+
+    def score(self, answers):
+        totals = self.weights[self.question_rows, self.answer_vector(answers)].sum(axis=0)
+        return {t: int(v) for t, v in zip(self.traits, totals)}
+
+    def score_many(self, answers_list):
+        if not answers_list:
+            return []
+        choices = np.stack([self.answer_vector(a) for a in answers_list])
+        # (submissions x questions) gather -> (submissions x questions x traits), summed over questions
+        totals = self.weights[self.question_rows[None, :], choices].sum(axis=1)
+        return [{t: int(v) for t, v in zip(self.traits, row)} for row in totals.tolist()]
+
+
+def load_compiled(quiz_id, compiled):
+    """Return the CompiledQuiz for a stored compiled form, memoized by quiz id."""
+    with _cache_lock:
+        cached = _compiled_cache.get(quiz_id)
+        if cached is not None:
+            return cached
+    quiz = CompiledQuiz(compiled)
+    with _cache_lock:
+        _compiled_cache[quiz_id] = quiz
+    return quiz
+
+
+def score_batch(compiled_by_quiz, submissions):
+    """Score many submissions across quizzes in one call.
+
+    `compiled_by_quiz` maps quizId -> CompiledQuiz and each submission is a dict
+    with "quizId" and "answers". Returns trait-score dicts in submission order
+    (None for submissions whose quiz is unknown).
+    """
+    results = [None] * len(submissions)
+    by_quiz = {}
+    for i, submission in enumerate(submissions):
+        by_quiz.setdefault(submission.get("quizId"), []).append(i)
+    for quiz_id, positions in by_quiz.items():
+        quiz = compiled_by_quiz.get(quiz_id)
+        if quiz is None:
+            continue
+        scores = quiz.score_many([submissions[i].get("answers") for i in positions])
+        for i, trait_scores in zip(positions, scores):
+            results[i] = trait_scores
+    return results
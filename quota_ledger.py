@@ -0,0 +1,210 @@
+import os
+import time
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUOTA_LEDGER_BACKEND = os.getenv("QUOTA_LEDGER_BACKEND", "mongo")  # "mongo" (shared by all workers) or "memory"
+QUOTA_LEDGER_SYNC_SECONDS = float(os.getenv("QUOTA_LEDGER_SYNC_SECONDS", "1"))  # flush + snapshot interval
+QUOTA_LEDGER_RETENTION_MINUTES = int(os.getenv("QUOTA_LEDGER_RETENTION_MINUTES", "60"))
+
+LEDGERS = {}  # {provider: QuotaLedger}, for the diagnostics endpoint
+
+
+def key_id(key):
+    """Stable, non-reversible id for an API key; raw keys never reach the ledger."""
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+def current_minute(now=None):
+    return int((now or time.time()) // 60) * 60
+
+
+class MemoryQuotaBackend:
+    """Per-process counts; for a single worker or local development."""
+
+    name = "memory"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}  # {(provider, minute): {key id: {"requests", "tokens"}}}
+
+    def increment(self, provider, minute, counts):
+        with self.lock:
+            bucket = self.buckets.setdefault((provider, minute), {})
+            for kid, (requests, tokens) in counts.items():
+                usage = bucket.setdefault(kid, {"requests": 0, "tokens": 0})
+                usage["requests"] += requests
+                usage["tokens"] += tokens
+            horizon = minute - QUOTA_LEDGER_RETENTION_MINUTES * 60
+            for old in [k for k in self.buckets if k[1] < horizon]:
+                del self.buckets[old]
+
+    def read(self, provider, minute):
+        with self.lock:
+            return {kid: dict(usage) for kid, usage in self.buckets.get((provider, minute), {}).items()}
+
+
+class MongoQuotaBackend:
+    """Per-minute counters in a Mongo collection, shared by every worker process.
+
+    One document per (provider, key id, minute); a TTL index (db_indexes)
+    removes them after QUOTA_LEDGER_RETENTION_MINUTES.
+    """
+
+    name = "mongo"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    def increment(self, provider, minute, counts):
+        bucket_start = datetime.utcfromtimestamp(minute)
+        expires_at = bucket_start + timedelta(minutes=QUOTA_LEDGER_RETENTION_MINUTES)
+        self.collection.bulk_write([
+            UpdateOne(
+                {"_id": f"{provider}:{kid}:{minute}"},
+                {
+                    "$inc": {"requests": requests, "tokens": tokens},
+                    "$setOnInsert": {"provider": provider, "keyId": kid, "minute": bucket_start, "expiresAt": expires_at},
+                },
+                upsert=True
+            )
+            for kid, (requests, tokens) in counts.items()
+        ], ordered=False)
+
+    def read(self, provider, minute):
+        docs = self.collection.find(
+            {"provider": provider, "minute": datetime.utcfromtimestamp(minute)},
+            {"keyId": 1, "requests": 1, "tokens": 1}
+        )
+        return {doc["keyId"]: {"requests": doc.get("requests", 0), "tokens": doc.get("tokens", 0)} for doc in docs}
+
+
+def create_backend(name=QUOTA_LEDGER_BACKEND):
+    if name == "memory":
+        return MemoryQuotaBackend()
+    if name == "mongo":
+        from database import db
+        return MongoQuotaBackend(db.llm_quota)
+    raise ValueError(f"Unknown QUOTA_LEDGER_BACKEND: {name}")
+
+
+class QuotaLedger:
+    """Per-key request/token usage for the current minute, as seen by all workers.
+
+    record() only touches memory; a background thread flushes pending counts to
+    the backend and re-reads the shared snapshot every QUOTA_LEDGER_SYNC_SECONDS,
+    so key selection never waits on the backend. Usage is the last snapshot plus
+    this process's not-yet-flushed counts.
+    """
+
+    def __init__(self, provider, backend, rpm=0, tpm=0, sync_seconds=QUOTA_LEDGER_SYNC_SECONDS):
+        self.provider = provider
+        self.backend = backend
+        self.rpm = rpm  # 0 = no limit
+        self.tpm = tpm
+        self.sync_seconds = sync_seconds
+        self.lock = threading.Lock()
+        self.pending = {}  # {minute: {key id: [requests, tokens]}}
+        self.snapshot_minute = None
+        self.snapshot = {}
+        self.snapshot_at = None
+        self.sync_errors = 0
+        self.thread = None
+        LEDGERS[provider] = self
+
+    def start(self):
+        with self.lock:
+            if self.thread:
+                return
+            self.thread = threading.Thread(target=self._sync_loop, name=f"quota-ledger-{self.provider}", daemon=True)
+            self.thread.start()
+
+    def record(self, key, requests=0, tokens=0):
+        if not requests and not tokens:
+            return
+        self.start()
+        with self.lock:
+            counts = self.pending.setdefault(current_minute(), {}).setdefault(key_id(key), [0, 0])
+            counts[0] += requests
+            counts[1] += int(tokens or 0)
+
+    def usage(self, key, now=None):
+        minute = current_minute(now)
+        kid = key_id(key)
+        with self.lock:
+            shared = self.snapshot.get(kid, {}) if self.snapshot_minute == minute else {}
+            local = self.pending.get(minute, {}).get(kid, [0, 0])
+            return {
+                "requests": shared.get("requests", 0) + local[0],
+                "tokens": shared.get("tokens", 0) + local[1],
+            }
+
+    def is_exhausted(self, key, now=None):
+        usage = self.usage(key, now)
+        return bool((self.rpm and usage["requests"] >= self.rpm) or (self.tpm and usage["tokens"] >= self.tpm))
+
+    def sync(self):
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        try:
+            for minute, counts in pending.items():
+                self.backend.increment(self.provider, minute, {kid: tuple(c) for kid, c in counts.items()})
+        except Exception as e:
+            # Put the counts back so the next sync retries them
+            with self.lock:
+                for minute, counts in pending.items():
+                    merged = self.pending.setdefault(minute, {})
+                    for kid, (requests, tokens) in counts.items():
+                        current = merged.setdefault(kid, [0, 0])
+                        current[0] += requests
+                        current[1] += tokens
+            raise e
+        minute = current_minute()
+        snapshot = self.backend.read(self.provider, minute)
+        with self.lock:
+            self.snapshot_minute = minute
+            self.snapshot = snapshot
+            self.snapshot_at = time.time()
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(self.sync_seconds)
+            try:
+                self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                print(f"Quota ledger sync failed for {self.provider}: {e}")
+
+    def utilization(self, keys=None):
+        """Current-minute usage per key id, with limits; `keys` adds keys that have no usage yet."""
+        minute = current_minute()
+        with self.lock:
+            usage = {kid: dict(u) for kid, u in self.snapshot.items()} if self.snapshot_minute == minute else {}
+            for kid, (requests, tokens) in self.pending.get(minute, {}).items():
+                entry = usage.setdefault(kid, {"requests": 0, "tokens": 0})
+                entry["requests"] += requests
+                entry["tokens"] += tokens
+            snapshot_age = round(time.time() - self.snapshot_at, 1) if self.snapshot_at else None
+        for key in keys or []:
+            usage.setdefault(key_id(key), {"requests": 0, "tokens": 0})
+        for entry in usage.values():
+            entry["requests_pct"] = round(100 * entry["requests"] / self.rpm, 1) if self.rpm else None
+            entry["tokens_pct"] = round(100 * entry["tokens"] / self.tpm, 1) if self.tpm else None
+        return {
+            "backend": self.backend.name,
+            "minute": datetime.utcfromtimestamp(minute).isoformat(),
+            "rpm_limit": self.rpm,
+            "tpm_limit": self.tpm,
+            "snapshot_age_seconds": snapshot_age,
+            "sync_errors": self.sync_errors,
+            "keys": usage,
+        }
+
+
+# One backend per process, shared by the Gemini and Mistral ledgers
+quota_backend = create_backend()
@@ -0,0 +1,91 @@
+import os
+import json
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# The reference quiz is the newest quiz of this student, unless a JSON file is configured
+REFERENCE_QUIZ_STUDENT_ID = os.getenv("REFERENCE_QUIZ_STUDENT_ID", "pulkitjhamb@gmail.com")
+REFERENCE_QUIZ_PATH = os.getenv("REFERENCE_QUIZ_PATH", "")  # file holding a JSON array of questions
+REFERENCE_QUIZ_MAX_QUESTIONS = int(os.getenv("REFERENCE_QUIZ_MAX_QUESTIONS", "5"))
+REFERENCE_QUIZ_REFRESH_SECONDS = int(os.getenv("REFERENCE_QUIZ_REFRESH_SECONDS", "300"))
+
+
+def compact_reference(questions, max_questions=REFERENCE_QUIZ_MAX_QUESTIONS):
+    """A few questions are enough to show the model the expected shape and tone."""
+    trimmed = []
+    for q in questions[:max_questions]:
+        trimmed.append({
+            "id": q.get("id"),
+            "text": q.get("text"),
+            "options": [
+                {"id": o.get("id"), "text": o.get("text"), "weights": o.get("weights")}
+                for o in q.get("options", [])
+            ],
+        })
+    return json.dumps(trimmed, separators=(",", ":"), ensure_ascii=False)
+
+
+class ReferenceQuizProvider:
+    """Caches the compact, pre-serialized reference quiz used in quiz generation prompts.
+
+    The Mongo source is re-checked at most every `refresh_seconds` with a
+    createdAt-only query; the full quiz is only re-read when a newer one exists.
+    Inserting a quiz for the reference student invalidates the cache right away.
+    """
+
+    def __init__(self, collection, student_id=REFERENCE_QUIZ_STUDENT_ID, path=REFERENCE_QUIZ_PATH,
+                 max_questions=REFERENCE_QUIZ_MAX_QUESTIONS, refresh_seconds=REFERENCE_QUIZ_REFRESH_SECONDS):
+        self.collection = collection
+        self.student_id = student_id
+        self.path = path
+        self.max_questions = max_questions
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self.serialized = None
+        self.version = None  # createdAt of the cached quiz, or the file mtime
+        self.checked_at = 0
+
+    def get_serialized(self):
+        with self.lock:
+            if time.time() - self.checked_at >= self.refresh_seconds:
+                try:
+                    self._refresh()
+                except Exception as e:
+                    # Keep serving the last good copy
+                    print(f"Reference quiz refresh failed: {e}")
+                self.checked_at = time.time()
+            return self.serialized
+
+    def invalidate(self):
+        with self.lock:
+            self.checked_at = 0
+
+    def notify_inserted(self, student_id):
+        if not self.path and student_id == self.student_id:
+            self.invalidate()
+
+    def _refresh(self):
+        if self.path:
+            version = os.path.getmtime(self.path)
+            if version != self.version:
+                with open(self.path) as f:
+                    questions = json.load(f)
+                self._store(questions, version)
+            return
+
+        latest = self.collection.find_one(
+            {"studentId": self.student_id}, {"createdAt": 1}, sort=[("createdAt", -1)]
+        )
+        if not latest or latest.get("createdAt") == self.version:
+            return
+        doc = self.collection.find_one({"_id": latest["_id"]}, {"questions": 1, "createdAt": 1})
+        if doc and doc.get("questions"):
+            self._store(doc["questions"], doc.get("createdAt"))
+
+    def _store(self, questions, version):
+        self.serialized = compact_reference(questions, self.max_questions)
+        self.version = version
+        print(f"Loaded reference quiz ({len(self.serialized)} chars, {min(len(questions), self.max_questions)} questions)")
@@ -0,0 +1,193 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))  # consecutive failures that open it
+LLM_BREAKER_RECOVERY_SECONDS = float(os.getenv("LLM_BREAKER_RECOVERY_SECONDS", "30"))  # open -> half-open after this
+LLM_BREAKER_HALF_OPEN_PROBES = int(os.getenv("LLM_BREAKER_HALF_OPEN_PROBES", "1"))  # trial calls let through at once
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", "0.5"))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", "8"))
+LLM_RETRY_BUDGET_RATIO = float(os.getenv("LLM_RETRY_BUDGET_RATIO", "0.2"))  # retries allowed per first attempt
+LLM_RETRY_BUDGET_MIN_RETRIES = int(os.getenv("LLM_RETRY_BUDGET_MIN_RETRIES", "10"))  # always allowed per window
+LLM_RETRY_BUDGET_WINDOW_SECONDS = float(os.getenv("LLM_RETRY_BUDGET_WINDOW_SECONDS", "60"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+TRANSITION_COUNTERS = {OPEN: "opened", HALF_OPEN: "half_opened", CLOSED: "closed"}
+
+BREAKERS = {}  # {name: CircuitBreaker}, for the diagnostics endpoint
+
+
+def backoff_delay(attempt, base=LLM_RETRY_BASE_SECONDS, cap=LLM_RETRY_MAX_SECONDS):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2**attempt)].
+
+    The jitter spreads the retries of requests that failed together, so they
+    don't hit the recovering API in one wave.
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker around one provider.
+
+    After `failure_threshold` consecutive failures the breaker opens and calls
+    are refused without touching the network. Once `recovery_seconds` have
+    passed it lets `half_open_probes` trial calls through: a success closes it,
+    a failure opens it again.
+    """
+
+    def __init__(self, name, failure_threshold=LLM_BREAKER_FAILURE_THRESHOLD,
+                 recovery_seconds=LLM_BREAKER_RECOVERY_SECONDS, half_open_probes=LLM_BREAKER_HALF_OPEN_PROBES):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.half_open_probes = half_open_probes
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probes = 0
+        self.changed_at = time.time()
+        self.counters = {"rejected": 0, "skipped": 0, "opened": 0, "half_opened": 0, "closed": 0}
+        BREAKERS[name] = self
+
+    def _transition(self, state):
+        # Caller holds self.lock
+        print(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        self.changed_at = time.time()
+        self.counters[TRANSITION_COUNTERS[state]] += 1
+
+    def available(self):
+        """Whether a call could be let through now; does not take a half-open probe slot."""
+        with self.lock:
+            if self.state == OPEN:
+                return time.time() - self.opened_at >= self.recovery_seconds
+            if self.state == HALF_OPEN:
+                return self.probes < self.half_open_probes
+            return True
+
+    def allow(self):
+        """Take permission for one call; every allowed call must end in record_success, record_failure
+        or record_skipped."""
+        with self.lock:
+            if self.state == OPEN and time.time() - self.opened_at >= self.recovery_seconds:
+                self._transition(HALF_OPEN)
+                self.probes = 0
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and self.probes < self.half_open_probes:
+                self.probes += 1
+                return True
+            self.counters["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            if self.state == HALF_OPEN:
+                self.probes = max(self.probes - 1, 0)
+                self._transition(CLOSED)
+
+    def record_skipped(self):
+        """The allowed call never reached the provider (e.g. no API key free): says nothing about its health."""
+        with self.lock:
+            self.counters["skipped"] += 1
+            if self.state == HALF_OPEN:
+                self.probes = max(self.probes - 1, 0)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self.probes = max(self.probes - 1, 0)
+                self.opened_at = time.time()
+                self._transition(OPEN)
+            elif self.state == CLOSED and self.failures >= self.failure_threshold:
+                self.opened_at = time.time()
+                self._transition(OPEN)
+
+    def stats(self):
+        with self.lock:
+            now = time.time()
+            return dict(
+                self.counters,
+                state=self.state,
+                consecutive_failures=self.failures,
+                seconds_in_state=round(now - self.changed_at, 1),
+                retry_in_seconds=round(max(self.opened_at + self.recovery_seconds - now, 0), 1) if self.state == OPEN else None,
+            )
+
+
+class RetryBudget:
+    """Caps retries at a fraction of first attempts over a sliding window.
+
+    During an outage every request wants to retry; the budget lets only
+    `ratio` retries per first attempt (plus a small floor) through, so retries
+    can't multiply the load on a struggling API.
+    """
+
+    def __init__(self, ratio=LLM_RETRY_BUDGET_RATIO, min_retries=LLM_RETRY_BUDGET_MIN_RETRIES,
+                 window_seconds=LLM_RETRY_BUDGET_WINDOW_SECONDS):
+        self.ratio = ratio
+        self.min_retries = min_retries
+        self.window_seconds = window_seconds
+        self.lock = threading.Lock()
+        self.requests = deque()
+        self.retries = deque()
+        self.counters = {"requests": 0, "retries": 0, "denied": 0}
+
+    def _trim(self, now):
+        # Caller holds self.lock
+        horizon = now - self.window_seconds
+        for events in (self.requests, self.retries):
+            while events and events[0] < horizon:
+                events.popleft()
+
+    def record_request(self):
+        with self.lock:
+            now = time.time()
+            self._trim(now)
+            self.requests.append(now)
+            self.counters["requests"] += 1
+
+    def try_retry(self):
+        """Spend one retry from the budget; False means the caller should give up now."""
+        with self.lock:
+            now = time.time()
+            self._trim(now)
+            if len(self.retries) >= self.min_retries + self.ratio * len(self.requests):
+                self.counters["denied"] += 1
+                return False
+            self.retries.append(now)
+            self.counters["retries"] += 1
+            return True
+
+    def stats(self):
+        with self.lock:
+            self._trim(time.time())
+            return dict(
+                self.counters,
+                window_seconds=self.window_seconds,
+                window_requests=len(self.requests),
+                window_retries=len(self.retries),
+                window_allowance=int(self.min_retries + self.ratio * len(self.requests)),
+            )
+
+
+# Shared by every LLM retry loop in the process
+llm_retry_budget = RetryBudget()
+
+
+def resilience_snapshot():
+    return {
+        "breakers": {name: breaker.stats() for name, breaker in BREAKERS.items()},
+        "retry_budget": llm_retry_budget.stats(),
+    }
@@ -0,0 +1,210 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LLM_LEASE_SECONDS = int(os.getenv("LLM_LEASE_SECONDS", "180"))  # a leader that died is taken over after this
+# A running leader renews its lease; renewals stop after this, so a hung leader's lease still lapses
+LLM_LEASE_MAX_SECONDS = int(os.getenv("LLM_LEASE_MAX_SECONDS", "900"))
+LLM_LEASE_RESULT_SECONDS = int(os.getenv("LLM_LEASE_RESULT_SECONDS", "15"))  # finished results are shared this long
+LLM_LEASE_POLL_SECONDS = float(os.getenv("LLM_LEASE_POLL_SECONDS", "0.5"))
+
+
+def flight_key(endpoint, student_id, inputs=None):
+    """(endpoint, student, input hash) key; inputs are hashed as canonical JSON."""
+    raw = json.dumps(inputs, sort_keys=True, separators=(",", ":"), default=str)
+    return f"{endpoint}:{student_id}:{hashlib.sha256(raw.encode('utf-8')).hexdigest()[:16]}"
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one computation per key at a time and hands its result to every concurrent caller.
+
+    Within a process, duplicates wait on the leader's event (for at most
+    max_seconds, then they run the computation themselves). Across workers,
+    the leader holds a lease document in `collection` and renews it while the
+    computation runs; other workers poll it and take the stored result when
+    the leader finishes, or take over the lease once it expires (the leader
+    died, or ran past max_seconds). Results must be JSON/BSON-serializable. Finished
+    results are kept for LLM_LEASE_RESULT_SECONDS so a retry that arrives just
+    after completion is answered too.
+    """
+
+    def __init__(self, collection, lease_seconds=LLM_LEASE_SECONDS, result_seconds=LLM_LEASE_RESULT_SECONDS,
+                 poll_seconds=LLM_LEASE_POLL_SECONDS, max_seconds=LLM_LEASE_MAX_SECONDS):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.max_seconds = max(max_seconds, lease_seconds)
+        self.result_seconds = result_seconds
+        self.poll_seconds = poll_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.lock = threading.Lock()
+        self.calls = {}  # {key: _Call} for computations running in this process
+        self.counters = {"leaders": 0, "local_shared": 0, "local_timeouts": 0, "remote_shared": 0, "takeovers": 0,
+                         "renewals": 0, "lease_errors": 0}
+
+    def do(self, key, fn):
+        """Return fn() for the first caller of `key`; concurrent callers get the same result (or exception)."""
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                self.counters["local_shared"] += 1
+        if not leader:
+            if not call.done.wait(self.max_seconds):
+                # The leader is stuck (same bound as a remote lease): stop waiting and run it here
+                print(f"Single-flight leader for {key} still running after {self.max_seconds}s, running it again")
+                self._count("local_timeouts")
+                return fn()
+            if call.error:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_with_lease(key, fn)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                self.calls.pop(key, None)
+            call.done.set()
+        return call.result
+
+    def _run_with_lease(self, key, fn):
+        token = str(uuid.uuid4())
+        while True:
+            try:
+                state, result = self._acquire(key, token)
+                if state == "busy":
+                    # Another worker is running it: wait for its result or for the lease to lapse
+                    state, result = self._wait_remote(key)
+            except Exception as e:
+                # Mongo trouble must not block the request: fall back to in-process coalescing only
+                print(f"Single-flight lease for {key} unavailable: {e}")
+                self._count("lease_errors")
+                return fn()
+            if state == "done":
+                self._count("remote_shared")
+                return result
+            if state == "acquired":
+                break
+
+        self._count("leaders")
+        stop = threading.Event()
+        threading.Thread(target=self._renew_loop, args=(key, token, stop), name="single-flight-renew",
+                         daemon=True).start()
+        try:
+            result = fn()
+        except Exception:
+            stop.set()
+            self._release(key, token)
+            raise
+        stop.set()
+        self._finish(key, token, result)
+        return result
+
+    def _renew_loop(self, key, token, stop):
+        """Keep the lease from expiring while the leader runs, up to max_seconds in total."""
+        last_renewal = time.time() + self.max_seconds - self.lease_seconds
+        while not stop.wait(self.lease_seconds / 3):
+            if time.time() > last_renewal:
+                print(f"Single-flight leader for {key} still running after {self.max_seconds}s, letting the lease lapse")
+                return
+            try:
+                renewed = self.collection.update_one(
+                    {"_id": key, "token": token, "status": "running"},
+                    {"$set": {"expiresAt": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+                )
+            except Exception as e:
+                print(f"Single-flight could not renew {key}: {e}")
+                self._count("lease_errors")
+                continue
+            if not renewed.matched_count:
+                return  # finished, released or taken over
+            self._count("renewals")
+
+    def _acquire(self, key, token):
+        """("acquired", None), ("done", result) or ("busy", None)."""
+        now = datetime.utcnow()
+        lease = {
+            "_id": key,
+            "status": "running",
+            "token": token,
+            "owner": self.owner,
+            "startedAt": now,
+            "expiresAt": now + timedelta(seconds=self.lease_seconds),
+        }
+        try:
+            self.collection.insert_one(lease)
+            return "acquired", None
+        except DuplicateKeyError:
+            pass
+        existing = self.collection.find_one({"_id": key})
+        if not existing:
+            return "busy", None  # finished and released in between; the next round inserts again
+        if existing["expiresAt"] > now:
+            if existing.get("status") == "done":
+                return "done", existing.get("result")
+            return "busy", None
+        # Expired but not swept yet (the TTL monitor runs once a minute): take it over,
+        # unless another worker got there first
+        taken = self.collection.replace_one({"_id": key, "expiresAt": existing["expiresAt"]}, lease)
+        if taken.modified_count:
+            self._count("takeovers")
+            return "acquired", None
+        return "busy", None
+
+    def _wait_remote(self, key):
+        while True:
+            time.sleep(self.poll_seconds)
+            doc = self.collection.find_one({"_id": key}, {"status": 1, "result": 1, "expiresAt": 1})
+            if not doc or doc["expiresAt"] <= datetime.utcnow():
+                return "retry", None
+            if doc.get("status") == "done":
+                return "done", doc.get("result")
+
+    def _finish(self, key, token, result):
+        try:
+            self.collection.update_one(
+                {"_id": key, "token": token},
+                {"$set": {
+                    "status": "done",
+                    "result": result,
+                    "expiresAt": datetime.utcnow() + timedelta(seconds=self.result_seconds),
+                }}
+            )
+        except Exception as e:
+            # Waiting workers will take over once the lease expires
+            print(f"Single-flight could not store result for {key}: {e}")
+            self._release(key, token)
+
+    def _release(self, key, token):
+        try:
+            self.collection.delete_one({"_id": key, "token": token})
+        except Exception as e:
+            print(f"Single-flight could not release {key}: {e}")
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters, in_flight=len(self.calls))
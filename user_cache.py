@@ -0,0 +1,94 @@
+import os
+import copy
+import threading
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "1") == "1"
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "5000"))
+# Short on purpose: other workers only see a write once their copy expires
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "30"))
+
+# Never cached: the password hash stays behind the login route's direct read
+PROFILE_PROJECTION = {"_id": 0, "password": 0}
+
+
+class UserProfileCache:
+    """Per-process cache of user profiles keyed by email.
+
+    Entries hold the whole profile (minus _id and password) and callers ask for
+    the fields they need, so one read serves every route. Writes must go through
+    invalidate(): a read that started before the write never re-populates the
+    entry it raced with.
+    """
+
+    def __init__(self, collection, maxsize=USER_CACHE_MAX_ENTRIES, ttl=USER_CACHE_TTL_SECONDS,
+                 enabled=USER_CACHE_ENABLED):
+        self.collection = collection
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.profiles = TTLCache(maxsize, ttl)
+        self.generations = {}  # {email: invalidation count}
+        self.epoch = 0  # bumped whenever generations is reset
+        self.counters = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, email, fields=None):
+        """Return a copy of the profile, limited to `fields` when given, or None if there is no such user."""
+        if not email:
+            return None
+        if not self.enabled:
+            return self._load(email, fields)
+
+        with self.lock:
+            profile = self.profiles.get(email)
+            if profile is not None:
+                self.counters["hits"] += 1
+                return self._project(profile, fields)
+            self.counters["misses"] += 1
+            generation = (self.epoch, self.generations.get(email, 0))
+
+        profile = self._load(email)
+        if profile is None:
+            return None
+        with self.lock:
+            if (self.epoch, self.generations.get(email, 0)) == generation:
+                self.profiles[email] = profile
+        return self._project(profile, fields)
+
+    def invalidate(self, email):
+        with self.lock:
+            self.profiles.pop(email, None)
+            self.generations[email] = self.generations.get(email, 0) + 1
+            self.counters["invalidations"] += 1
+            if len(self.generations) > self.profiles.maxsize:
+                # Only in-flight loads compare generations; the new epoch makes them all skip storing
+                self.generations.clear()
+                self.epoch += 1
+
+    def _load(self, email, fields=None):
+        if fields is None:
+            return self.collection.find_one({"email": email}, PROFILE_PROJECTION)
+        projection = {"_id": 0}
+        projection.update({field: 1 for field in fields})
+        return self.collection.find_one({"email": email}, projection)
+
+    def _project(self, profile, fields):
+        if fields is None:
+            return copy.deepcopy(profile)
+        return {field: copy.deepcopy(profile[field]) for field in fields if field in profile}
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            size = len(self.profiles)
+        lookups = counters["hits"] + counters["misses"]
+        return dict(
+            counters,
+            enabled=self.enabled,
+            size=size,
+            maxsize=self.profiles.maxsize,
+            ttl=self.profiles.ttl,
+            hit_rate=round(counters["hits"] / lookups, 3) if lookups else None,
+        )